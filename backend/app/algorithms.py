@@ -1,7 +1,9 @@
-from typing import List, Dict, Tuple, Set
+from typing import List, Dict, Tuple, Set, Literal
 from collections import deque
 import uuid
+import numpy as np
 from app.schemas import Cell, GardenZone
+from app import raster
 
 def sort_border_segments(
     border_set: Set[Tuple[Tuple[int, int], Tuple[int, int]]]
@@ -25,24 +27,25 @@ def sort_border_segments(
         start = next(iter(adjacency))
 
     ordered_points = [start]
-    prev = None
     curr = start
 
+    # Every segment is walked at most once, so outlines that touch themselves
+    # at a corner end the walk instead of circling one of their loops forever
     while True:
         neighbors = adjacency[curr]
-        next_pt = None
-        for neighbor in neighbors:
-            if neighbor != prev:
-                next_pt = neighbor
-                break
-        if not next_pt or next_pt == ordered_points[0]:
+        if not neighbors:
+            break
+        next_pt = neighbors.pop(0)
+        adjacency[next_pt].remove(curr)
+        if next_pt == ordered_points[0]:
             break
         ordered_points.append(next_pt)
-        prev, curr = curr, next_pt
+        curr = next_pt
 
     return ordered_points
 
-def group_cells_into_zones(cells: List[Cell]) -> List[GardenZone]:
+def group_cells_into_zones_bfs(cells: List[Cell]) -> List[GardenZone]:
+    # Reference implementation, kept for comparison with the raster engine
     # Index the cells by their (col, row) coordinates
     cell_map: Dict[Tuple[int, int], Cell] = {
         (int(cell.col), int(cell.row)): cell for cell in cells
@@ -105,3 +108,147 @@ def group_cells_into_zones(cells: List[Cell]) -> List[GardenZone]:
             zones.append(zone)
 
     return zones
+
+def group_cells_into_zones(
+    cells: List[Cell],
+    engine: Literal["raster", "bfs"] = "raster"
+) -> List[GardenZone]:
+    if engine == "bfs":
+        return group_cells_into_zones_bfs(cells)
+
+    cols = np.fromiter((int(cell.col) for cell in cells), dtype=np.int64, count=len(cells))
+    rows = np.fromiter((int(cell.row) for cell in cells), dtype=np.int64, count=len(cells))
+
+    keep = raster.deduplicate(cols, rows)
+    cells = [cells[i] for i in keep]
+    cols, rows = cols[keep], rows[keep]
+    codes, _ = raster.intern_attributes(
+        (cell.color for cell in cells),
+        (cell.palette_item_id for cell in cells),
+    )
+
+    zones: List[GardenZone] = []
+    for members, outer, holes in group_columns_into_zones(cols, rows, codes):
+        group = [cells[i] for i in members]
+        zones.append(GardenZone(
+            id=str(uuid.uuid4()),
+            display_name=None,
+            color=group[0].color,
+            coverage=group,
+            border_path=outer,
+            border_holes=holes
+        ))
+
+    return zones
+
+
+def group_columns_into_zones(
+    cols: np.ndarray,
+    rows: np.ndarray,
+    codes: np.ndarray
+) -> List[Tuple[np.ndarray, List[Tuple[int, int]], List[List[Tuple[int, int]]]]]:
+    """
+    The raster engine on arrays: one ``(indices of its cells, outer ring, holes)``
+    per zone, in the order the BFS would discover them. Positions must be unique
+    (see ``raster.deduplicate``). Paints that fit a dense grid are labeled and
+    traced on it; sparser ones are labeled from their sorted positions and
+    each zone is traced on its own bounding box.
+    """
+    if not raster.fits_dense_grid(cols, rows):
+        return _group_sparse_columns(cols, rows, codes)
+
+    grid, origin = raster.pack(cols, rows, codes)
+    labels, count = raster.label(grid)
+    cell_labels = labels[rows - origin[1], cols - origin[0]]
+
+    # Number zones in the order the BFS would discover them
+    _, first_seen = np.unique(cell_labels, return_index=True)
+    discovered = np.argsort(first_seen, kind="stable")
+    rank = np.empty(count, dtype=np.intp)
+    rank[discovered] = np.arange(count)
+    cell_labels = rank[cell_labels]
+
+    order = np.argsort(cell_labels, kind="stable")
+    starts = np.searchsorted(cell_labels[order], np.arange(count + 1))
+
+    rings = raster.trace_rings(labels, origin, count)
+    return [
+        (order[starts[z]:starts[z + 1]], *rings[k])
+        for z, k in enumerate(discovered.tolist())
+    ]
+
+
+def _group_sparse_columns(
+    cols: np.ndarray,
+    rows: np.ndarray,
+    codes: np.ndarray
+) -> List[Tuple[np.ndarray, List[Tuple[int, int]], List[List[Tuple[int, int]]]]]:
+    # Far-apart beds would make the shared grid mostly empty squares
+    cell_labels, count = raster.label_cells(cols, rows, codes)
+    _, first_seen = np.unique(cell_labels, return_index=True)
+    rank = np.empty(count, dtype=np.intp)
+    rank[np.argsort(first_seen, kind="stable")] = np.arange(count)
+    cell_labels = rank[cell_labels]
+
+    order = np.argsort(cell_labels, kind="stable")
+    starts = np.searchsorted(cell_labels[order], np.arange(count + 1))
+    zones = []
+    for z in range(count):
+        members = order[starts[z]:starts[z + 1]]
+        zones.append((members, *raster.component_rings(cols[members], rows[members])))
+    return zones
+
+
+def find_detached_pieces(
+    inside: np.ndarray,
+    changed: np.ndarray,
+    complete: bool
+) -> Tuple[np.ndarray, List[int]] | None:
+    # Decide, from a window around an edit, which parts of a zone got cut off.
+    # Only pieces next to a changed square can have been disconnected. A piece
+    # that does not reach the window's border is closed off from the rest of the
+    # zone. Returns None when two pieces leave the window and the window has to
+    # grow to tell whether they meet outside it.
+    grid = np.where(inside, 0, raster.EMPTY).astype(np.int32)
+    labels, count = raster.label(grid)
+    if count == 0:
+        return labels, []
+
+    near = changed.copy()
+    near[1:, :] |= changed[:-1, :]
+    near[:-1, :] |= changed[1:, :]
+    near[:, 1:] |= changed[:, :-1]
+    near[:, :-1] |= changed[:, 1:]
+    affected = set(np.unique(labels[near & inside]).tolist())
+
+    edge = np.concatenate([labels[0, :], labels[-1, :], labels[:, 0], labels[:, -1]])
+    leaving = set(np.unique(edge[edge != raster.EMPTY]).tolist())
+
+    if complete:
+        # The whole zone is in view, the biggest piece keeps its identity
+        keep = int(np.argmax(np.bincount(labels[inside])))
+        return labels, [k for k in range(count) if k != keep]
+
+    if len(affected & leaving) > 1:
+        return None
+    return labels, sorted(affected - leaving)
+
+
+def group_paint(
+    cols: np.ndarray,
+    rows: np.ndarray,
+    codes: np.ndarray,
+    palette: List[Tuple[str | None, str | None]]
+) -> List[Tuple[np.ndarray, np.ndarray, Tuple[str | None, str | None], List[Tuple[int, int]], List[List[Tuple[int, int]]] | None]]:
+    """
+    Group a paint given as columns, ``palette[codes[i]]`` painted at
+    ``(cols[i], rows[i])``, into ``(cols, rows, paint, outer ring, holes)``
+    per zone. Later cells win at the same position. Stays on arrays.
+    Only takes and returns plain data, so it can run in another process.
+    """
+    keep = raster.deduplicate(cols, rows)
+    cols, rows, codes = cols[keep], rows[keep], codes[keep]
+    return [
+        (cols[members], rows[members], tuple(palette[codes[members[0]]]), outer, holes)
+        for members, outer, holes in group_columns_into_zones(cols, rows, codes)
+    ]
@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Depends, HTTPException
+from app import schemas
+from app import crud
+from app.database import DbSession, open_session, run_sync
+
+router = APIRouter()
+
+# Larger edits should be split, the whole batch holds one transaction open
+MAX_OPERATIONS = 1000
+
+async def get_db():
+    async with open_session() as db:
+        yield db
+
+@router.post("/", response_model=list[schemas.BatchResult])
+async def apply_batch(payload: schemas.BatchRequest, db: DbSession = Depends(get_db)):
+    if len(payload.operations) > MAX_OPERATIONS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_OPERATIONS} operations per batch")
+    try:
+        return await run_sync(db, crud.apply_batch, payload.operations)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
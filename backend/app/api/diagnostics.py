@@ -0,0 +1,36 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app import metrics
+from app.cache import read_cache
+from app.database import pool_stats
+from app.feed import hub
+from app.jobs import zone_jobs
+
+# Counters of this server process for operators. Nothing here is authenticated,
+# main.py only serves the router with DIAGNOSTICS set.
+router = APIRouter()
+
+@router.get("/api/cache", tags=["Cache"])
+def cache_stats():
+    # Hit/miss counters of the in-process list cache
+    return read_cache.stats()
+
+@router.get("/api/jobs", tags=["Jobs"])
+def job_stats():
+    # Zone jobs by status, and how many were turned away by a full queue
+    return zone_jobs.stats()
+
+@router.get("/api/feed/stats", tags=["Feed"])
+def feed_stats():
+    # Connected feed clients and events published from this process
+    return hub.stats()
+
+@router.get("/api/pool", tags=["Pool"])
+def connection_pool_stats():
+    # Checked out and overflow connections, checkout waits and recycles, for sizing workers
+    return pool_stats()
+
+@router.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
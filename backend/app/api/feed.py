@@ -0,0 +1,43 @@
+from typing import List, Literal
+import asyncio
+from fastapi import APIRouter, Query
+from fastapi.responses import StreamingResponse
+from app import serialize
+from app.feed import COALESCE_SECONDS, HEARTBEAT_SECONDS, hub
+
+router = APIRouter()
+
+def _message(name: str, data) -> bytes:
+    return b"event: " + name.encode() + b"\ndata: " + serialize.dumps(data) + b"\n\n"
+
+async def _stream(kinds: list[str]):
+    subscription = hub.subscribe(kinds)
+    try:
+        # Anything written between the client's last load and now is in GET /api/sync?since=token
+        yield _message("ready", {"token": subscription.delivered_until.isoformat()})
+        while True:
+            batch = await subscription.next_batch(HEARTBEAT_SECONDS)
+            if batch is None:
+                # Keeps proxies from closing an idle connection and notices clients that left
+                yield b": ping\n\n"
+                continue
+            if batch[0]["op"] == "resync":
+                yield _message("resync", {"token": batch[0]["token"]})
+            else:
+                yield _message("changes", batch)
+            await asyncio.sleep(COALESCE_SECONDS)
+    finally:
+        hub.unsubscribe(subscription)
+
+@router.get("/", response_class=StreamingResponse, responses={200: {"content": {"text/event-stream": {}}}})
+async def change_feed(
+    kinds: List[Literal["items", "zones"]] = Query(default=["items", "zones"], description="Kinds of objects to receive changes of"),
+):
+    # Server-Sent Events: "changes" carries a JSON array of
+    # {"op": "upsert", "kind", "id", "data": summary} and {"op": "delete", "kind", "id"},
+    # "resync" means events were dropped, the client catches up with GET /api/sync?since=token
+    return StreamingResponse(
+        _stream(kinds),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,45 +1,135 @@
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from fastapi import APIRouter, Depends
+from datetime import datetime
+from typing import Literal
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from app import schemas
 from app import models
 from app import crud
-from app.database import SessionLocal
+from app.utils import parse_bbox, decode_cursor, encode_cursor
+from app import serialize
+from app.cache import read_cache
+from app.database import DbSession, open_session, pick_replica, run_sync
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
-def get_db():
-    db = SessionLocal()
-    try:
+# Largest page a client can ask for, bigger lists should use format=ndjson
+MAX_PAGE_SIZE = 1000
+
+async def get_db(request: Request):
+    # Lists and history read from a replica when one is configured, writes from the primary
+    async with open_session(pick_replica(request)) as db:
         yield db
-    finally:
-        db.close()
 
 @router.post("/", response_model=schemas.GardenItemRead)
-def create_item(item: schemas.GardenItemCreate, db: Session = Depends(get_db)):
-    print("CREATE ITEM CALLED with", item)
-    return crud.create_item(db, item)
+async def create_item(item: schemas.GardenItemCreate, db: DbSession = Depends(get_db)):
+    logger.debug("create item %s", item.id)
+    return await run_sync(db, crud.create_item, item)
+
+def _item_page(db: Session, viewport, zoom, view, after, limit, serializer) -> tuple[bytes, dict]:
+    items = crud.get_items(db, viewport, zoom, view, after, limit)
+    logger.debug("listed %d items", len(items))
+    headers = {}
+    if limit is not None and len(items) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(items[-1].last_modified, items[-1].id)
+    return serialize.encode_list(items, serializer), headers
+
+@router.get("/", response_model=list[schemas.GardenItemRead] | list[schemas.GardenItemSummary])
+async def get_items(
+    request: Request,
+    bbox: str | None = Query(default=None, description="Viewport as min_x,min_y,max_x,max_y in map pixels"),
+    zoom: float | None = Query(default=None, gt=0, description="Screen pixels per map pixel"),
+    view: Literal["full", "summary"] = Query(default="full", description="summary leaves out the coverage cells"),
+    limit: int | None = Query(default=None, ge=1, le=MAX_PAGE_SIZE, description="Page size, the next page token comes back in X-Next-Cursor"),
+    cursor: str | None = Query(default=None, description="X-Next-Cursor of the previous page"),
+    format: Literal["json", "ndjson"] = Query(default="json", description="ndjson streams one object per line"),
+    coverage_format: Literal["cells", "ranges"] = Query(default="cells", description="ranges sends the coverage as same-paint rectangles like B3:F9"),
+    db: DbSession = Depends(get_db)
+):
+    try:
+        viewport = parse_bbox(bbox)
+        after = decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    serializer = serialize.item_serializer(view, coverage_format)
+    version = await crud.request_version(request, db, "items")
+
+    if format == "ndjson":
+        if isinstance(db, AsyncSession):
+            rows = await crud.stream_items(db, viewport, zoom, view, after)
+            return StreamingResponse(serialize.ndjson_lines_async(rows, serializer), media_type="application/x-ndjson")
+        rows = crud.iter_items(db, viewport, zoom, view, after)
+        return StreamingResponse(serialize.ndjson_lines(rows, serializer), media_type="application/x-ndjson")
+
+    # Serve the encoded response of an identical query if nothing was written since
+    shape = (viewport, zoom, view, after, limit, coverage_format)
+    cached = read_cache.get("items", shape, version) if read_cache.enabled else None
+    if cached is not None:
+        body, headers = cached
+        return Response(content=body, media_type="application/json", headers=headers)
 
-@router.get("/", response_model=list[schemas.GardenItemRead])
-def get_items(db: Session = Depends(get_db)):
-    print("GET ITEMS CALLED with response:", crud.get_items(db))
-    return crud.get_items(db)
+    body, headers = await run_sync(db, _item_page, viewport, zoom, view, after, limit, serializer)
+    if read_cache.enabled:
+        read_cache.put("items", shape, version, body, headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
-@router.get("/{id}/history", response_model=list[schemas.GardenItemHistory])
-def get_item_history(id: str, db: Session = Depends(get_db)):
-    return db.query(models.GardenItemHistory).filter_by(garden_item_id=id).order_by(models.GardenItemHistory.last_modified.desc()).all()
+@router.get("/{id}/history", response_model=list[schemas.GardenItemHistory] | schemas.GardenItemHistory)
+async def get_item_history(
+    request: Request,
+    response: Response,
+    id: str,
+    at: datetime | None = Query(default=None, description="Return the single state recorded at or before this time"),
+    since: datetime | None = Query(default=None, alias="from", description="Oldest last_modified to include"),
+    until: datetime | None = Query(default=None, alias="to", description="Newest last_modified to include"),
+    limit: int | None = Query(default=None, ge=1, le=MAX_PAGE_SIZE, description="Page size, the next page token comes back in X-Next-Cursor"),
+    cursor: str | None = Query(default=None, description="X-Next-Cursor of the previous page"),
+    view: Literal["full", "summary"] = Query(default="full", description="summary leaves out the coverage cells"),
+    db: DbSession = Depends(get_db)
+):
+    # Read before the history, conditional_get puts it in the ETag
+    await crud.request_version(request, db, "items")
+    if at is not None:
+        state = await run_sync(db, crud.get_history_at, "items", id, at)
+        if state is None:
+            raise HTTPException(status_code=404, detail="No history recorded at that time")
+        return state
+
+    try:
+        after = decode_cursor(cursor)
+        entries = await run_sync(db, crud.get_history, "items", id, since, until, after[1] if after else None, limit, view)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if limit is not None and len(entries) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(entries[-1]["last_modified"], entries[-1]["id"])
+    return entries
+
+def _update_item(db: Session, id: str, payload: schemas.GardenItemUpdateWrapper, coverage_format):
+    db_item = crud.update_item(db, id, payload.updates, payload.operation)
+    if db_item is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    return serialize.FastJSONResponse(serialize.item_serializer("full", coverage_format)(db_item))
 
 @router.put("/{id}", response_model=schemas.GardenItemRead)
-def update_item(
+async def update_item(
     id: str,
     payload: schemas.GardenItemUpdateWrapper,
-    db: Session = Depends(get_db)
+    coverage_format: Literal["cells", "ranges"] = Query(default="cells", description="ranges sends the coverage as same-paint rectangles like B3:F9"),
+    db: DbSession = Depends(get_db)
 ):
-    db_item = crud.update_item(db, id, payload.updates, payload.operation)
-    return schemas.GardenItemRead.model_validate(db_item)
+    return await run_sync(db, _update_item, id, payload, coverage_format)
+
+def _delete_item(db: Session, id: str):
+    db_item = crud.delete_item(db, id)
+    if db_item is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    return serialize.FastJSONResponse(serialize.item_read(db_item))
 
 @router.delete("/{id}", response_model=schemas.GardenItemRead)
-def delete_item(id: str, db: Session = Depends(get_db)):
-    print(f"DELETE ITEM CALLED with id={id}")
-    return crud.delete_item(db, id)
+async def delete_item(id: str, db: DbSession = Depends(get_db)):
+    logger.debug("delete item %s", id)
+    return await run_sync(db, _delete_item, id)
 
 
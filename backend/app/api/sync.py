@@ -0,0 +1,47 @@
+from sqlalchemy.orm import Session
+from typing import Literal
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query
+from app import schemas
+from app import crud
+from app import serialize
+from app.database import DbSession, open_session, run_sync
+
+router = APIRouter()
+
+async def get_db():
+    # Always the primary: a replica lagging behind the token would lose changes for good
+    async with open_session() as db:
+        yield db
+
+def _changes(db: Session, since: datetime | None, view: Literal["full", "summary"], coverage_format: Literal["cells", "ranges"]) -> dict | None:
+    if since is not None and crud.sync_expired(db, since):
+        return None
+    changes = crud.get_changes(db, since, view)
+    item_serializer = serialize.item_serializer(view, coverage_format)
+    zone_serializer = serialize.zone_serializer(view, coverage_format)
+    # Same fields as schemas.SyncRead
+    return {
+        "token": changes["token"].isoformat(),
+        "items": [item_serializer(obj) for obj in changes["items"]],
+        "zones": [zone_serializer(obj) for obj in changes["zones"]],
+        "deleted": changes["deleted"],
+    }
+
+@router.get("/", response_model=schemas.SyncRead)
+async def sync(
+    since: str | None = Query(default=None, description="token of the previous sync, omit for everything"),
+    view: Literal["full", "summary"] = Query(default="full", description="summary leaves out the coverage cells"),
+    coverage_format: Literal["cells", "ranges"] = Query(default="cells", description="ranges sends the coverage as same-paint rectangles like B3:F9"),
+    db: DbSession = Depends(get_db)
+):
+    try:
+        since_time = datetime.fromisoformat(since) if since is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+    changes = await run_sync(db, _changes, since_time, view, coverage_format)
+    if changes is None:
+        # Deletions after the token may have been pruned, the client has to reload everything
+        raise HTTPException(status_code=410, detail="Sync token expired")
+    return serialize.FastJSONResponse(changes)
@@ -1,60 +1,269 @@
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime, timezone
+from typing import Literal
+import logging
+import numpy as np
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from app import schemas, models
 from app import crud
-from app.database import SessionLocal
-from app import algorithms
+from app.utils import parse_bbox, decode_cursor, encode_cursor, decode_columns, decode_grid
+from app import serialize
+from app.cache import read_cache
+from app.database import DbSession, open_session, pick_replica, run_sync
+from app.jobs import MIN_CELLS, RETRY_AFTER, QueueFull, zone_jobs
 
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
-def get_db():
-    db = SessionLocal()
-    try:
+# Largest page a client can ask for, bigger lists should use format=ndjson
+MAX_PAGE_SIZE = 1000
+
+async def get_db(request: Request):
+    # Lists and history read from a replica when one is configured, writes from the primary
+    async with open_session(pick_replica(request)) as db:
         yield db
-    finally:
-        db.close()
 
-@router.get("/", response_model=list[schemas.GardenZoneRead])
-def get_zones(db: Session = Depends(get_db)):
-    print("GET ZONES CALLED with response:", crud.get_zones(db))
-    return crud.get_zones(db)
+def _zone_page(db: Session, viewport, zoom, view, after, limit, serializer) -> tuple[bytes, dict]:
+    zones = crud.get_zones(db, viewport, zoom, view, after, limit)
+    logger.debug("listed %d zones", len(zones))
+    headers = {}
+    if limit is not None and len(zones) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(zones[-1].last_modified, zones[-1].id)
+    return serialize.encode_list(zones, serializer), headers
+
+@router.get("/", response_model=list[schemas.GardenZoneRead] | list[schemas.GardenZoneSummary])
+async def get_zones(
+    request: Request,
+    bbox: str | None = Query(default=None, description="Viewport as min_x,min_y,max_x,max_y in map pixels"),
+    zoom: float | None = Query(default=None, gt=0, description="Screen pixels per map pixel"),
+    view: Literal["full", "summary"] = Query(default="full", description="summary leaves out the coverage cells"),
+    limit: int | None = Query(default=None, ge=1, le=MAX_PAGE_SIZE, description="Page size, the next page token comes back in X-Next-Cursor"),
+    cursor: str | None = Query(default=None, description="X-Next-Cursor of the previous page"),
+    format: Literal["json", "ndjson"] = Query(default="json", description="ndjson streams one object per line"),
+    coverage_format: Literal["cells", "ranges"] = Query(default="cells", description="ranges sends the coverage as same-paint rectangles like B3:F9"),
+    db: DbSession = Depends(get_db)
+):
+    try:
+        viewport = parse_bbox(bbox)
+        after = decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    serializer = serialize.zone_serializer(view, coverage_format)
+    version = await crud.request_version(request, db, "zones")
+
+    if format == "ndjson":
+        if isinstance(db, AsyncSession):
+            rows = await crud.stream_zones(db, viewport, zoom, view, after)
+            return StreamingResponse(serialize.ndjson_lines_async(rows, serializer), media_type="application/x-ndjson")
+        rows = crud.iter_zones(db, viewport, zoom, view, after)
+        return StreamingResponse(serialize.ndjson_lines(rows, serializer), media_type="application/x-ndjson")
+
+    # Serve the encoded response of an identical query if nothing was written since
+    shape = (viewport, zoom, view, after, limit, coverage_format)
+    cached = read_cache.get("zones", shape, version) if read_cache.enabled else None
+    if cached is not None:
+        body, headers = cached
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    body, headers = await run_sync(db, _zone_page, viewport, zoom, view, after, limit, serializer)
+    if read_cache.enabled:
+        read_cache.put("zones", shape, version, body, headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@router.get("/zones/{id}/history", response_model=list[schemas.GardenZoneHistory] | schemas.GardenZoneHistory)
+async def get_zone_history(
+    request: Request,
+    response: Response,
+    id: str,
+    at: datetime | None = Query(default=None, description="Return the single state recorded at or before this time"),
+    since: datetime | None = Query(default=None, alias="from", description="Oldest last_modified to include"),
+    until: datetime | None = Query(default=None, alias="to", description="Newest last_modified to include"),
+    limit: int | None = Query(default=None, ge=1, le=MAX_PAGE_SIZE, description="Page size, the next page token comes back in X-Next-Cursor"),
+    cursor: str | None = Query(default=None, description="X-Next-Cursor of the previous page"),
+    view: Literal["full", "summary"] = Query(default="full", description="summary leaves out the coverage cells"),
+    db: DbSession = Depends(get_db)
+):
+    # Read before the history, conditional_get puts it in the ETag
+    await crud.request_version(request, db, "zones")
+    if at is not None:
+        state = await run_sync(db, crud.get_history_at, "zones", id, at)
+        if state is None:
+            raise HTTPException(status_code=404, detail="No history recorded at that time")
+        return state
+
+    try:
+        after = decode_cursor(cursor)
+        entries = await run_sync(db, crud.get_history, "zones", id, since, until, after[1] if after else None, limit, view)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if limit is not None and len(entries) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(entries[-1]["last_modified"], entries[-1]["id"])
+    return entries
+
+JOB_QUERY = Query(
+    default=None,
+    description="true runs the calculation as a job and answers 202 with its id at once, false never does, "
+                "unset runs paints of ZONE_JOB_MIN_CELLS cells and more as jobs",
+)
+
+def _wants_job(job: bool | None, cells: int) -> bool:
+    return job if job is not None else cells >= MIN_CELLS
+
+def _timestamp(value: float | None) -> datetime | None:
+    return datetime.fromtimestamp(value, timezone.utc) if value is not None else None
 
-@router.get("/zones/{id}/history", response_model=list[schemas.GardenZoneHistory])
-def get_zone_history(id: str, db: Session = Depends(get_db)):
-    return db.query(models.GardenZoneHistory).filter_by(garden_zone_id=id).order_by(models.GardenZoneHistory.last_modified.desc()).all()
+def _job_fields(job: dict) -> dict:
+    return {
+        **job,
+        "created_at": _timestamp(job["created_at"]),
+        "started_at": _timestamp(job["started_at"]),
+        "finished_at": _timestamp(job["finished_at"]),
+    }
 
-@router.post("/", response_model=list[schemas.GardenZoneRead])
-def calculate_zones(
+def _submit_job(display_name, cols, rows, codes, palette):
+    try:
+        job = zone_jobs.submit(display_name, cols, rows, codes, palette)
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(RETRY_AFTER)})
+    logger.info("queued zone job %s for %d cells", job["id"], job["cells"])
+    return serialize.FastJSONResponse(
+        _job_fields(job), status_code=202, headers={"Location": f"/api/zones/jobs/{job['id']}"}
+    )
+
+def _cell_columns(cells: list[schemas.Cell]):
+    palette = {}
+    codes = [palette.setdefault((cell.color, cell.palette_item_id), len(palette)) for cell in cells]
+    return (
+        np.array([cell.col for cell in cells], dtype=np.int64),
+        np.array([cell.row for cell in cells], dtype=np.int64),
+        np.array(codes, dtype=np.int64),
+        list(palette),
+    )
+
+@router.post(
+    "/",
+    response_model=list[schemas.GardenZoneRead],
+    responses={202: {"model": schemas.ZoneJob, "description": "Calculation queued as a job"}},
+)
+async def calculate_zones(
     payload: schemas.GardenZoneCreate,
-    db: Session = Depends(get_db)
+    job: bool | None = JOB_QUERY,
+    db: DbSession = Depends(get_db)
 ):
-    print("RECEIVED CELLS:", payload.cells)
+    logger.debug("calculate zones from %d cells", len(payload.cells))
+    if _wants_job(job, len(payload.cells)):
+        # A job saves every zone found, like POST /grid
+        return _submit_job(payload.display_name, *_cell_columns(payload.cells))
+    # Every zone found in one transaction, the same way as POST /grid and the jobs
+    return await run_sync(
+        db, _save_zone_columns, payload.display_name, *_cell_columns(payload.cells), serialize.zone_serializer("full", "cells")
+    )
 
-    # Use the grouping algorithm from algorithms.py
-    grouped_zones = algorithms.group_cells_into_zones(payload.cells)
+def _save_zone_columns(db: Session, display_name, cols, rows, codes, palette, serializer):
+    zones = crud.create_zones_from_columns(db, display_name, cols, rows, codes, palette)
+    zones = crud.get_zones_by_id(db, [zone.id for zone in zones])
+    return serialize.FastJSONResponse([serializer(zone) for zone in zones])
 
-    saved_zones = []
+@router.post(
+    "/grid",
+    response_model=list[schemas.GardenZoneRead] | list[schemas.GardenZoneSummary],
+    responses={202: {"model": schemas.ZoneJob, "description": "Calculation queued as a job"}},
+    openapi_extra={"requestBody": {"required": True, "content": {
+        "application/json": {"schema": {
+            "type": "object",
+            "required": ["display_name", "cols", "rows", "color_idx", "palette"],
+            "properties": {
+                "display_name": {"type": "string"},
+                "cols": {"type": "array", "items": {"type": "integer"}},
+                "rows": {"type": "array", "items": {"type": "integer"}},
+                "color_idx": {"type": "array", "items": {"type": "integer"}, "description": "Index into palette per cell"},
+                "palette": {"type": "array", "items": {"type": "array", "items": {"type": ["string", "null"]}}, "description": "[color, palette_item_id] pairs"},
+            },
+        }},
+        "application/octet-stream": {"schema": {
+            "type": "string",
+            "format": "binary",
+            "description": "GGR1, then little-endian int32 origin col and row, uint32 width, height and palette JSON "
+                           "length, the palette JSON, and width * height uint16 palette indices row by row, 65535 for empty",
+        }},
+    }}},
+)
+async def calculate_zones_from_grid(
+    request: Request,
+    display_name: str | None = Query(default=None, description="Name of the new zones, required with a binary body"),
+    view: Literal["full", "summary"] = Query(default="full", description="summary leaves out the coverage cells"),
+    coverage_format: Literal["cells", "ranges"] = Query(default="cells", description="ranges sends the coverage as same-paint rectangles like B3:F9"),
+    job: bool | None = JOB_QUERY,
+    db: DbSession = Depends(get_db)
+):
+    # Like POST /, from columns or a binary grid parsed straight into arrays
+    # instead of one validated object per cell, and saving every zone found
+    body = await request.body()
+    try:
+        if request.headers.get("content-type", "").startswith("application/octet-stream"):
+            cols, rows, codes, palette = decode_grid(body)
+        else:
+            payload = orjson.loads(body)
+            if not isinstance(payload, dict):
+                raise ValueError("Expected a JSON object")
+            display_name = payload.get("display_name", display_name)
+            cols, rows, codes, palette = decode_columns(payload)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if not isinstance(display_name, str):
+        raise HTTPException(status_code=422, detail="display_name is required")
 
-    for zone in grouped_zones:
-        zone.display_name = payload.display_name
-        saved_zone = crud.create_zone_with_cells(db, zone)
-        saved_zones.append(saved_zone)
+    logger.debug("calculate zones from %d columnar cells", len(cols))
+    if _wants_job(job, len(cols)):
+        return _submit_job(display_name, cols, rows, codes, palette)
+    serializer = serialize.zone_serializer(view, coverage_format)
+    return await run_sync(db, _save_zone_columns, display_name, cols, rows, codes, palette, serializer)
 
-        return saved_zones
+def _job_zones(db: Session, ids: list[str], serializer):
+    return [serializer(zone) for zone in crud.get_zones_by_id(db, ids)]
 
-@router.put("/{id}", response_model=schemas.GardenZoneRead)
-def update_zone(
+@router.get("/jobs/{id}", response_model=schemas.ZoneJob)
+async def get_zone_job(
     id: str,
-    payload: schemas.GardenZoneUpdateWrapper,
-    db: Session = Depends(get_db)
+    view: Literal["full", "summary"] | None = Query(default=None, description="Also return the zones of a finished job, in this view"),
+    coverage_format: Literal["cells", "ranges"] = Query(default="cells", description="ranges sends the coverage as same-paint rectangles like B3:F9"),
+    db: DbSession = Depends(get_db)
 ):
+    # Poll until status is done or failed; jobs are kept for ZONE_JOB_RETENTION seconds after
+    job = zone_jobs.get(id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    content = _job_fields(job)
+    if view is not None and job["status"] == "done":
+        content["zones"] = await run_sync(db, _job_zones, job["zone_ids"], serialize.zone_serializer(view, coverage_format))
+    return serialize.FastJSONResponse(content)
+
+def _update_zone(db: Session, id: str, payload: schemas.GardenZoneUpdateWrapper, coverage_format):
     updated_zone = crud.update_zone(db, id, payload.updates, payload.operation)
     if not updated_zone:
         raise HTTPException(status_code=404, detail="Zone not found")
-    return updated_zone
+    return serialize.FastJSONResponse(serialize.zone_serializer("full", coverage_format)(updated_zone))
+
+@router.put("/{id}", response_model=schemas.GardenZoneRead)
+async def update_zone(
+    id: str,
+    payload: schemas.GardenZoneUpdateWrapper,
+    coverage_format: Literal["cells", "ranges"] = Query(default="cells", description="ranges sends the coverage as same-paint rectangles like B3:F9"),
+    db: DbSession = Depends(get_db)
+):
+    return await run_sync(db, _update_zone, id, payload, coverage_format)
+
+def _delete_zone(db: Session, id: str):
+    db_zone = crud.delete_zone(db, id)
+    if db_zone is None:
+        raise HTTPException(status_code=404, detail="Zone not found")
+    return serialize.FastJSONResponse(serialize.zone_read(db_zone))
 
 @router.delete("/{id}", response_model=schemas.GardenZoneRead)
-def delete_zone(id: str, db: Session = Depends(get_db)):
-    print(f"DELETE ZONE CALLED with id={id}")
-    return crud.delete_zone(db, id)
+async def delete_zone(id: str, db: DbSession = Depends(get_db)):
+    logger.debug("delete zone %s", id)
+    return await run_sync(db, _delete_zone, id)
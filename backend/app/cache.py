@@ -0,0 +1,77 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Hashable, Tuple
+import os
+
+# Memory for cached list responses, in MB; 0 turns the cache off
+MAX_BYTES = int(float(os.getenv("READ_CACHE_MB", "64")) * 2**20)
+
+
+class ResponseCache:
+    """
+    LRU cache of encoded response bodies, bounded by their total size.
+
+    Entries belong to a kind ("items" or "zones") and are stored with the
+    version of that kind they were built from. A lookup with any other version
+    misses, so a write committed by another worker process is never served
+    stale; ``invalidate`` frees this process's entries right away.
+    """
+
+    def __init__(self, max_bytes: int = MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[Tuple[str, Hashable], Tuple[int, bytes, Dict[str, str]]] = OrderedDict()
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, kind: str, shape: Hashable, version: int) -> Tuple[bytes, Dict[str, str]] | None:
+        """The body and extra headers cached for ``shape`` at ``version``, if any."""
+        with self._lock:
+            entry = self._entries.get((kind, shape))
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((kind, shape))
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, kind: str, shape: Hashable, version: int, body: bytes, headers: Dict[str, str] | None = None):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop((kind, shape), None)
+            if old is not None:
+                self.size -= len(old[1])
+            self._entries[(kind, shape)] = (version, body, headers or {})
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def invalidate(self, kind: str):
+        """Drop every entry of ``kind``, called by the crud writes to it."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == kind]:
+                self.size -= len(self._entries.pop(key)[1])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+read_cache = ResponseCache()
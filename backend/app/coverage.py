@@ -0,0 +1,91 @@
+from typing import Iterable, List, Tuple
+import json
+import os
+import struct
+import zlib
+import numpy as np
+from app import raster
+
+# "rows" keeps one T_cells row per cell, "compact" stores each item's, zone's
+# and history entry's coverage as a single run-length encoded blob
+STORAGE = os.getenv("COVERAGE_STORAGE", "rows")
+
+_MAGIC = b"GCV1"
+_HEADER = struct.Struct("<II")  # palette JSON length, number of runs
+
+
+def encode(
+    cols: np.ndarray,
+    rows: np.ndarray,
+    colors: Iterable[str | None],
+    palette_item_ids: Iterable[str | None],
+) -> bytes:
+    """
+    Pack cells into row-wise runs of equal (color, palette_item_id).
+
+    The blob is the magic bytes followed by a zlib stream of: a small header,
+    the palette as JSON and one little-endian int32 ``(row, col, length, code)``
+    quadruple per run. Later cells win over earlier ones at the same position.
+    """
+    cols = np.asarray(cols, dtype=np.int64)
+    rows = np.asarray(rows, dtype=np.int64)
+    codes, palette = raster.intern_attributes(colors, palette_item_ids)
+
+    keep = raster.deduplicate(cols, rows)
+    cols, rows, codes = cols[keep], rows[keep], codes[keep]
+    order = np.lexsort((cols, rows))
+    cols, rows, codes = cols[order], rows[order], codes[order]
+
+    starts = np.flatnonzero(np.concatenate([
+        [True],
+        (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1] + 1) | (codes[1:] != codes[:-1]),
+    ])) if cols.size else np.zeros(0, dtype=np.intp)
+    lengths = np.diff(np.append(starts, cols.size))
+    runs = np.stack([rows[starts], cols[starts], lengths, codes[starts]], axis=1).astype("<i4")
+
+    palette_json = json.dumps(palette, separators=(",", ":")).encode()
+    payload = _HEADER.pack(len(palette_json), len(runs)) + palette_json + runs.tobytes()
+    return _MAGIC + zlib.compress(payload)
+
+
+def decode(blob: bytes) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Unpack a blob into ``(cols, rows, colors, palette_item_ids)`` arrays, in row-major order."""
+    if blob[:len(_MAGIC)] != _MAGIC:
+        raise ValueError("Not an encoded coverage blob")
+    payload = zlib.decompress(blob[len(_MAGIC):])
+    palette_length, run_count = _HEADER.unpack_from(payload)
+    offset = _HEADER.size
+    palette = json.loads(payload[offset:offset + palette_length])
+    offset += palette_length
+    runs = np.frombuffer(payload, dtype="<i4", count=run_count * 4, offset=offset).reshape(-1, 4)
+
+    row, col, length, code = (runs[:, i].astype(np.int64) for i in range(4))
+    total = int(length.sum())
+    run_starts = np.repeat(np.cumsum(length) - length, length)
+    cols = np.repeat(col, length) + (np.arange(total) - run_starts)
+    rows = np.repeat(row, length)
+
+    attributes = np.empty((len(palette), 2), dtype=object)
+    for i, (color, palette_item_id) in enumerate(palette):
+        attributes[i] = (color, palette_item_id)
+    codes = np.repeat(code, length)
+    return cols, rows, attributes[codes, 0], attributes[codes, 1]
+
+
+def encode_cells(cells: List) -> bytes:
+    """Encode schema or ORM cells."""
+    return encode(
+        np.fromiter((int(cell.col) for cell in cells), dtype=np.int64, count=len(cells)),
+        np.fromiter((int(cell.row) for cell in cells), dtype=np.int64, count=len(cells)),
+        [cell.color for cell in cells],
+        [cell.palette_item_id for cell in cells],
+    )
+
+
+def decode_cells(blob: bytes) -> List[dict]:
+    """Decode a blob into the ``{col, row, color, palette_item_id}`` dicts the API returns."""
+    cols, rows, colors, palette_item_ids = decode(blob)
+    return [
+        {"col": col, "row": row, "color": color, "palette_item_id": palette_item_id}
+        for col, row, color, palette_item_id in zip(cols.tolist(), rows.tolist(), colors, palette_item_ids)
+    ]
@@ -1,44 +1,246 @@
-from sqlalchemy.orm import Session
-from datetime import datetime
+from sqlalchemy.orm import Session, selectinload, raiseload, defer
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, func, inspect, or_, select, tuple_, update
+from datetime import datetime, timedelta
 from typing import Literal
-from app import models, schemas, algorithms
+from app import models, schemas, algorithms, raster, coverage, utils
+from app.utils import serialize_positions
+from app.cache import read_cache
+from app.database import run_sync
+from app import feed
+import logging
+import math
+import numpy as np
+import os
 import uuid
 
+logger = logging.getLogger(__name__)
 
-def get_items(db: Session) -> list[schemas.GardenItemRead]:
-    return db.query(models.GardenItem).all()
+# Rows per INSERT statement when writing coverage in bulk
+CELL_INSERT_CHUNK = 5000
 
-def create_item(db: Session, item: schemas.GardenItemCreate):
+
+def insert_cells(db: Session, cells: list[schemas.Cell], **owner: str) -> int:
+    """
+    Write coverage cells with chunked executemany INSERTs on the Core table,
+    skipping the ORM unit of work and the per-row ``set_serialized_cell``
+    listener. ``owner`` is the foreign key to set on every row, e.g.
+    ``garden_zone_id=zone.id``. The owner row must already be flushed.
+    """
+    return insert_cell_columns(
+        db,
+        np.fromiter((int(cell.col) for cell in cells), dtype=np.int64, count=len(cells)),
+        np.fromiter((int(cell.row) for cell in cells), dtype=np.int64, count=len(cells)),
+        [cell.color for cell in cells],
+        [cell.palette_item_id for cell in cells],
+        **owner,
+    )
+
+def insert_cell_columns(db: Session, cols: np.ndarray, rows: np.ndarray, colors, palette_item_ids, **owner) -> int:
+    """
+    ``insert_cells`` for cells given as parallel columns. Each ``owner`` value
+    is either one id for all rows or a list with the id of every cell.
+    """
+    if len(cols) == 0:
+        return 0
+    per_cell = {key: value for key, value in owner.items() if not isinstance(value, str)}
+    owner = {key: value for key, value in owner.items() if isinstance(value, str)}
+    serialized = serialize_positions(cols, rows)
+
+    # One random UUID per batch, rows are numbered within it
+    prefix = str(uuid.uuid4())[:24]
+    values = [
+        {
+            "id": f"{prefix}{i:012x}",
+            "col": col,
+            "row": row,
+            "color": color,
+            "palette_item_id": palette_item_id,
+            "serialized": label,
+            **owner,
+        }
+        for i, (col, row, color, palette_item_id, label) in enumerate(
+            zip(np.asarray(cols).tolist(), np.asarray(rows).tolist(), colors, palette_item_ids, serialized)
+        )
+    ]
+    for key, ids in per_cell.items():
+        for value, id in zip(values, ids):
+            value[key] = id
+    table = models.Cell.__table__
+    for start in range(0, len(values), CELL_INSERT_CHUNK):
+        db.execute(table.insert(), values[start:start + CELL_INSERT_CHUNK])
+    return len(values)
+
+def store_coverage(db: Session, owner, cells: list[schemas.Cell], **owner_key: str) -> None:
+    """
+    Write ``cells`` as the coverage of a new or emptied item or zone, either as
+    T_cells rows or as one blob depending on ``coverage.STORAGE``.
+    ``owner_key`` is passed on to ``insert_cells``.
+    """
+    if coverage.STORAGE == "compact":
+        owner.coverage_blob = coverage.encode_cells(cells)
+        return
+    owner.coverage_blob = None
+    if inspect(owner).pending:
+        # The rows reference a new owner, so insert it first. Existing owners are
+        # left unflushed, their history listener has to see the new rows.
+        db.flush()
+    insert_cells(db, cells, **owner_key)
+
+# Delta sync re-sends rows changed this long before the token, which covers
+# second-resolution timestamps and writes that commit after a sync has read
+SYNC_OVERLAP = timedelta(seconds=float(os.getenv("SYNC_OVERLAP_SECONDS", "5")))
+
+# Tombstones older than this are pruned, tokens from before the last prune need a full reload
+TOMBSTONE_RETENTION = timedelta(days=float(os.getenv("TOMBSTONE_RETENTION_DAYS", "30")))
+# T_versions row holding the cutoff of the last tombstone prune, in epoch seconds
+PRUNED_TOMBSTONES = "tombstones_pruned"
+# Token of a sync that found nothing at all
+SYNC_EPOCH = datetime(1970, 1, 2)
+
+
+# Objects narrower than this many screen pixels at the requested zoom are left out
+MIN_VISIBLE_PIXELS = 1.0
+
+# Rows fetched per round trip when streaming a list
+STREAM_BATCH = 200
+
+
+def _in_viewport(query, model, bbox: tuple[float, float, float, float] | None, zoom: float | None):
+    # Keep objects whose bounding box intersects ``bbox`` (map pixels) and that
+    # are big enough to see at ``zoom`` (screen pixels per map pixel)
+    if bbox is not None:
+        min_x, min_y, max_x, max_y = bbox
+        query = query.filter(
+            model.min_x <= max_x,
+            model.max_x >= min_x,
+            model.min_y <= max_y,
+            model.max_y >= min_y,
+        )
+    if zoom:
+        visible = MIN_VISIBLE_PIXELS / zoom
+        query = query.filter((model.max_x - model.min_x >= visible) | (model.max_y - model.min_y >= visible))
+    return query
+
+def with_coverage(query, model, view: Literal["full", "summary", "rows"] = "full"):
+    # "full" loads every owner's cells in one extra SELECT ... IN instead of one per owner,
+    # "summary" never touches the cells or the blob, "rows" leaves the cells to load_cells
+    if view == "summary":
+        return query.options(raiseload(model.coverage), defer(model.coverage_blob))
+    if view == "rows":
+        return query.options(raiseload(model.coverage))
+    return query.options(selectinload(model.coverage))
+
+# Owner ids per SELECT ... IN of load_cells, the same as selectinload
+LOAD_CELLS_CHUNK = 500
+# Columns of stroke neighbour positions per merge lookup
+NEIGHBOUR_CHUNK = 500
+
+def load_cells(db: Session, model, owners: list) -> list:
+    """
+    Read the T_cells coverage of ``owners``, queried with ``with_coverage(..., "rows")``,
+    into their ``loaded_cells`` as plain ``Cell`` dicts. It runs the same
+    SELECT ... IN as selectinload on the Core table, because building an ORM
+    object per cell is most of the time a large list takes.
+    """
+    owner_column = models.Cell.garden_item_id if model is models.GardenItem else models.Cell.garden_zone_id
+    by_owner = {}
+    for owner in owners:
+        if owner.coverage_blob is None:
+            owner.loaded_cells = by_owner[owner.id] = []
+    ids = list(by_owner)
+    columns = (owner_column, models.Cell.col, models.Cell.row, models.Cell.color, models.Cell.palette_item_id)
+    for start in range(0, len(ids), LOAD_CELLS_CHUNK):
+        rows = db.execute(select(*columns).where(owner_column.in_(ids[start:start + LOAD_CELLS_CHUNK])))
+        for owner_id, col, row, color, palette_item_id in rows:
+            by_owner[owner_id].append({"col": int(col), "row": int(row), "color": color, "palette_item_id": palette_item_id})
+    return owners
+
+def _keyset(query, model, after: tuple[datetime, str] | None, limit: int | None):
+    # Stable (last_modified, id) order, resuming strictly after the last row of the previous page
+    query = query.order_by(model.last_modified, model.id)
+    if after is not None:
+        last_modified, id = after
+        query = query.filter(or_(
+            model.last_modified > last_modified,
+            and_(model.last_modified == last_modified, model.id > id),
+        ))
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+def _list_query(db: Session, model, bbox, zoom, view, after, limit):
+    query = with_coverage(db.query(model), model, view)
+    return _keyset(_in_viewport(query, model, bbox, zoom), model, after, limit)
+
+def _list(db: Session, model, bbox, zoom, view, after, limit) -> list:
+    if view == "summary":
+        return _list_query(db, model, bbox, zoom, view, after, limit).all()
+    return load_cells(db, model, _list_query(db, model, bbox, zoom, "rows", after, limit).all())
+
+async def _stream(db: AsyncSession, model, bbox, zoom, view, after):
+    query = with_coverage(select(model), model, view)
+    query = _keyset(_in_viewport(query, model, bbox, zoom), model, after, None)
+    return await db.stream_scalars(query.execution_options(yield_per=STREAM_BATCH))
+
+def get_items(
+    db: Session,
+    bbox: tuple[float, float, float, float] | None = None,
+    zoom: float | None = None,
+    view: Literal["full", "summary"] = "full",
+    after: tuple[datetime, str] | None = None,
+    limit: int | None = None
+) -> list[schemas.GardenItemRead]:
+    return _list(db, models.GardenItem, bbox, zoom, view, after, limit)
+
+def iter_items(
+    db: Session,
+    bbox: tuple[float, float, float, float] | None = None,
+    zoom: float | None = None,
+    view: Literal["full", "summary"] = "full",
+    after: tuple[datetime, str] | None = None
+):
+    """Like ``get_items``, but streams rows from a server-side cursor in batches."""
+    return _list_query(db, models.GardenItem, bbox, zoom, view, after, None).yield_per(STREAM_BATCH)
+
+async def stream_items(
+    db: AsyncSession,
+    bbox: tuple[float, float, float, float] | None = None,
+    zoom: float | None = None,
+    view: Literal["full", "summary"] = "full",
+    after: tuple[datetime, str] | None = None
+):
+    """``iter_items`` for an AsyncSession, an async iterator over the same server-side cursor."""
+    return await _stream(db, models.GardenItem, bbox, zoom, view, after)
+
+def create_item(db: Session, item: schemas.GardenItemCreate, commit: bool = True):
     data = item.dict()
     x = data['position']['x']
     y = data['position']['y']
     data.pop('position')
 
-    # Handle coverage explicitly
-    coverage_data = data.pop('coverage', [])
-    db_cells = [
-        models.Cell(
-            id=str(uuid.uuid4()),
-            col=cell['col'],
-            row=cell['row'],
-            color=cell.get('color'),
-            palette_item_id=cell.get('palette_item_id'),
-        )
-        for cell in coverage_data
-    ]
+    data.pop('coverage', None)
 
-    # Now create the item
-    db_item = models.GardenItem(**data, x=x, y=y, coverage=db_cells)
+    # Now create the item, its coverage goes in through the bulk writer
+    db_item = models.GardenItem(**data, x=x, y=y)
     db.add(db_item)
-    db.commit()
-    db.refresh(db_item)
+    store_coverage(db, db_item, item.coverage or [], garden_item_id=db_item.id)
+    bump_version(db, "items")
+    feed.changed(db, "items", db_item)
+    if commit:
+        db.commit()
+        db.refresh(db_item)
+    else:
+        db.flush()
     return schemas.GardenItemRead.model_validate(db_item)
 
 def update_item(
     db: Session, 
     id: str, 
     updates: schemas.GardenItemUpdate, 
-    record: Literal["create", "modify"]
+    record: Literal["create", "modify"],
+    commit: bool = True
 ):
     # Set the history flag for event listener
     db.info["record_history"] = (record == "create")
@@ -61,62 +263,80 @@ def update_item(
     db_item.last_modified = datetime.now()
 
     if coverage_data is not None:
-        db.query(models.Cell).filter(models.Cell.garden_item_id == id).delete()
-        db_item.coverage.clear()
-        db.flush()
-        new_cells = [
-            models.Cell(
-                id=str(uuid.uuid4()),
-                col=cell['col'],
-                row=cell['row'],
-                color=cell.get('color'),
-                palette_item_id=cell.get('palette_item_id'),
-                garden_item_id=id
-            )
-            for cell in coverage_data
-        ]
-        db_item.coverage = new_cells
+        db.query(models.Cell).filter(models.Cell.garden_item_id == id).delete(synchronize_session=False)
+        store_coverage(db, db_item, updates.coverage, garden_item_id=id)
+        db.expire(db_item, ["coverage"])
 
-    db.commit()
-    db.refresh(db_item)
+    bump_version(db, "items")
+    feed.changed(db, "items", db_item)
+    if commit:
+        db.commit()
+        db.refresh(db_item)
+    else:
+        db.flush()
     return db_item
 
-def delete_item(db: Session, id: str):
+def delete_item(db: Session, id: str, commit: bool = True):
     db_item = db.query(models.GardenItem).filter(models.GardenItem.id == id).first()
     if db_item:
         db.delete(db_item)
-        db.commit()
+        record_tombstones(db, "item", [id])
+        bump_version(db, "items")
+        if commit:
+            db.commit()
+        else:
+            db.flush()
         return db_item
     return None
 
-def get_zones(db: Session):
-    return db.query(models.GardenZone).all()
+def get_zones(
+    db: Session,
+    bbox: tuple[float, float, float, float] | None = None,
+    zoom: float | None = None,
+    view: Literal["full", "summary"] = "full",
+    after: tuple[datetime, str] | None = None,
+    limit: int | None = None
+):
+    return _list(db, models.GardenZone, bbox, zoom, view, after, limit)
 
-def create_zone_with_cells(db: Session, zone: schemas.GardenZoneCreate):
-    # Convert Pydantic cells to SQLAlchemy models
-    db_cells = [
-        models.Cell(
-            id=str(uuid.uuid4()),
-            col=cell.col,
-            row=cell.row,
-            color=cell.color,
-            palette_item_id=cell.palette_item_id,
-        )
-        for cell in zone.coverage
-    ]
+def iter_zones(
+    db: Session,
+    bbox: tuple[float, float, float, float] | None = None,
+    zoom: float | None = None,
+    view: Literal["full", "summary"] = "full",
+    after: tuple[datetime, str] | None = None
+):
+    """Like ``get_zones``, but streams rows from a server-side cursor in batches."""
+    return _list_query(db, models.GardenZone, bbox, zoom, view, after, None).yield_per(STREAM_BATCH)
+
+async def stream_zones(
+    db: AsyncSession,
+    bbox: tuple[float, float, float, float] | None = None,
+    zoom: float | None = None,
+    view: Literal["full", "summary"] = "full",
+    after: tuple[datetime, str] | None = None
+):
+    """``iter_zones`` for an AsyncSession, an async iterator over the same server-side cursor."""
+    return await _stream(db, models.GardenZone, bbox, zoom, view, after)
 
-    # Now associate these with a new GardenZone
+def create_zone_with_cells(db: Session, zone: schemas.GardenZoneCreate, commit: bool = True):
     db_zone = models.GardenZone(
         id=zone.id,
         display_name=zone.display_name,
         color=zone.color,
-        coverage=db_cells,
-        border_path=zone.border_path
+        border_path=zone.border_path,
+        border_holes=zone.border_holes
     )
 
     db.add(db_zone)
-    db.commit()
-    db.refresh(db_zone)
+    store_coverage(db, db_zone, zone.coverage, garden_zone_id=db_zone.id)
+    bump_version(db, "zones")
+    feed.changed(db, "zones", db_zone)
+    if commit:
+        db.commit()
+        db.refresh(db_zone)
+    else:
+        db.flush()
 
     return schemas.GardenZoneRead.model_validate(db_zone)
 
@@ -125,13 +345,14 @@ def update_zone(
     db: Session,
     id: str,
     updates: schemas.GardenZoneUpdate,
-    record: Literal["create", "modify"]
+    record: Literal["create", "modify"],
+    commit: bool = True
 ):
     # Set the history flag for event listener
     db.info["record_history"] = (record == "create")
 
     timestamp = datetime.now()
-    print("CRUD now updating zone with id: ", id)
+    logger.debug("updating zone %s", id)
     db_zone = db.query(models.GardenZone).filter(models.GardenZone.id == id).first()
     if not db_zone:
         return None
@@ -140,53 +361,129 @@ def update_zone(
 
     soil_mix = updates_data.pop("soil_mix", None)
 
-    if isinstance(soil_mix, dict):
-        db_zone.sand = float(soil_mix["x"]) if "x" in soil_mix else None
-        db_zone.silt = float(soil_mix["y"]) if "y" in soil_mix else None
-        db_zone.clay = float(soil_mix["z"]) if "z" in soil_mix else None
-
     # Handle coverage update (Cells)
     if "coverage" in updates_data:
-        db.query(models.Cell).filter(models.Cell.garden_zone_id == db_zone.id).delete()
-        new_cells = [
-            models.Cell(
-                id=str(uuid.uuid4()),
-                col=cell["col"],
-                row=cell["row"],
-                color=cell["color"],
-                palette_item_id=cell["palette_item_id"],
-                garden_zone_id=db_zone.id
-            )
-            for cell in updates_data["coverage"]
-        ]
-        db.add_all(new_cells)
-
-        schema_cells = [
-            schemas.Cell(
-                col=cell.col,
-                row=cell.row,
-                color=cell.color,
-                palette_item_id=cell.palette_item_id
-            )
-            for cell in new_cells
-        ]
+        db.query(models.Cell).filter(models.Cell.garden_zone_id == db_zone.id).delete(synchronize_session=False)
+        schema_cells = updates.coverage or []
+        store_coverage(db, db_zone, schema_cells, garden_zone_id=db_zone.id)
+        db.expire(db_zone, ["coverage"])
+
         merged_zones = algorithms.group_cells_into_zones(schema_cells)
         if merged_zones:
             db_zone.border_path = merged_zones[0].border_path
+            db_zone.border_holes = merged_zones[0].border_holes
 
         updates_data.pop("coverage")
 
+    # Handle incremental coverage edits (brush strokes)
+    added = updates_data.pop("coverage_added", None)
+    removed = updates_data.pop("coverage_removed", None)
+    if added or removed:
+        apply_coverage_diff(
+            db,
+            db_zone,
+            [schemas.Cell(**cell) for cell in added or []],
+            [schemas.Cell(**cell) for cell in removed or []],
+        )
+
+    # Column changes go last, a flush while writing the coverage would
+    # otherwise record history before the new coverage exists
+    if isinstance(soil_mix, dict):
+        db_zone.sand = float(soil_mix["x"]) if "x" in soil_mix else None
+        db_zone.silt = float(soil_mix["y"]) if "y" in soil_mix else None
+        db_zone.clay = float(soil_mix["z"]) if "z" in soil_mix else None
+
     # Apply updates
     for key, value in updates_data.items():
         setattr(db_zone, key, value)
 
     db_zone.last_modified = timestamp
 
-    db.commit()
-    db.refresh(db_zone)
+    bump_version(db, "zones")
+    feed.changed(db, "zones", db_zone)
+    if commit:
+        db.commit()
+        db.refresh(db_zone)
+    else:
+        db.flush()
     return db_zone
 
 
+def create_zones_from_columns(
+    db: Session,
+    display_name: str,
+    cols: np.ndarray,
+    rows: np.ndarray,
+    codes: np.ndarray,
+    palette: list[tuple[str | None, str | None]],
+    commit: bool = True
+) -> list[models.GardenZone]:
+    """
+    Group a paint given as columns, ``palette[codes[i]]`` painted at
+    ``(cols[i], rows[i])``, into zones and save them all in one transaction.
+    """
+    return save_zone_groups(db, display_name, algorithms.group_paint(cols, rows, codes, palette), commit)
+
+def save_zone_groups(db: Session, display_name: str, groups: list[tuple], commit: bool = True) -> list[models.GardenZone]:
+    """
+    Save the zones of ``algorithms.group_paint``: one flush for the zones and
+    one chunked Core INSERT for all their cells, or a blob each in compact storage.
+    """
+    # Kept apart, reading them back from flushed zones would reload each zone
+    ids = [str(uuid.uuid4()) for _ in groups]
+    db_zones = [
+        models.GardenZone(
+            id=id,
+            display_name=display_name,
+            color=color,
+            border_path=outer,
+            border_holes=holes
+        )
+        for id, (_, _, (color, _), outer, holes) in zip(ids, groups)
+    ]
+    # A zone has a single paint
+    sizes = [len(zone_cols) for zone_cols, *_ in groups]
+    if coverage.STORAGE == "compact":
+        for db_zone, size, (zone_cols, zone_rows, (color, palette_item_id), _, _) in zip(db_zones, sizes, groups):
+            db_zone.coverage_blob = coverage.encode(zone_cols, zone_rows, [color] * size, [palette_item_id] * size)
+        db.add_all(db_zones)
+    else:
+        db.add_all(db_zones)
+        db.flush()
+        if groups:
+            paints = np.empty(len(groups), dtype=object)
+            paints[:] = [paint for _, _, paint, _, _ in groups]
+            paints = np.repeat(paints, sizes).tolist()
+            insert_cell_columns(
+                db,
+                np.concatenate([zone_cols for zone_cols, *_ in groups]),
+                np.concatenate([zone_rows for _, zone_rows, *_ in groups]),
+                [color for color, _ in paints],
+                [palette_item_id for _, palette_item_id in paints],
+                garden_zone_id=np.repeat(np.array(ids, dtype=object), sizes).tolist(),
+            )
+
+    bump_version(db, "zones")
+    feed.changed(db, "zones", *db_zones)
+    if commit:
+        db.commit()
+    else:
+        db.flush()
+    return db_zones
+
+def get_zones_by_id(db: Session, ids: list[str]) -> list[models.GardenZone]:
+    """
+    The zones with ``ids`` that still exist, in that order, their cells read by
+    ``load_cells``. Also reloads expired zones with a few SELECT ... IN rather
+    than a refresh each.
+    """
+    found = {}
+    for start in range(0, len(ids), LOAD_CELLS_CHUNK):
+        query = with_coverage(db.query(models.GardenZone), models.GardenZone, "rows")
+        for zone in query.filter(models.GardenZone.id.in_(ids[start:start + LOAD_CELLS_CHUNK])):
+            found[zone.id] = zone
+    return load_cells(db, models.GardenZone, [found[id] for id in ids if id in found])
+
 def get_zone_by_name(db: Session, name: str):
     return db.query(models.GardenZone).filter(models.GardenZone.display_name == name).first()
 
@@ -198,59 +495,584 @@ def deduplicate_cells(cells: list[schemas.Cell]) -> list[schemas.Cell]:
     return list(unique.values())
 
 def merge_cells_into_existing_zone(db: Session, existing_zone: models.GardenZone, new_zone: schemas.GardenZone):
-    # 1. Delete existing colored cells
-    db.query(models.Cell).filter(models.Cell.garden_zone_id == existing_zone.id).delete()
-
-    # 2. Merge and deduplicate cells
-    all_cells = [
-        schemas.Cell(
-            col=cell.col,
-            row=cell.row,
-            color=cell.color,
-            palette_item_id=cell.palette_item_id
+    apply_coverage_diff(db, existing_zone, new_zone.coverage, [])
+
+    bump_version(db, "zones")
+    db.commit()
+    db.refresh(existing_zone)
+
+    return existing_zone
+
+# Attributes a zone hands down to the pieces a stroke cuts off it
+SPLIT_ZONE_COLUMNS = (
+    "display_name", "color", "ph", "temp", "moisture", "sunshine", "compaction",
+    "sand", "silt", "clay", "t_watered", "dt_watered", "q_watered", "t_amended", "q_amended",
+)
+
+def _zone_rings(zone: models.GardenZone) -> list[list[tuple[int, int]]]:
+    return [
+        [tuple(point) for point in ring]
+        for ring in [zone.border_path or [], *(zone.border_holes or [])]
+        if ring
+    ]
+
+def _coverage_window(
+    load,
+    added_at: dict[tuple[int, int], schemas.Cell],
+    changed_at: list[tuple[int, int]],
+    stroke: tuple[int, int, int, int],
+    bounds: tuple[int, int, int, int],
+    local: bool
+):
+    # Load the zone's squares around a stroke, apply the stroke and find the
+    # pieces it cut off. The window doubles until that is decided, or covers
+    # the whole zone right away when there is no outline to splice into.
+    # ``load(window)`` returns the (col, row) pairs the zone has in a window.
+    margin = 1
+    while True:
+        window = (stroke[0] - margin, stroke[1] - margin, stroke[2] + margin, stroke[3] + margin)
+        if not local:
+            window = (
+                min(window[0], bounds[0] - 1), min(window[1], bounds[1] - 1),
+                max(window[2], bounds[2] + 1), max(window[3], bounds[3] + 1),
+            )
+        complete = (
+            window[0] < bounds[0] and window[1] < bounds[1]
+            and window[2] > bounds[2] and window[3] > bounds[3]
         )
-        for cell in existing_zone.coverage
-    ] + [
-        schemas.Cell(
-            col=cell.col,
-            row=cell.row,
-            color=cell.color,
-            palette_item_id=cell.palette_item_id
+        origin = (window[0], window[1])
+        shape = (window[3] - window[1] + 1, window[2] - window[0] + 1)
+
+        present = load(window)
+        inside = np.zeros(shape, dtype=bool)
+        inside[present[:, 1] - origin[1], present[:, 0] - origin[0]] = True
+        changed = np.zeros(shape, dtype=bool)
+        for col, row in changed_at:
+            changed[row - origin[1], col - origin[0]] = True
+            inside[row - origin[1], col - origin[0]] = (col, row) in added_at
+
+        decided = algorithms.find_detached_pieces(inside, changed, complete)
+        if decided is not None:
+            labels, detached = decided
+            if detached:
+                inside &= ~np.isin(labels, detached)
+            return origin, inside, labels, detached
+        margin *= 2
+
+def _position_keys(cols: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    return np.asarray(rows, dtype=np.int64) * (1 << 32) + np.asarray(cols, dtype=np.int64)
+
+def apply_coverage_diff(
+    db: Session,
+    db_zone: models.GardenZone,
+    added: list[schemas.Cell],
+    removed: list[schemas.Cell]
+) -> list[models.GardenZone]:
+    """
+    Paint ``added`` cells into a zone and erase ``removed`` ones, touching only
+    the rows at those positions. Zones with the same color and palette item
+    that the stroke connects to are merged in, pieces the stroke cuts off
+    become zones of their own (returned). The border is re-traced only in a
+    window around the stroke that grows until the zone's connectivity is known.
+    Zones stored as a coverage blob rewrite the blob and are not merged.
+    Does not commit.
+    """
+    Cell = models.Cell
+    added_at = {(int(cell.col), int(cell.row)): cell for cell in added}
+    removed_at = {(int(cell.col), int(cell.row)) for cell in removed} - added_at.keys()
+    changed_at = list(added_at.keys() | removed_at)
+    if not changed_at:
+        return []
+
+    cols = [col for col, _ in changed_at]
+    rows = [row for _, row in changed_at]
+    stroke = (min(cols), min(rows), max(cols), max(rows))
+    compact = db_zone.coverage_blob is not None
+
+    # Zones painted like the stroke and touching or overlapping it are merged into this one
+    neighbours = {
+        (col + dx, row + dy): cell
+        for (col, row), cell in added_at.items()
+        for dx, dy in ((0, 0), (-1, 0), (1, 0), (0, -1), (0, 1))
+    }
+    merged_ids = set()
+    if neighbours and not compact:
+        # Lookups of the exact positions on ix_T_cells_position, one column at a
+        # time; a bounding box of the stroke scans every cell in its rows and columns,
+        # and SQLite doesn't use an index for a (col, row) IN list
+        rows_by_col: dict[int, list[int]] = {}
+        for col, row in neighbours:
+            rows_by_col.setdefault(col, []).append(row)
+        columns = list(rows_by_col.items())
+        for start in range(0, len(columns), NEIGHBOUR_CHUNK):
+            candidates = (
+                db.query(Cell.col, Cell.row, Cell.color, Cell.palette_item_id, Cell.garden_zone_id)
+                .filter(
+                    or_(*(and_(Cell.col == col, Cell.row.in_(rows)) for col, rows in columns[start:start + NEIGHBOUR_CHUNK])),
+                    Cell.garden_zone_id.is_not(None),
+                    Cell.garden_zone_id != db_zone.id,
+                )
+            )
+            for col, row, color, palette_item_id, zone_id in candidates:
+                cell = neighbours[(int(col), int(row))]
+                if (cell.color, cell.palette_item_id) == (color, palette_item_id):
+                    merged_ids.add(zone_id)
+    merged_zones = (
+        db.query(models.GardenZone).filter(models.GardenZone.id.in_(merged_ids)).all()
+        if merged_ids else []
+    )
+    member_ids = [db_zone.id, *merged_ids]
+
+    if compact:
+        blob_cols, blob_rows, blob_colors, blob_palette_item_ids = coverage.decode(db_zone.coverage_blob)
+
+        def load(window):
+            within = (
+                (blob_cols >= window[0]) & (blob_cols <= window[2])
+                & (blob_rows >= window[1]) & (blob_rows <= window[3])
+            )
+            return np.stack([blob_cols[within], blob_rows[within]], axis=1)
+
+        def full_bounds():
+            if not blob_cols.size:
+                return None
+            return blob_cols.min(), blob_rows.min(), blob_cols.max(), blob_rows.max()
+    else:
+        def load(window):
+            return np.array(
+                db.query(Cell.col, Cell.row)
+                .filter(
+                    Cell.garden_zone_id.in_(member_ids),
+                    Cell.col.between(window[0], window[2]),
+                    Cell.row.between(window[1], window[3]),
+                )
+                .all(),
+                dtype=np.int64,
+            ).reshape(-1, 2)
+
+        def full_bounds():
+            lo_col, lo_row, hi_col, hi_row = (
+                db.query(func.min(Cell.col), func.min(Cell.row), func.max(Cell.col), func.max(Cell.row))
+                .filter(Cell.garden_zone_id.in_(member_ids))
+                .one()
+            )
+            return None if lo_col is None else (lo_col, lo_row, hi_col, hi_row)
+
+    # Zones saved before border_holes existed may carry a broken outline,
+    # rebuild those from the full coverage instead of splicing
+    rings = []
+    for zone in [db_zone, *merged_zones]:
+        if zone.border_holes is None:
+            rings = None
+            break
+        rings.extend(_zone_rings(zone))
+    points = [point for ring in rings or [] for point in ring]
+    if rings is None or not points:
+        bounds = tuple(int(value) for value in full_bounds() or stroke)
+        rings = []
+    else:
+        bounds = (
+            min(x for x, _ in points), min(y for _, y in points),
+            max(x for x, _ in points) - 1, max(y for _, y in points) - 1,
         )
-        for cell in new_zone.coverage
-    ]
+    bounds = (
+        min(bounds[0], stroke[0]), min(bounds[1], stroke[1]),
+        max(bounds[2], stroke[2]), max(bounds[3], stroke[3]),
+    )
 
-    all_cells = deduplicate_cells(all_cells)
+    # Separate zones are not connected to each other outside the window, so a
+    # merge is settled on the whole of the merged zones
+    if merged_ids:
+        rings = []
 
-    # 3. Insert new colored cells
-    new_db_cells = [
-        models.Cell(
+    try:
+        origin, inside, labels, detached = _coverage_window(
+            load, added_at, changed_at, stroke, bounds, bool(rings)
+        )
+        outer, holes = raster.splice_rings(rings, origin, inside)
+    except ValueError:
+        # The stored outline does not close, re-trace the whole zone
+        origin, inside, labels, detached = _coverage_window(
+            load, added_at, changed_at, stroke, bounds, False
+        )
+        outer, holes = raster.splice_rings([], origin, inside)
+
+    split_zones = []
+    pieces = []
+    for k in detached:
+        ys, xs = np.nonzero(labels == k)
+        piece_outer, piece_holes = raster.trace_rings(
+            np.where(labels == k, 0, raster.EMPTY), origin, 1
+        )[0]
+        split_zones.append(models.GardenZone(
             id=str(uuid.uuid4()),
-            col=cell.col,
-            row=cell.row,
-            color=cell.color,
-            palette_item_id=cell.palette_item_id,
-            garden_zone_id=existing_zone.id
+            **{column: getattr(db_zone, column) for column in SPLIT_ZONE_COLUMNS},
+            border_path=piece_outer,
+            border_holes=piece_holes,
+        ))
+        pieces.append((xs + origin[0], ys + origin[1]))
+
+    if compact:
+        # Rewrite the blob: drop the stroke's squares, append the painted ones
+        # and hand the cut-off pieces their own blobs
+        kept = ~np.isin(
+            _position_keys(blob_cols, blob_rows),
+            _position_keys([col for col, _ in changed_at], [row for _, row in changed_at]),
         )
-        for cell in all_cells
-    ]
-    db.add_all(new_db_cells)
+        new_cols = np.concatenate([blob_cols[kept], np.array([col for col, _ in added_at], dtype=np.int64)])
+        new_rows = np.concatenate([blob_rows[kept], np.array([row for _, row in added_at], dtype=np.int64)])
+        new_colors = np.concatenate([blob_colors[kept], np.array([cell.color for cell in added_at.values()], dtype=object)])
+        new_palette_item_ids = np.concatenate([
+            blob_palette_item_ids[kept],
+            np.array([cell.palette_item_id for cell in added_at.values()], dtype=object),
+        ])
+        for split_zone, (piece_cols, piece_rows) in zip(split_zones, pieces):
+            in_piece = np.isin(_position_keys(new_cols, new_rows), _position_keys(piece_cols, piece_rows))
+            split_zone.coverage_blob = coverage.encode(
+                new_cols[in_piece], new_rows[in_piece], new_colors[in_piece], new_palette_item_ids[in_piece]
+            )
+            new_cols, new_rows = new_cols[~in_piece], new_rows[~in_piece]
+            new_colors, new_palette_item_ids = new_colors[~in_piece], new_palette_item_ids[~in_piece]
+            db.add(split_zone)
+        db_zone.coverage_blob = coverage.encode(new_cols, new_rows, new_colors, new_palette_item_ids)
+    else:
+        # Rewrite only the rows under the stroke
+        db.query(Cell).filter(
+            Cell.garden_zone_id.in_(member_ids),
+            tuple_(Cell.col, Cell.row).in_(changed_at),
+        ).delete(synchronize_session=False)
+        insert_cells(db, list(added_at.values()), garden_zone_id=db_zone.id)
 
-    # 4. Recompute borders
-    merged_zones = algorithms.group_cells_into_zones(all_cells)
-    if merged_zones:
-        merged_zone = merged_zones[0]
-        existing_zone.border_path = merged_zone.border_path
+        if merged_ids:
+            db.query(Cell).filter(Cell.garden_zone_id.in_(merged_ids)).update(
+                {Cell.garden_zone_id: db_zone.id}, synchronize_session=False
+            )
+            db.query(models.GardenZone).filter(models.GardenZone.id.in_(merged_ids)).delete(
+                synchronize_session=False
+            )
+            record_tombstones(db, "zone", merged_ids)
 
-    db.commit()
-    db.refresh(existing_zone)
+        for split_zone, (piece_cols, piece_rows) in zip(split_zones, pieces):
+            db.add(split_zone)
+            db.flush()
+            db.query(Cell).filter(
+                Cell.garden_zone_id == db_zone.id,
+                tuple_(Cell.col, Cell.row).in_(list(zip(piece_cols.tolist(), piece_rows.tolist()))),
+            ).update({Cell.garden_zone_id: split_zone.id}, synchronize_session=False)
 
-    return existing_zone
+    db_zone.border_path = outer
+    db_zone.border_holes = holes
+    db.expire(db_zone, ["coverage"])
+    feed.changed(db, "zones", db_zone, *split_zones)
+    return split_zones
 
-def delete_zone(db: Session, id: str):
+def delete_zone(db: Session, id: str, commit: bool = True):
     db_item = db.query(models.GardenZone).filter(models.GardenZone.id == id).first()
     if db_item:
         db.delete(db_item)
-        db.commit()
+        record_tombstones(db, "zone", [id])
+        bump_version(db, "zones")
+        if commit:
+            db.commit()
+        else:
+            db.flush()
         return db_item
-    return None
\ No newline at end of file
+    return None
+
+def bump_version(db: Session, kind: Literal["items", "zones"]):
+    """
+    Advance the version of ``kind`` in the caller's transaction, so it changes
+    exactly when the write commits, and drop this process's cached reads of it.
+    """
+    version = models.Version.__table__
+    result = db.execute(
+        update(version).where(version.c.name == kind).values(version=version.c.version + 1)
+    )
+    if result.rowcount == 0:
+        db.execute(version.insert().values(name=kind, version=1))
+    read_cache.invalidate(kind)
+
+def get_version(connection, kind: Literal["items", "zones"]) -> int:
+    """Current version of ``kind``, with a single Core SELECT on a session or connection."""
+    version = models.Version.__table__
+    return connection.execute(
+        select(version.c.version).where(version.c.name == kind)
+    ).scalar() or 0
+
+async def request_version(request, db, kind: Literal["items", "zones"]) -> int:
+    """
+    ``get_version`` once per request, read before the response is built.
+    conditional_get leaves the version it compared in ``request.state.version``
+    and puts it in the ETag of the response.
+    """
+    version = getattr(request.state, "version", None)
+    if version is None:
+        version = request.state.version = await run_sync(db, get_version, kind)
+    return version
+
+def _history_entry(state: dict) -> dict:
+    # A replayed history state in the shape of the history schemas
+    entry = dict(state)
+    if state["coverage"] is not None:
+        entry["coverage"] = [
+            {"col": col, "row": row, "color": color, "palette_item_id": palette_item_id}
+            for (col, row), (color, palette_item_id) in state["coverage"].items()
+        ]
+    if "x" in entry:
+        entry["position"] = {"x": entry["x"], "y": entry["y"]}
+        if entry.get("location") is None:
+            entry["location"] = utils.calculate_location(entry["x"], entry["y"])
+    return entry
+
+def get_history(
+    db: Session,
+    kind: Literal["items", "zones"],
+    id: str,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    after: str | None = None,
+    limit: int | None = None,
+    view: Literal["full", "summary"] = "full"
+) -> list[dict]:
+    """
+    History entries of an item or zone, newest first, optionally within
+    ``since``..``until`` and resuming after the entry with id ``after``.
+    The summary view leaves out the coverage.
+    """
+    chain = models.item_history if kind == "items" else models.zone_history
+    connection = db.connection()
+    after_row = None
+    if after is not None:
+        after_row = chain.find(connection, id, after)
+        if after_row is None:
+            raise ValueError("Invalid cursor")
+    states = chain.page(connection, id, since, until, after_row, limit, view == "full")
+    return [_history_entry(state) for state in states]
+
+def get_history_at(db: Session, kind: Literal["items", "zones"], id: str, at: datetime) -> dict | None:
+    """The item or zone as its newest history entry at or before ``at`` recorded it."""
+    chain = models.item_history if kind == "items" else models.zone_history
+    state = chain.state_at(db.connection(), id, at)
+    return _history_entry(state) if state is not None else None
+
+def record_tombstones(db: Session, kind: Literal["item", "zone"], ids: list[str]):
+    """Remember deleted objects for delta sync and prune expired tombstones."""
+    db.add_all([models.Tombstone(kind=kind, object_id=id) for id in ids])
+    feed.deleted(db, f"{kind}s", ids)
+    cutoff = datetime.now() - TOMBSTONE_RETENTION
+    # Rounded up so a token in the same second as the cutoff counts as before it
+    watermark = math.ceil(cutoff.timestamp())
+    pruned = db.query(models.Tombstone).filter(
+        models.Tombstone.deleted_at < cutoff
+    ).delete(synchronize_session=False)
+    if pruned:
+        # Tokens from before the cutoff may have missed these deletions
+        version = models.Version.__table__
+        result = db.execute(
+            update(version).where(version.c.name == PRUNED_TOMBSTONES).values(version=watermark)
+        )
+        if result.rowcount == 0:
+            db.execute(version.insert().values(name=PRUNED_TOMBSTONES, version=watermark))
+
+def sync_expired(db: Session, since: datetime) -> bool:
+    """Whether tombstones a client with token ``since`` hasn't seen may have been pruned."""
+    return since.timestamp() < get_version(db, PRUNED_TOMBSTONES)
+
+def get_changes(db: Session, since: datetime | None, view: Literal["full", "summary"] = "full") -> dict:
+    """
+    Items and zones changed since ``since`` plus the ids deleted since then,
+    everything when ``since`` is None. Changed rows overlap a little with the
+    previous call, so clients must apply them as upserts, after the deletions.
+
+    ``token`` is the newest time stamped on what was read, never the clock of
+    this process, so a row stamped behind it by a skewed clock isn't skipped.
+    """
+    changes = {"items": [], "zones": [], "deleted": {"items": [], "zones": []}}
+    newest = [since or SYNC_EPOCH]
+    for key, model in (("items", models.GardenItem), ("zones", models.GardenZone)):
+        query = with_coverage(db.query(model), model, "summary" if view == "summary" else "rows")
+        if since is not None:
+            query = query.filter(model.last_modified >= since - SYNC_OVERLAP)
+        changes[key] = query.order_by(model.last_modified, model.id).all()
+        if changes[key]:
+            newest.append(changes[key][-1].last_modified)
+        if view != "summary":
+            load_cells(db, model, changes[key])
+
+    if since is not None:
+        tombstones = (
+            db.query(models.Tombstone.kind, models.Tombstone.object_id, models.Tombstone.deleted_at)
+            .filter(models.Tombstone.deleted_at >= since - SYNC_OVERLAP)
+            .all()
+        )
+        for kind, object_id, deleted_at in tombstones:
+            changes["deleted"][f"{kind}s"].append(object_id)
+            newest.append(deleted_at)
+    else:
+        # A full load has no deletions to send, the token still moves past them
+        newest.append(db.query(func.max(models.Tombstone.deleted_at)).scalar() or SYNC_EPOCH)
+        # and past the last prune, or it would be expired right away
+        pruned = get_version(db, PRUNED_TOMBSTONES)
+        if pruned:
+            newest.append(datetime.fromtimestamp(pruned))
+    changes["token"] = max(newest)
+    return changes
+
+def backfill_bounds(db: Session) -> int:
+    """Fill in bounding boxes of rows saved before they were tracked."""
+    count = 0
+    for model in (models.GardenItem, models.GardenZone):
+        for obj in db.query(model).filter(model.min_x.is_(None)).all():
+            if model is models.GardenItem:
+                bounds = utils.item_bounds(obj.x, obj.y, obj.width, obj.height, obj.rotation)
+            else:
+                bounds = utils.ring_bounds(obj.border_path)
+            if bounds is None:
+                continue
+            db.execute(
+                update(model)
+                .where(model.id == obj.id)
+                .values(
+                    min_x=bounds[0], min_y=bounds[1], max_x=bounds[2], max_y=bounds[3],
+                    last_modified=model.last_modified,
+                )
+            )
+            count += 1
+    db.commit()
+    return count
+
+def _bulk_update_items(db: Session, pending: list[tuple], results: list) -> None:
+    """
+    Apply consecutive item updates without coverage with one SELECT and one
+    executemany UPDATE, then record history once per object (apply_batch
+    lets an object be updated once per batch). ``pending`` holds
+    ``(index, updates, record)`` tuples.
+    """
+    ids = {updates.id for _, updates, _ in pending}
+    objects = {
+        obj.id: obj for obj in
+        db.query(models.GardenItem)
+        .options(selectinload(models.GardenItem.coverage))
+        .filter(models.GardenItem.id.in_(ids))
+    }
+    columns = models.GardenItem.__table__.c
+    timestamp = datetime.now()
+    touched: dict[str, bool] = {}
+    for index, updates, record in pending:
+        db_item = objects.get(updates.id)
+        if db_item is None:
+            results[index] = {"index": index, "status": 404, "detail": "Item not found"}
+            continue
+        values = updates.dict(exclude_unset=True)
+        position = values.pop("position", None)
+        if position is not None:
+            values["x"], values["y"] = position["x"], position["y"]
+        values["last_modified"] = timestamp
+        for key, value in values.items():
+            if key in columns and key != "id":
+                set_committed_value(db_item, key, value)
+        # Bulk statements skip the mapper listeners, so the bounds are set here
+        if None not in (db_item.x, db_item.y, db_item.width, db_item.height):
+            bounds = utils.item_bounds(db_item.x, db_item.y, db_item.width, db_item.height, db_item.rotation)
+            for key, value in zip(("min_x", "min_y", "max_x", "max_y"), bounds):
+                set_committed_value(db_item, key, value)
+        touched[db_item.id] = touched.get(db_item.id, False) or record
+        results[index] = {"index": index, "status": 200, "data": schemas.GardenItemRead.model_validate(db_item)}
+    if not touched:
+        return
+
+    # Every row carries the same keys, so this is a single executemany by primary key
+    changed = [column.name for column in columns if column.name not in ("id", "coverage_blob")]
+    db.execute(
+        update(models.GardenItem),
+        [{name: getattr(objects[id], name) for name in ("id", *changed)} for id in touched],
+    )
+    connection = db.connection()
+    for id, record in touched.items():
+        if record and not db.info.get(f"_history_created_for_{id}"):
+            db.info[f"_history_created_for_{id}"] = True
+            models.item_history.record(connection, objects[id])
+    bump_version(db, "items")
+    feed.changed(db, "items", *(objects[id] for id in touched))
+
+def _apply_operation(db: Session, index: int, operation: schemas.BatchOperation) -> dict:
+    # One batch operation through the regular write functions, without committing
+    data = dict(operation.data or {})
+    if operation.id is not None:
+        data["id"] = operation.id
+
+    if operation.kind == "item":
+        if operation.op == "create":
+            return {"index": index, "status": 201, "data": create_item(db, schemas.GardenItemCreate(**data), commit=False)}
+        if operation.op == "update":
+            db_item = update_item(db, operation.id, schemas.GardenItemUpdate(**data), operation.operation, commit=False)
+            if db_item is None:
+                return {"index": index, "status": 404, "detail": "Item not found"}
+            return {"index": index, "status": 200, "data": schemas.GardenItemRead.model_validate(db_item)}
+        if delete_item(db, operation.id, commit=False) is None:
+            return {"index": index, "status": 404, "detail": "Item not found"}
+        return {"index": index, "status": 200, "data": {"id": operation.id}}
+
+    if operation.op == "create":
+        payload = schemas.GardenZoneCreate(**data)
+        created = []
+        for zone in algorithms.group_cells_into_zones(payload.cells):
+            zone.display_name = payload.display_name
+            created.append(create_zone_with_cells(db, zone, commit=False))
+        return {"index": index, "status": 201, "data": created}
+    if operation.op == "update":
+        db_zone = update_zone(db, operation.id, schemas.GardenZoneUpdate(**data), operation.operation, commit=False)
+        if db_zone is None:
+            return {"index": index, "status": 404, "detail": "Zone not found"}
+        return {"index": index, "status": 200, "data": schemas.GardenZoneRead.model_validate(db_zone)}
+    if delete_zone(db, operation.id, commit=False) is None:
+        return {"index": index, "status": 404, "detail": "Zone not found"}
+    return {"index": index, "status": 200, "data": {"id": operation.id}}
+
+def apply_batch(db: Session, operations: list[schemas.BatchOperation]) -> list[dict]:
+    """
+    Apply create, update and delete operations on items and zones in order, in
+    one transaction. Runs of item updates that leave the coverage alone go out
+    as a single bulk UPDATE. Operations on missing objects report 404 without
+    failing the batch; any other error, invalid data included, rolls everything
+    back and is raised as ``ValueError`` naming the operation.
+
+    History is recorded once per object and transaction, so an object may be
+    updated by one operation of a batch only; a second update is rejected
+    rather than leaving out its history entry.
+    """
+    results: list = [None] * len(operations)
+    pending: list[tuple] = []
+    updated: set[tuple[str, str]] = set()
+    try:
+        for index, operation in enumerate(operations):
+            if operation.id is None and operation.op != "create":
+                raise ValueError(f"{operation.op} needs an id")
+            if operation.op == "update":
+                if (operation.kind, operation.id) in updated:
+                    raise ValueError(f"{operation.kind} {operation.id} is updated by an earlier operation, merge the updates")
+                updated.add((operation.kind, operation.id))
+            if (
+                operation.kind == "item" and operation.op == "update"
+                and "coverage" not in (operation.data or {})
+            ):
+                # The operation's id wins over one in the data, as in _apply_operation
+                data = dict(operation.data or {})
+                data["id"] = operation.id
+                updates = schemas.GardenItemUpdate(**data)
+                pending.append((index, updates, operation.operation == "create"))
+                continue
+            if pending:
+                _bulk_update_items(db, pending, results)
+                pending = []
+            results[index] = _apply_operation(db, index, operation)
+        if pending:
+            _bulk_update_items(db, pending, results)
+        db.commit()
+    except ValueError as e:
+        # pydantic's ValidationError is a ValueError too
+        db.rollback()
+        raise ValueError(f"Operation {index}: {e}") from e
+    finally:
+        db.info.pop("record_history", None)
+    return results
@@ -1,19 +1,258 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import DeclarativeBase, sessionmaker
+from contextlib import asynccontextmanager
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import DeclarativeBase, Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.concurrency import run_in_threadpool
+import itertools
 import os
+import time
 from dotenv import load_dotenv
+from app.pool_metrics import PoolMetrics, timed_pool
+from app.metrics import watch_engine
+from app import profiling
 
 load_dotenv()
 
-SQLALCHEMY_DATABASE_URL = (
+# DATABASE_URL overrides the MariaDB settings, e.g. sqlite:///garden.db for local runs
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL") or (
     f"mysql+pymysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
 )
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, echo=False, future=True)
+# Pool sizing per engine and process. Connections older than POOL_RECYCLE seconds
+# are reopened on checkout, before MariaDB's wait_timeout closes them server-side,
+# and pre-ping replaces connections that died anyway.
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+
+def pool_options(url: str, pool_class, metrics: PoolMetrics) -> dict:
+    if make_url(url).get_backend_name() == "sqlite" and make_url(url).database in (None, "", ":memory:"):
+        # In-memory SQLite keeps its single-connection pool
+        return {}
+    return {
+        "poolclass": timed_pool(pool_class, metrics),
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": POOL_PRE_PING,
+    }
+
+
+pool_metrics = PoolMetrics()
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, echo=False, future=True,
+    **pool_options(SQLALCHEMY_DATABASE_URL, QueuePool, pool_metrics),
+)
+
+
+def watch(engine, metrics: PoolMetrics):
+    # Pool counters, request metrics and, with PROFILING on, statement recording
+    metrics.watch(engine)
+    watch_engine(engine)
+    if profiling.ENABLED:
+        profiling.watch_engine(engine)
+
+
+watch(engine, pool_metrics)
 
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
 
+# "async" serves requests from an AsyncSession, so a request waiting on the
+# database no longer holds one of the threadpool's workers. "sync" keeps the
+# blocking PyMySQL sessions. Schema updates at startup always use the sync engine.
+DB_MODE = os.getenv("DB_MODE", "sync")
+
+# Async driver replacing the sync one of DATABASE_URL, ASYNC_DATABASE_URL overrides it
+ASYNC_DRIVERS = {
+    "mysql": "mysql+asyncmy",
+    "mysql+pymysql": "mysql+asyncmy",
+    "mariadb": "mariadb+asyncmy",
+    "mariadb+pymysql": "mariadb+asyncmy",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+
+def async_database_url(url: str) -> str:
+    parsed = make_url(url)
+    return parsed.set(drivername=ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername)).render_as_string(hide_password=False)
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_database_url(SQLALCHEMY_DATABASE_URL)
+async_pool_metrics = PoolMetrics()
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, echo=False,
+    **pool_options(ASYNC_DATABASE_URL, AsyncAdaptedQueuePool, async_pool_metrics),
+) if DB_MODE == "async" else None
+if async_engine is not None:
+    watch(async_engine.sync_engine, async_pool_metrics)
+
+# Objects stay loaded after commit, reading an expired attribute would need IO outside run_sync
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+) if async_engine is not None else None
+
+DbSession = Session | AsyncSession
+
+
+# Read replicas for the GET routes of items and zones, comma separated URLs like DATABASE_URL
+REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+# A client that wrote reads from the primary for this long, so it sees its own
+# writes while the replicas catch up
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+
+# Set on successful writes; browsers send the cookie back, other clients can echo the header
+WROTE_AT_COOKIE = "garden_wrote_at"
+WROTE_AT_HEADER = "X-Wrote-At"
+
+replica_metrics = [PoolMetrics() for _ in REPLICA_URLS]
+if DB_MODE == "async":
+    replica_engines = [
+        create_async_engine(
+            async_database_url(url), echo=False,
+            **pool_options(async_database_url(url), AsyncAdaptedQueuePool, metrics),
+        )
+        for url, metrics in zip(REPLICA_URLS, replica_metrics)
+    ]
+    ReplicaSessions = [
+        async_sessionmaker(bind=replica, autoflush=False, expire_on_commit=False) for replica in replica_engines
+    ]
+else:
+    replica_engines = [
+        create_engine(url, echo=False, future=True, **pool_options(url, QueuePool, metrics))
+        for url, metrics in zip(REPLICA_URLS, replica_metrics)
+    ]
+    ReplicaSessions = [
+        sessionmaker(bind=replica, autoflush=False, autocommit=False, future=True) for replica in replica_engines
+    ]
+for replica, metrics in zip(replica_engines, replica_metrics):
+    watch(getattr(replica, "sync_engine", replica), metrics)
+
+_replica_turn = itertools.count()
+
+
+def wrote_recently(request) -> bool:
+    wrote_at = request.headers.get(WROTE_AT_HEADER) or request.cookies.get(WROTE_AT_COOKIE)
+    if wrote_at is None:
+        return False
+    try:
+        return time.time() - float(wrote_at) < READ_YOUR_WRITES_SECONDS
+    except ValueError:
+        return False
+
+
+def pick_replica(request) -> int | None:
+    """
+    Index of the replica serving a read-only request, None for the primary:
+    writes, no replicas configured or a client inside its read-your-writes
+    window. Decided once per request, so the ETag middleware and the route
+    read the same database.
+    """
+    if not hasattr(request.state, "replica"):
+        use_replica = (
+            replica_engines and request.method in ("GET", "HEAD") and not wrote_recently(request)
+        )
+        request.state.replica = next(_replica_turn) % len(replica_engines) if use_replica else None
+    return request.state.replica
+
+
+@asynccontextmanager
+async def open_session(replica: int | None = None):
+    """A session of the configured DB_MODE on the primary or a replica, closed on exit."""
+    if replica is not None:
+        factory = ReplicaSessions[replica]
+    else:
+        factory = AsyncSessionLocal or SessionLocal
+    if DB_MODE == "async":
+        async with factory() as db:
+            yield db
+        return
+    db = factory()
+    try:
+        yield db
+    finally:
+        await run_in_threadpool(db.close)
+
+
+def pool_stats() -> dict:
+    """Live state and counters of the connection pools in this process."""
+    stats = {"sync": pool_metrics.stats(engine.pool)}
+    if async_engine is not None:
+        stats["async"] = async_pool_metrics.stats(async_engine.sync_engine.pool)
+    for i, (replica, metrics) in enumerate(zip(replica_engines, replica_metrics)):
+        stats[f"replica-{i}"] = metrics.stats(getattr(replica, "sync_engine", replica).pool)
+    return stats
+
+
+async def run_sync(db: DbSession, fn, *args, **kwargs):
+    """
+    Call ``fn(session, *args, **kwargs)`` with a sync Session without blocking
+    the event loop. On an AsyncSession it runs in a greenlet over the async
+    connection, so the sync crud functions and mapper listeners work unchanged;
+    on a sync Session it runs in the threadpool.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    if profiling.ENABLED and profiling.current.get() is not None:
+        fn = profiling.current.get().profiled(fn)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
 
 # Use the new DeclarativeBase class (SQLAlchemy 2.0 style)
 class Base(DeclarativeBase):
     pass
+
+
+def add_missing_columns(bind=engine):
+    # create_all() skips tables that already exist, so add columns introduced
+    # since a table was created. New columns must be nullable or have a default.
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=bind.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+
+def add_missing_indexes(bind=engine):
+    # Same as add_missing_columns, for indexes declared after a table was created
+    inspector = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind)
+
+
+def relax_not_null_columns(bind=engine):
+    # Drop NOT NULL from columns that the models have since made nullable
+    if bind.dialect.name not in ("mysql", "mariadb", "postgresql"):
+        return
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"]: column for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if not column.nullable or column.name not in existing or existing[column.name]["nullable"]:
+                    continue
+                if bind.dialect.name == "postgresql":
+                    conn.execute(text(f'ALTER TABLE "{table.name}" ALTER COLUMN {column.name} DROP NOT NULL'))
+                else:
+                    column_type = column.type.compile(dialect=bind.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} MODIFY COLUMN {column.name} {column_type} NULL"))
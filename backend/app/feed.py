@@ -0,0 +1,259 @@
+"""
+Change feed: item and zone writes pushed to connected clients as they commit,
+served as Server-Sent Events by GET /api/feed.
+
+The write functions in crud mark what they touched with ``changed`` and
+``deleted``. Right before the session commits, the marked objects become
+compact events: an upsert with the summary of the object (no coverage cells),
+or a delete with its id. After the commit the events go to the ``hub``; a
+rollback drops them.
+
+Every connection has a ``Subscription``, which keeps the newest pending
+event per object. A client dragging an item sends many updates, and
+subscribers that are sent a batch every FEED_COALESCE_MS only see the last
+of them. A client that falls FEED_MAX_PENDING objects behind gets a
+``resync`` event instead and catches up through GET /api/sync. Publishing
+never waits on a slow connection.
+
+The hub delivers to the connections of this process. With FEED_BACKEND=redis,
+events travel over a Redis channel instead, so every server process sees the
+writes of the others.
+"""
+from datetime import datetime
+from threading import Lock
+from typing import Iterable, Literal
+import asyncio
+import logging
+import os
+import orjson
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import serialize
+
+logger = logging.getLogger(__name__)
+
+# Seconds a connection collects events before sending them, repeated updates
+# of one object within it go out once
+COALESCE_SECONDS = float(os.getenv("FEED_COALESCE_MS", "50")) / 1000
+# Distinct objects a connection may have pending before it is told to resync
+MAX_PENDING = int(os.getenv("FEED_MAX_PENDING", "1000"))
+# Seconds between keep-alive comments on an idle connection
+HEARTBEAT_SECONDS = float(os.getenv("FEED_HEARTBEAT_SECONDS", "15"))
+# "local" for a single server process, "redis" to share events between processes
+BACKEND = os.getenv("FEED_BACKEND", "local")
+REDIS_URL = os.getenv("FEED_REDIS_URL", "redis://localhost:6379/0")
+REDIS_CHANNEL = os.getenv("FEED_REDIS_CHANNEL", "garden-feed")
+
+SUMMARIES = {"items": serialize.item_summary, "zones": serialize.zone_summary}
+
+
+class Subscription:
+    """Pending events of one connection, used from the event loop only."""
+
+    def __init__(self, kinds: Iterable[str], max_pending: int = MAX_PENDING):
+        self.kinds = set(kinds)
+        self.max_pending = max_pending
+        self.overflowed = False
+        # Events committed before this were all handed out, the sync token of a resync
+        self.delivered_until = datetime.now()
+        self._pending: dict[tuple[str, str], dict] = {}
+        self._ready = asyncio.Event()
+
+    def offer(self, events: list[dict]):
+        wanted = False
+        for change in events:
+            if change["kind"] not in self.kinds or self.overflowed:
+                continue
+            wanted = True
+            key = (change["kind"], change["id"])
+            # The newest event of an object replaces the older one and moves to the end
+            self._pending.pop(key, None)
+            self._pending[key] = change
+            if len(self._pending) > self.max_pending:
+                self._pending.clear()
+                self.overflowed = True
+        # Connections watching other kinds don't wake up for an empty batch
+        if wanted:
+            self._ready.set()
+
+    async def next_batch(self, timeout: float) -> list[dict] | None:
+        """
+        The pending events, waiting up to ``timeout`` seconds for one; None on
+        timeout. A single ``resync`` event replaces them after an overflow.
+        """
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._ready.clear()
+        since, self.delivered_until = self.delivered_until, datetime.now()
+        if self.overflowed:
+            self.overflowed = False
+            return [{"op": "resync", "token": since.isoformat()}]
+        batch = list(self._pending.values())
+        self._pending.clear()
+        return batch
+
+
+class LocalBackend:
+    """Delivers events to the subscribers of this process only."""
+
+    remote = False
+
+    def publish(self, hub: "Hub", events: list[dict]):
+        hub.deliver(events)
+
+    async def listen(self, hub: "Hub"):
+        pass
+
+
+class RedisBackend:
+    """
+    Shares events between server processes over a Redis channel. Every
+    process, the publishing one included, delivers what arrives on the channel.
+    Needs the redis package.
+    """
+
+    remote = True
+
+    def __init__(self, url: str = REDIS_URL, channel: str = REDIS_CHANNEL):
+        import redis
+        import redis.asyncio
+
+        self.url = url
+        self.channel = channel
+        # Publishing happens right after a commit, on whichever thread ran it
+        self._client = redis.Redis.from_url(url)
+        self._async = redis.asyncio
+
+    def publish(self, hub: "Hub", events: list[dict]):
+        try:
+            self._client.publish(self.channel, serialize.dumps(events))
+        except Exception:
+            logger.exception("publishing %d feed events failed", len(events))
+
+    async def listen(self, hub: "Hub"):
+        while True:
+            try:
+                client = self._async.Redis.from_url(self.url)
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            hub.deliver(orjson.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("feed channel lost, reconnecting")
+                await asyncio.sleep(1)
+
+
+class Hub:
+    """
+    Fans committed events out to subscriptions. ``publish`` and ``deliver``
+    may be called from any thread; subscriptions are only touched on the
+    event loop serving them.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or LocalBackend()
+        self.published = 0
+        self.resyncs = 0
+        self._subscriptions: set[Subscription] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._listener: asyncio.Task | None = None
+        self._lock = Lock()
+
+    @property
+    def active(self) -> bool:
+        """Whether writes need to build events at all."""
+        return self.backend.remote or bool(self._subscriptions)
+
+    def subscribe(self, kinds: Iterable[str]) -> Subscription:
+        subscription = Subscription(kinds)
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+            self._subscriptions.add(subscription)
+        if self._listener is None:
+            self._listener = self._loop.create_task(self.backend.listen(self))
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, events: list[dict]):
+        with self._lock:
+            self.published += len(events)
+        self.backend.publish(self, events)
+
+    def deliver(self, events: list[dict]):
+        with self._lock:
+            loop = self._loop
+            if loop is None or not self._subscriptions:
+                return
+        loop.call_soon_threadsafe(self._fan_out, events)
+
+    def _fan_out(self, events: list[dict]):
+        for subscription in list(self._subscriptions):
+            overflowed = subscription.overflowed
+            subscription.offer(events)
+            if subscription.overflowed and not overflowed:
+                self.resyncs += 1
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "subscribers": len(self._subscriptions),
+            "published": self.published,
+            "resyncs": self.resyncs,
+        }
+
+
+hub = Hub(RedisBackend() if BACKEND == "redis" else LocalBackend())
+
+
+def changed(db: Session, kind: Literal["items", "zones"], *objects):
+    """Mark ORM items or zones written in ``db``'s transaction."""
+    if not hub.active:
+        return
+    pending = db.info.setdefault("feed_changed", {})
+    for obj in objects:
+        pending[kind, obj.id] = obj
+
+
+def deleted(db: Session, kind: Literal["items", "zones"], ids: Iterable[str]):
+    """Mark items or zones deleted in ``db``'s transaction."""
+    if not hub.active:
+        return
+    pending = db.info.setdefault("feed_deleted", {})
+    for id in ids:
+        pending[kind, id] = None
+
+
+@event.listens_for(Session, "before_commit")
+def _build_events(session):
+    # Summaries are read now, committing expires the objects
+    changed = session.info.pop("feed_changed", {})
+    deleted = session.info.pop("feed_deleted", {})
+    if not changed and not deleted:
+        return
+    events = [
+        {"op": "upsert", "kind": kind, "id": id, "data": SUMMARIES[kind](obj)}
+        for (kind, id), obj in changed.items() if (kind, id) not in deleted
+    ]
+    events.extend({"op": "delete", "kind": kind, "id": id} for kind, id in deleted)
+    session.info["feed_events"] = events
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_events(session):
+    events = session.info.pop("feed_events", None)
+    if events:
+        hub.publish(events)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_events(session, _previous_transaction):
+    for key in ("feed_changed", "feed_deleted", "feed_events"):
+        session.info.pop(key, None)
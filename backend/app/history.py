@@ -0,0 +1,315 @@
+"""
+Delta-encoded history of items and zones.
+
+Every recorded edit appends one history row. Most rows are deltas: ``changes``
+holds only the fields that differ from the previous entry, ``added_blob`` and
+``removed_blob`` hold the coverage cells painted and erased since then. Every
+``KEYFRAME_INTERVAL``-th row is a keyframe with all fields and the full
+coverage, like the rows written before deltas existed. The state at any entry
+is rebuilt by replaying the deltas that follow the nearest keyframe.
+
+Recording an edit diffs against the object's last recorded state, which is
+kept in memory for the most recently edited objects; only an object whose
+newest entry was written elsewhere (another process, or a rolled back
+transaction) is replayed from its keyframe first.
+"""
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+from typing import Dict, Iterable, List, Tuple
+import json
+import os
+import uuid
+import numpy as np
+from sqlalchemy import DateTime, and_, func, or_, select
+from app import coverage as coverage_codec
+
+# A full copy is written after this many deltas, which bounds the cost of a replay
+KEYFRAME_INTERVAL = int(os.getenv("HISTORY_KEYFRAME_INTERVAL", "20"))
+# Objects per history kind whose last recorded state is kept in memory
+STATE_CACHE_SIZE = int(os.getenv("HISTORY_STATE_CACHE", "1024"))
+
+CoverageMap = Dict[Tuple[int, int], Tuple[str | None, str | None]]
+
+
+def _normalize(value):
+    # The JSON form of a field, so stored and live values compare equal
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return json.loads(json.dumps(value))
+    return value
+
+
+def _restore(field: str, value, datetime_fields: Iterable[str]):
+    if value is not None and field in datetime_fields:
+        return datetime.fromisoformat(value)
+    return value
+
+
+def coverage_map(cells: Iterable) -> CoverageMap:
+    """``{(col, row): (color, palette_item_id)}`` from ORM cells, schema cells or dicts."""
+    result: CoverageMap = {}
+    for cell in cells:
+        if isinstance(cell, dict):
+            col, row, color, palette_item_id = cell["col"], cell["row"], cell["color"], cell["palette_item_id"]
+        else:
+            col, row, color, palette_item_id = cell.col, cell.row, cell.color, cell.palette_item_id
+        result[(int(col), int(row))] = (color, palette_item_id)
+    return result
+
+
+def _encode_map(cells: CoverageMap) -> bytes | None:
+    if not cells:
+        return None
+    positions = list(cells)
+    return coverage_codec.encode(
+        np.array([col for col, _ in positions], dtype=np.int64),
+        np.array([row for _, row in positions], dtype=np.int64),
+        [color for color, _ in cells.values()],
+        [palette_item_id for _, palette_item_id in cells.values()],
+    )
+
+
+def _decode_map(blob: bytes | None) -> CoverageMap:
+    return coverage_map(coverage_codec.decode_cells(blob)) if blob is not None else {}
+
+
+class Chain:
+    """
+    Reads and writes the history rows of one kind of object.
+
+    ``entry_model`` is the history model, ``owner_key`` its column holding the
+    object's id, ``cell_key`` the T_cells column pointing at a history row and
+    ``fields`` the tracked columns.
+    """
+
+    def __init__(self, entry_model, owner_key: str, cell_key: str, fields: Tuple[str, ...]):
+        self.entry_model = entry_model
+        self.owner_key = owner_key
+        self.cell_key = cell_key
+        self.fields = fields
+        self.datetime_fields = {
+            field for field in fields if isinstance(getattr(entry_model, field).type, DateTime)
+        }
+        # object id -> (id of its newest entry, fields, coverage, entries since the keyframe)
+        self._states: OrderedDict[str, tuple] = OrderedDict()
+        self._lock = Lock()
+
+    @property
+    def table(self):
+        return self.entry_model.__table__
+
+    def _order(self):
+        # Rows written before deltas have no seq, they are all keyframes and come first
+        return (func.coalesce(self.table.c.seq, 0), self.table.c.last_modified, self.table.c.id)
+
+    def _compare(self, row, before: bool, inclusive: bool = True):
+        # Rows ordered before (or after) ``row``, as OR/AND terms the indexes can use
+        seq, last_modified, id = self._order()
+        key = (row.seq or 0, row.last_modified, row.id)
+        less = (lambda a, b: a < b) if before else (lambda a, b: a > b)
+        tail = (id <= key[2]) if before else (id >= key[2])
+        if not inclusive:
+            tail = less(id, key[2])
+        return or_(
+            less(seq, key[0]),
+            and_(seq == key[0], less(last_modified, key[1])),
+            and_(seq == key[0], last_modified == key[1], tail),
+        )
+
+    def _columns(self, with_coverage: bool):
+        table = self.table
+        if with_coverage:
+            return list(table.c)
+        return [column for column in table.c if column.name not in ("coverage_blob", "added_blob", "removed_blob")]
+
+    def _keyframe_coverage(self, connection, row) -> CoverageMap:
+        if row.coverage_blob is not None:
+            return _decode_map(row.coverage_blob)
+        cells = self.entry_model.coverage.property.mapper.class_.__table__
+        return coverage_map(
+            connection.execute(select(cells).where(cells.c[self.cell_key] == row.id)).mappings()
+        )
+
+    def _replay(self, connection, rows, with_coverage: bool = True) -> List[dict]:
+        # States after each of ``rows``, which start with a keyframe
+        states = []
+        state: dict = {}
+        cells: CoverageMap = {}
+        for row in rows:
+            if row.changes is None:
+                state = {field: getattr(row, field) for field in self.fields}
+                if with_coverage:
+                    cells = self._keyframe_coverage(connection, row)
+            else:
+                for field, value in row.changes.items():
+                    state[field] = _restore(field, value, self.datetime_fields)
+                if with_coverage:
+                    cells = dict(cells)
+                    for position in _decode_map(row.removed_blob):
+                        cells.pop(position, None)
+                    cells.update(_decode_map(row.added_blob))
+            states.append({
+                **state,
+                "id": row.id,
+                self.owner_key: getattr(row, self.owner_key),
+                "last_modified": row.last_modified,
+                "coverage": cells if with_coverage else None,
+            })
+        return states
+
+    def _chain(self, connection, object_id: str, first, last, with_coverage: bool = True):
+        # The newest keyframe at or before row ``first`` and every row after it up to row ``last``
+        table = self.table
+        owned = table.c[self.owner_key] == object_id
+        if first.changes is None:
+            keyframe = first
+        else:
+            keyframe = connection.execute(
+                select(*self._columns(False))
+                .where(owned, table.c.changes.is_(None), self._compare(first, before=True))
+                .order_by(*(column.desc() for column in self._order()))
+                .limit(1)
+            ).first()
+            if keyframe is None:
+                return []
+        return connection.execute(
+            select(*self._columns(with_coverage))
+            .where(owned, self._compare(keyframe, before=False), self._compare(last, before=True))
+            .order_by(*self._order())
+        ).all()
+
+    def _latest(self, connection, object_id: str, *conditions):
+        table = self.table
+        return connection.execute(
+            select(*self._columns(False))
+            .where(table.c[self.owner_key] == object_id, *conditions)
+            .order_by(*(column.desc() for column in self._order()))
+            .limit(1)
+        ).first()
+
+    def _previous(self, connection, object_id: str, latest) -> tuple | None:
+        # (fields, coverage, entries since the keyframe) as of the newest entry ``latest``
+        with self._lock:
+            cached = self._states.get(object_id)
+            if cached is not None and cached[0] == latest.id:
+                self._states.move_to_end(object_id)
+                return cached[1:]
+        rows = self._chain(connection, object_id, latest, latest)
+        if not rows:
+            return None
+        state = self._replay(connection, rows)[-1]
+        return {field: _normalize(state[field]) for field in self.fields}, state["coverage"], len(rows)
+
+    def _remember(self, object_id: str, entry_id: str, fields: dict, cells: CoverageMap, since_keyframe: int):
+        with self._lock:
+            self._states[object_id] = (entry_id, fields, cells, since_keyframe)
+            self._states.move_to_end(object_id)
+            while len(self._states) > STATE_CACHE_SIZE:
+                self._states.popitem(last=False)
+
+    def record(self, connection, db_state):
+        """Append the state of ``db_state`` as a keyframe or as a delta to the previous entry."""
+        current = {field: _normalize(getattr(db_state, field)) for field in self.fields}
+        cells = coverage_map(db_state.coverage_cells)
+        table = self.table
+
+        latest = self._latest(connection, db_state.id)
+        previous = self._previous(connection, db_state.id, latest) if latest is not None else None
+        if latest is None:
+            last_seq = 0
+        elif latest.seq is not None:
+            # Ordered by seq, the newest entry has the highest
+            last_seq = latest.seq
+        else:
+            last_seq = connection.execute(
+                select(func.count()).where(table.c[self.owner_key] == db_state.id)
+            ).scalar()
+
+        entry = {
+            "id": str(uuid.uuid4()),
+            self.owner_key: db_state.id,
+            "seq": last_seq + 1,
+            "last_modified": db_state.last_modified,
+        }
+        if previous is None or previous[2] >= KEYFRAME_INTERVAL:
+            entry.update({field: getattr(db_state, field) for field in self.fields})
+            # Always a blob, whichever way the object stores its coverage: one
+            # column instead of a T_cells row per cell, and _keyframe_coverage reads both
+            entry["coverage_blob"] = db_state.coverage_blob if db_state.coverage_blob is not None else _encode_map(cells)
+            since_keyframe = 1
+        else:
+            old_fields, old_cells, since_keyframe = previous
+            entry["changes"] = {
+                field: value for field, value in current.items()
+                if old_fields[field] != value
+            }
+            entry["added_blob"] = _encode_map({
+                position: value for position, value in cells.items()
+                if old_cells.get(position) != value
+            })
+            entry["removed_blob"] = _encode_map({
+                position: (None, None) for position in old_cells if position not in cells
+            })
+            since_keyframe += 1
+        # A Core INSERT on the flushing connection, the session can't take new objects mid-flush
+        connection.execute(table.insert().values(**entry))
+        self._remember(db_state.id, entry["id"], current, cells, since_keyframe)
+
+    def find(self, connection, object_id: str, entry_id: str):
+        """The ordering key row of one entry, for resuming a page after it."""
+        table = self.table
+        return connection.execute(
+            select(table.c.id, table.c.seq, table.c.last_modified)
+            .where(table.c[self.owner_key] == object_id, table.c.id == entry_id)
+        ).first()
+
+    def page(
+        self,
+        connection,
+        object_id: str,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        after=None,
+        limit: int | None = None,
+        with_coverage: bool = True,
+    ) -> List[dict]:
+        """
+        Entries of an object recorded between ``since`` and ``until``, newest
+        first, rebuilt to their full state. ``after`` is the last entry of the
+        previous page (see ``find``). Only the chain from the keyframe before
+        the oldest entry of the page is read, and without the coverage blobs
+        unless ``with_coverage``.
+        """
+        table = self.table
+        conditions = [table.c[self.owner_key] == object_id]
+        if since is not None:
+            conditions.append(table.c.last_modified >= since)
+        if until is not None:
+            conditions.append(table.c.last_modified <= until)
+        if after is not None:
+            conditions.append(self._compare(after, before=True, inclusive=False))
+        query = (
+            select(*self._columns(False))
+            .where(*conditions)
+            .order_by(*(column.desc() for column in self._order()))
+        )
+        if limit is not None:
+            query = query.limit(limit)
+        selected = connection.execute(query).all()
+        if not selected:
+            return []
+
+        wanted = {row.id for row in selected}
+        rows = self._chain(connection, object_id, selected[-1], selected[0], with_coverage)
+        states = [state for state in self._replay(connection, rows, with_coverage) if state["id"] in wanted]
+        return states[::-1]
+
+    def state_at(self, connection, object_id: str, at: datetime) -> dict | None:
+        """The state of the newest entry recorded at or before ``at``."""
+        upto = self._latest(connection, object_id, self.table.c.last_modified <= at)
+        if upto is None:
+            return None
+        rows = self._chain(connection, object_id, upto, upto)
+        return self._replay(connection, rows)[-1] if rows else None
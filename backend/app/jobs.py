@@ -0,0 +1,160 @@
+"""
+Zone calculations run as background jobs, so a large paint doesn't hold its
+request open or the server's threads busy while it is grouped.
+
+``algorithms.group_paint`` runs in a worker process on plain arrays. This
+process then saves every zone of the job in one transaction, the same way
+POST /api/zones/grid does. Jobs and their results live in the memory of the
+server process that accepted them, like the read cache, and are forgotten
+after ZONE_JOB_RETENTION seconds.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+import numpy as np
+from app import algorithms, crud
+from app.database import open_session, run_sync
+
+logger = logging.getLogger(__name__)
+
+# Worker processes grouping paints; each runs one job at a time
+WORKERS = int(os.getenv("ZONE_JOB_WORKERS", "2"))
+# Jobs waiting or running at once, more are turned away with 503
+MAX_PENDING = int(os.getenv("ZONE_JOB_QUEUE", "8"))
+# Paints of at least this many cells run as a job unless the request says otherwise
+MIN_CELLS = int(os.getenv("ZONE_JOB_MIN_CELLS", "100000"))
+# Seconds a finished job and its zone ids stay available
+RETENTION = float(os.getenv("ZONE_JOB_RETENTION", "3600"))
+# Retry-After sent with a full queue
+RETRY_AFTER = int(os.getenv("ZONE_JOB_RETRY_AFTER", "5"))
+
+
+def _save(db, display_name: str, groups: list[tuple]) -> list[str]:
+    # Ids read before the session closes, committed zones expire
+    return [zone.id for zone in crud.save_zone_groups(db, display_name, groups)]
+
+
+class QueueFull(Exception):
+    pass
+
+
+class ZoneJobs:
+    """
+    Registry of zone jobs and the process pool running them.
+
+    A job is ``queued`` until a worker is free, ``running`` while it is
+    grouped and saved, then ``done`` with the ids of its zones or ``failed``
+    with an error. At most ``max_pending`` jobs are queued or running; their
+    arrays are held in memory until they finish, so that also bounds memory.
+    """
+
+    def __init__(self, workers: int = WORKERS, max_pending: int = MAX_PENDING, retention: float = RETENTION):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retention = retention
+        self.submitted = 0
+        self.rejected = 0
+        self._jobs: dict[str, dict] = {}
+        # Keeps the asyncio tasks alive until they finish
+        self._tasks: set[asyncio.Task] = set()
+        self._pool: ProcessPoolExecutor | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._lock = Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn, forking a server with live threads and connections isn't safe
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def _pending(self) -> int:
+        return sum(job["status"] in ("queued", "running") for job in self._jobs.values())
+
+    def _expire(self, now: float):
+        for id in [id for id, job in self._jobs.items() if job["finished_at"] is not None and now - job["finished_at"] > self.retention]:
+            del self._jobs[id]
+
+    def submit(
+        self,
+        display_name: str,
+        cols: np.ndarray,
+        rows: np.ndarray,
+        codes: np.ndarray,
+        palette: list[tuple[str | None, str | None]]
+    ) -> dict:
+        """
+        Queue the grouping and saving of a paint, from a request on the event loop.
+        Returns the new job, or raises QueueFull.
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if self._pending() >= self.max_pending:
+                self.rejected += 1
+                raise QueueFull(f"{self.max_pending} zone jobs are already waiting or running")
+            job = {
+                "id": str(uuid.uuid4()),
+                "status": "queued",
+                "display_name": display_name,
+                "cells": len(cols),
+                "created_at": now,
+                "started_at": None,
+                "finished_at": None,
+                "zone_ids": None,
+                "error": None,
+            }
+            self._jobs[job["id"]] = job
+            self.submitted += 1
+        task = asyncio.get_running_loop().create_task(self._run(job, display_name, cols, rows, codes, palette))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return dict(job)
+
+    async def _run(self, job: dict, display_name, cols, rows, codes, palette):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        async with self._slots:
+            job["status"] = "running"
+            job["started_at"] = time.time()
+            try:
+                groups = await asyncio.get_running_loop().run_in_executor(
+                    self._executor(), algorithms.group_paint, cols, rows, codes, palette
+                )
+                async with open_session() as db:
+                    job["zone_ids"] = await run_sync(db, _save, display_name, groups)
+                job["status"] = "done"
+            except Exception as e:
+                logger.exception("zone job %s failed", job["id"])
+                job["error"] = str(e) or type(e).__name__
+                job["status"] = "failed"
+            finally:
+                job["finished_at"] = time.time()
+
+    def get(self, id: str) -> dict | None:
+        """A copy of the job, None if it is unknown or expired."""
+        with self._lock:
+            self._expire(time.time())
+            job = self._jobs.get(id)
+            return dict(job) if job is not None else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            statuses = [job["status"] for job in self._jobs.values()]
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "queued": statuses.count("queued"),
+                "running": statuses.count("running"),
+                "done": statuses.count("done"),
+                "failed": statuses.count("failed"),
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+            }
+
+
+zone_jobs = ZoneJobs()
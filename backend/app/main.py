@@ -1,15 +1,101 @@
-from fastapi import FastAPI
-from app.api import items, zones
-from app.database import engine, Base
+from fastapi import FastAPI, Response
+from app.api import items, zones, sync, batch, feed, diagnostics
+from app.database import READ_YOUR_WRITES_SECONDS, WROTE_AT_COOKIE, WROTE_AT_HEADER, open_session, pick_replica, replica_engines, run_sync
+from app import crud, migrate_schema
+from app import metrics, profiling
+from app.logs import configure_logging
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
+import hashlib
 import logging
+import math
+import os
+import re
+import time
 
-Base.metadata.create_all(bind=engine)
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Serves /metrics and the /api/pool, /api/cache, /api/jobs and /api/feed/stats counters.
+# They are unauthenticated and the API allows any origin, so only turn this on where
+# the port is not reachable from outside, e.g. for a Prometheus scraper on the same network.
+DIAGNOSTICS = os.getenv("DIAGNOSTICS", "false").lower() in ("1", "true", "yes")
+
+# Runs app.migrate_schema when the server starts, which suits a single server process.
+# With several workers or replicas run `python -m app.migrate_schema` once per deploy
+# instead and turn this off, so they don't all alter the tables at the same time.
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() in ("1", "true", "yes")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if MIGRATE_ON_STARTUP:
+        filled = await run_in_threadpool(migrate_schema.migrate)
+        logger.info("schema is up to date, filled in the bounds of %d objects", filled)
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(items.router, prefix="/api/items", tags=["Items"])
 app.include_router(zones.router, prefix="/api/zones", tags=["Zones"])
+app.include_router(sync.router, prefix="/api/sync", tags=["Sync"])
+app.include_router(batch.router, prefix="/api/batch", tags=["Batch"])
+app.include_router(feed.router, prefix="/api/feed", tags=["Feed"])
+if DIAGNOSTICS:
+    app.include_router(diagnostics.router)
+
+# GET routes whose response only depends on the query string and the items or zones version
+CONDITIONAL_PATHS = re.compile(r"^/api/(items|zones)/(zones/)?([^/]+/history)?$")
+
+# Routers serving CONDITIONAL_PATHS, by the kind the path names
+CONDITIONAL_ROUTERS = {"items": ("/api/items", items.router), "zones": ("/api/zones", zones.router)}
+
+def _resolve_route(scope, kind: str):
+    # What routing would have set, so a 304 from here is labelled with its route in the metrics
+    prefix, router = CONDITIONAL_ROUTERS[kind]
+    for route in router.routes:
+        match, child_scope = route.matches({**scope, "path": scope["path"][len(prefix):]})
+        if match == Match.FULL:
+            scope.update(child_scope)
+            return
+
+@app.middleware("http")
+async def conditional_get(request, call_next):
+    # Answer unchanged reads with 304 before any ORM or Pydantic work happens.
+    # Registered before CORS so the 304 still carries the CORS headers.
+    match = CONDITIONAL_PATHS.match(request.url.path)
+    if request.method != "GET" or not match:
+        return await call_next(request)
+
+    representation = hashlib.blake2b(f"{request.url.path}?{request.url.query}".encode(), digest_size=8).hexdigest()
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        # From the database the route will read, a replica's version matches its data.
+        # The route reuses it through crud.request_version.
+        async with open_session(pick_replica(request)) as db:
+            request.state.version = await run_sync(db, crud.get_version, match.group(1))
+        etag = f'"{request.state.version}-{representation}"'
+        if etag in (tag.strip() for tag in if_none_match.split(",")):
+            _resolve_route(request.scope, match.group(1))
+            return Response(status_code=304, headers={"ETag": etag})
+
+    response = await call_next(request)
+    # The version the route read before building the body
+    version = getattr(request.state, "version", None)
+    if response.status_code == 200 and version is not None:
+        response.headers["ETag"] = f'"{version}-{representation}"'
+    return response
+
+@app.middleware("http")
+async def remember_writes(request, call_next):
+    # Start the client's read-your-writes window, see database.pick_replica
+    response = await call_next(request)
+    if replica_engines and request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        wrote_at = f"{time.time():.3f}"
+        response.headers[WROTE_AT_HEADER] = wrote_at
+        response.set_cookie(WROTE_AT_COOKIE, wrote_at, max_age=math.ceil(READ_YOUR_WRITES_SECONDS), httponly=True)
+    return response
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,17 +103,13 @@ app.add_middleware(
     allow_credentials=True,  # Needed if frontend uses cookies or auth
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", WROTE_AT_HEADER],
 )
 
-@app.middleware("http")
-async def log_headers(request, call_next):
-    response = await call_next(request)
-    print("Response Headers:", response.headers)
-    return response
+if profiling.ENABLED:
+    app.add_middleware(profiling.ProfilingMiddleware)
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-)
-logger = logging.getLogger(__name__)
-logger.debug("🚀 Backend has started...")
+# Outermost, so the timings include the other middlewares
+app.add_middleware(metrics.RequestMetrics)
+
+logger.info("Backend has started")
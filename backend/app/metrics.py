@@ -0,0 +1,203 @@
+"""
+Request metrics in the Prometheus text format, served by GET /metrics.
+
+Every request is timed by ``RequestMetrics``, a plain ASGI middleware, and the
+SQL it runs is timed by cursor events on the engines (``watch_engine``). The
+per-request database counters live in a context variable, which the
+threadpool and AsyncSession greenlets inherit. Recording a request takes a
+few dictionary lookups and one lock per histogram, no I/O.
+"""
+from contextvars import ContextVar
+from threading import Lock
+from typing import Dict, Tuple
+import bisect
+import logging
+import os
+import random
+import time
+from sqlalchemy import event
+
+logger = logging.getLogger("app.access")
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Fraction of successful requests written to the access log, errors and
+# requests slower than LOG_SLOW_MS are always logged
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+LOG_SLOW_SECONDS = float(os.getenv("LOG_SLOW_MS", "1000")) / 1000
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per label tuple."""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...], buckets: Tuple[float, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [count per bucket (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        for label_values, counts, total in sorted(snapshot):
+            labels = ",".join(f'{name}="{value}"' for name, value in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        for label_values, value in snapshot:
+            labels = ",".join(f'{name}="{value}"' for name, value in zip(self.labels, label_values))
+            lines.append(f"{self.name}{{{labels}}} {value}")
+        return lines
+
+
+REQUESTS = Counter("http_requests_total", "Requests by route and status code.", ("method", "route", "status"))
+LATENCY = Histogram("http_request_duration_seconds", "Time from request to last response byte.", ("method", "route"), LATENCY_BUCKETS)
+REQUEST_SIZE = Histogram("http_request_size_bytes", "Request body size from Content-Length.", ("method", "route"), SIZE_BUCKETS)
+RESPONSE_SIZE = Histogram("http_response_size_bytes", "Response body size.", ("method", "route"), SIZE_BUCKETS)
+DB_TIME = Histogram("db_time_per_request_seconds", "Time spent in SQL statements per request.", ("method", "route"), LATENCY_BUCKETS)
+DB_QUERIES = Histogram("db_queries_per_request", "SQL statements executed per request.", ("method", "route"), QUERY_COUNT_BUCKETS)
+
+METRICS = (REQUESTS, LATENCY, REQUEST_SIZE, RESPONSE_SIZE, DB_TIME, DB_QUERIES)
+
+
+class DbStats:
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+# Database work of the current request, None outside requests (startup, scripts)
+db_stats: ContextVar[DbStats | None] = ContextVar("db_stats", default=None)
+
+
+def watch_engine(engine):
+    """Count and time the statements of ``engine`` (a sync Engine) into the current request."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timer(connection, _cursor, _statement, _parameters, _context, _executemany):
+        connection.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_timer(connection, _cursor, _statement, _parameters, _context, _executemany):
+        elapsed = time.perf_counter() - connection.info["query_start"].pop()
+        stats = db_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds += elapsed
+
+
+def render() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def route_label(scope) -> str:
+    """
+    The path with its parameters put back as ``{name}``, which keeps the label
+    set as small as the route table. Paths that matched no route share one label.
+    """
+    if "route" not in scope:
+        return "unmatched"
+    params = {str(value): f"{{{name}}}" for name, value in scope.get("path_params", {}).items()}
+    if not params:
+        return scope["path"]
+    return "/".join(params.get(segment, segment) for segment in scope["path"].split("/"))
+
+
+class RequestMetrics:
+    """ASGI middleware recording latency, sizes and database work of every HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        stats = DbStats()
+        token = db_stats.set(stats)
+        status = 500
+        sent = 0
+
+        async def send_wrapper(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            db_stats.reset(token)
+            elapsed = time.perf_counter() - start
+            method = scope["method"]
+            route = route_label(scope)
+            received = 0
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    received = int(value)
+                    break
+
+            REQUESTS.inc(method, route, str(status))
+            LATENCY.observe(elapsed, method, route)
+            REQUEST_SIZE.observe(received, method, route)
+            RESPONSE_SIZE.observe(sent, method, route)
+            DB_TIME.observe(stats.seconds, method, route)
+            DB_QUERIES.observe(stats.queries, method, route)
+
+            if status >= 500 or elapsed >= LOG_SLOW_SECONDS or random.random() < LOG_SAMPLE_RATE:
+                logger.info("request", extra={
+                    "method": method,
+                    "route": route,
+                    "path": scope["path"],
+                    "status": status,
+                    "duration_ms": round(elapsed * 1000, 2),
+                    "db_ms": round(stats.seconds * 1000, 2),
+                    "db_queries": stats.queries,
+                    "request_bytes": received,
+                    "response_bytes": sent,
+                })
@@ -0,0 +1,84 @@
+"""
+Move stored coverage between T_cells rows and compact blobs.
+
+    python -m app.migrate_coverage --to compact
+    python -m app.migrate_coverage --to rows
+
+Each item, zone and history entry is converted in its own small step and
+committed in batches, so the migration can be interrupted and re-run.
+"""
+import argparse
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from app import schemas  # noqa: F401  (schemas first, models imports utils -> schemas)
+from app import coverage, crud, models
+from app.database import SessionLocal
+
+# Owner model and the T_cells foreign key pointing at it
+OWNERS = (
+    (models.GardenItem, "garden_item_id"),
+    (models.GardenZone, "garden_zone_id"),
+    (models.GardenItemHistory, "garden_item_history_id"),
+    (models.GardenZoneHistory, "garden_zone_history_id"),
+)
+
+
+def _set_blob(db: Session, model, owner_id: str, blob: bytes | None) -> int:
+    # Core UPDATE that keeps last_modified, a storage change is not an edit
+    result = db.execute(
+        update(model)
+        .where(model.id == owner_id)
+        .values(coverage_blob=blob, last_modified=model.last_modified)
+    )
+    return result.rowcount
+
+
+def rows_to_compact(db: Session, batch_size: int = 200) -> int:
+    """Encode the T_cells rows of every owner without a blob into its blob. Returns owners converted."""
+    converted = 0
+    for model, foreign_key in OWNERS:
+        column = getattr(models.Cell, foreign_key)
+        while True:
+            owner_ids = [
+                owner_id for (owner_id,) in
+                db.query(column).filter(column.is_not(None)).distinct().limit(batch_size)
+            ]
+            if not owner_ids:
+                break
+            for owner_id in owner_ids:
+                cells = db.query(models.Cell).filter(column == owner_id).all()
+                converted += _set_blob(db, model, owner_id, coverage.encode_cells(cells))
+                db.query(models.Cell).filter(column == owner_id).delete(synchronize_session=False)
+            db.commit()
+    return converted
+
+
+def compact_to_rows(db: Session, batch_size: int = 200) -> int:
+    """Expand every blob back into T_cells rows. Returns owners converted."""
+    converted = 0
+    for model, foreign_key in OWNERS:
+        while True:
+            owners = (
+                db.query(model.id, model.coverage_blob)
+                .filter(model.coverage_blob.is_not(None))
+                .limit(batch_size)
+                .all()
+            )
+            if not owners:
+                break
+            for owner_id, blob in owners:
+                cells = [schemas.Cell(**cell) for cell in coverage.decode_cells(blob)]
+                crud.insert_cells(db, cells, **{foreign_key: owner_id})
+                converted += _set_blob(db, model, owner_id, None)
+            db.commit()
+    return converted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move stored coverage between T_cells rows and compact blobs.")
+    parser.add_argument("--to", choices=["compact", "rows"], required=True)
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        migrate = rows_to_compact if args.to == "compact" else compact_to_rows
+        print(f"Converted coverage of {migrate(db)} objects to {args.to} storage")
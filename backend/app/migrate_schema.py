@@ -0,0 +1,27 @@
+"""
+Bring the database up to the models.
+
+    python -m app.migrate_schema
+
+create_all() only creates missing tables, so the columns, indexes and
+nullable changes made to existing tables since are applied here too, then
+the bounding boxes of rows saved before they were tracked are filled in.
+Every step skips what is already done, so it can be re-run at any time.
+"""
+from app import schemas  # noqa: F401  (schemas first, models imports utils -> schemas)
+from app import crud, models  # noqa: F401  (models registers the tables)
+from app.database import Base, SessionLocal, engine, add_missing_columns, add_missing_indexes, relax_not_null_columns
+
+
+def migrate() -> int:
+    """Apply every schema update. Returns the rows whose bounds were filled in."""
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    relax_not_null_columns(engine)
+    add_missing_indexes(engine)
+    with SessionLocal() as db:
+        return crud.backfill_bounds(db)
+
+
+if __name__ == "__main__":
+    print(f"Schema is up to date, filled in the bounds of {migrate()} objects")
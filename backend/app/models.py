@@ -1,12 +1,48 @@
+from datetime import datetime
 from uuid import uuid4
-from app.utils import to_column_letter
-from sqlalchemy.orm import Mapped, mapped_column, relationship, Session, object_session
-from sqlalchemy import String, Float, DateTime, ForeignKey, JSON, func, event
+from app.utils import to_column_letter, item_bounds, ring_bounds
+from app import coverage as coverage_codec
+from app import history
+from sqlalchemy.orm import Mapped, mapped_column, relationship, declared_attr, Session, object_session
+from sqlalchemy import String, Float, Integer, DateTime, ForeignKey, JSON, Index, LargeBinary, event
 from app.database import Base
 from typing import List, Tuple
 
 
-class GardenItem(Base):
+class CompactCoverageMixin:
+    # Set when the coverage is stored as one encoded blob instead of T_cells rows
+    coverage_blob: Mapped[bytes | None] = mapped_column(LargeBinary(length=2**32 - 1), nullable=True)
+
+    # Cell dicts read by crud.load_cells, for rows queried without their coverage relationship
+    loaded_cells: list[dict] | None = None
+
+    @property
+    def coverage_cells(self):
+        """The coverage, whichever way it is stored. Read schemas validate from this."""
+        if self.coverage_blob is not None:
+            return coverage_codec.decode_cells(self.coverage_blob)
+        if self.loaded_cells is not None:
+            return self.loaded_cells
+        return self.coverage
+
+
+class BoundsMixin:
+    # Bounding box in map pixels, kept up to date by listeners, for viewport queries
+    min_x: Mapped[float | None] = mapped_column(Float, nullable=True)
+    min_y: Mapped[float | None] = mapped_column(Float, nullable=True)
+    max_x: Mapped[float | None] = mapped_column(Float, nullable=True)
+    max_y: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+    @declared_attr.directive
+    def __table_args__(cls):
+        # Covering indexes so either axis can drive a box intersection query
+        return (
+            Index(f"ix_{cls.__tablename__}_bounds_x", "min_x", "max_x", "min_y", "max_y"),
+            Index(f"ix_{cls.__tablename__}_bounds_y", "min_y", "max_y", "min_x", "max_x"),
+        )
+
+
+class GardenItem(BoundsMixin, CompactCoverageMixin, Base):
     __tablename__ = "T_garden_items"
 
     id: Mapped[str] = mapped_column(String(36), primary_key=True, index=True)
@@ -32,29 +68,58 @@ class GardenItem(Base):
     q_watered: Mapped[float | None] = mapped_column(Float, nullable=True)
     t_amended: Mapped[DateTime | None] = mapped_column(DateTime, nullable=True)
     q_amended: Mapped[float | None] = mapped_column(Float, nullable=True)
-    last_modified: Mapped[DateTime] = mapped_column(DateTime, default=func.now(), onupdate=func.now())
+    # Stamped by the app, like crud's explicit updates: the database's now() is whole
+    # seconds on SQLite, which would put rows behind the keyset cursor of their own second
+    last_modified: Mapped[DateTime] = mapped_column(DateTime, default=datetime.now, onupdate=datetime.now)
 
     coverage: Mapped[list["Cell"]] = relationship(
         back_populates="item",
         cascade="all, delete-orphan"
     )
 
-class GardenItemHistory(Base):
+# (last_modified, id) is the keyset order of paginated and streamed lists
+Index("ix_T_garden_items_modified", GardenItem.last_modified, GardenItem.id)
+
+@event.listens_for(GardenItem, "before_insert")
+@event.listens_for(GardenItem, "before_update")
+def set_item_bounds(_mapper, _connection, target: GardenItem):
+    if None in (target.x, target.y, target.width, target.height):
+        return
+    target.min_x, target.min_y, target.max_x, target.max_y = item_bounds(
+        target.x, target.y, target.width, target.height, target.rotation
+    )
+
+class HistoryDeltaMixin:
+    # Position in the object's history, null on rows written before deltas existed
+    seq: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    # Null on keyframes, otherwise the fields that changed since the previous entry,
+    # and the tracked columns are left empty
+    changes: Mapped[dict | None] = mapped_column(JSON, nullable=True)
+    # Coverage painted over and erased since the previous entry, as encoded blobs
+    added_blob: Mapped[bytes | None] = mapped_column(LargeBinary(length=2**32 - 1), nullable=True)
+    removed_blob: Mapped[bytes | None] = mapped_column(LargeBinary(length=2**32 - 1), nullable=True)
+
+
+class GardenItemHistory(HistoryDeltaMixin, CompactCoverageMixin, Base):
     __tablename__ = "T_garden_items_history"
+    __table_args__ = (
+        Index("ix_T_garden_items_history_seq", "garden_item_id", "seq"),
+        Index("ix_T_garden_items_history_modified", "garden_item_id", "last_modified"),
+    )
 
     id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid4()))
     garden_item_id: Mapped[str] = mapped_column(String(36), index=True)
-    palette_item_id: Mapped[str] = mapped_column(String(3))
-    display_name: Mapped[str] = mapped_column(String(255))
-    icon: Mapped[str] = mapped_column(String(255))
-    x: Mapped[float] = mapped_column(Float)
-    y: Mapped[float] = mapped_column(Float)
+    palette_item_id: Mapped[str] = mapped_column(String(3), nullable=True)
+    display_name: Mapped[str] = mapped_column(String(255), nullable=True)
+    icon: Mapped[str] = mapped_column(String(255), nullable=True)
+    x: Mapped[float] = mapped_column(Float, nullable=True)
+    y: Mapped[float] = mapped_column(Float, nullable=True)
     location: Mapped[str | None] = mapped_column(String(255), nullable=True)
-    width: Mapped[float] = mapped_column(Float)
-    height: Mapped[float] = mapped_column(Float)
+    width: Mapped[float] = mapped_column(Float, nullable=True)
+    height: Mapped[float] = mapped_column(Float, nullable=True)
     rotation: Mapped[float] = mapped_column(Float, nullable=True)
-    category: Mapped[str] = mapped_column(String(255))
-    sub_category: Mapped[str] = mapped_column(String(255))
+    category: Mapped[str] = mapped_column(String(255), nullable=True)
+    sub_category: Mapped[str] = mapped_column(String(255), nullable=True)
     wcvp_id: Mapped[str | None] = mapped_column(String(255), nullable=True)
     rhs_id: Mapped[str | None] = mapped_column(String(255), nullable=True)
     species: Mapped[str | None] = mapped_column(String(255), nullable=True)
@@ -66,13 +131,21 @@ class GardenItemHistory(Base):
     q_watered: Mapped[float | None] = mapped_column(Float, nullable=True)
     t_amended: Mapped[DateTime | None] = mapped_column(DateTime, nullable=True)
     q_amended: Mapped[float | None] = mapped_column(Float, nullable=True)
-    last_modified: Mapped[DateTime] = mapped_column(DateTime, default=func.now())
+    last_modified: Mapped[DateTime] = mapped_column(DateTime, default=datetime.now)
 
     coverage: Mapped[list["Cell"]] = relationship(
         back_populates="item_history",
         cascade="all, delete-orphan"
     )
 
+# Columns that history entries track, beside the coverage
+ITEM_HISTORY_FIELDS = (
+    "palette_item_id", "display_name", "icon", "x", "y", "location", "width", "height",
+    "rotation", "category", "sub_category", "wcvp_id", "rhs_id", "species", "genus",
+    "circumference", "price", "t_watered", "dt_watered", "q_watered", "t_amended", "q_amended",
+)
+item_history = history.Chain(GardenItemHistory, "garden_item_id", "garden_item_history_id", ITEM_HISTORY_FIELDS)
+
 @event.listens_for(GardenItem, "before_update")
 def track_garden_item_history(mapper, connection, target: GardenItem):
     session = object_session(target)
@@ -87,53 +160,16 @@ def track_garden_item_history(mapper, connection, target: GardenItem):
         return
     session.info[f"_history_created_for_{target.id}"] = True
 
-    history_entry = GardenItemHistory(
-        garden_item_id=db_state.id,
-        palette_item_id=db_state.palette_item_id,
-        display_name=db_state.display_name,
-        icon=db_state.icon,
-        x=db_state.x,
-        y=db_state.y,
-        location=db_state.location,
-        width=db_state.width,
-        height=db_state.height,
-        rotation=db_state.rotation,
-        category=db_state.category,
-        sub_category=db_state.sub_category,
-        wcvp_id=db_state.wcvp_id,
-        rhs_id=db_state.rhs_id,
-        species=db_state.species,
-        genus=db_state.genus,
-        circumference=db_state.circumference,
-        price=db_state.price,
-        t_watered=db_state.t_watered,
-        dt_watered=db_state.dt_watered,
-        q_watered=db_state.q_watered,
-        t_amended=db_state.t_amended,
-        q_amended=db_state.q_amended,
-        last_modified=db_state.last_modified,
-    )
-
-    for cell in db_state.coverage:
-        copied_cell = Cell(
-            col=cell.col,
-            row=cell.row,
-            color=cell.color,
-            palette_item_id=cell.palette_item_id,
-            serialized=cell.serialized,
-            item_history=history_entry
-        )
-        history_entry.coverage.append(copied_cell)
-
-    session.add(history_entry)
+    item_history.record(connection, db_state)
 
-class GardenZone(Base):
+class GardenZone(BoundsMixin, CompactCoverageMixin, Base):
     __tablename__ = "T_garden_zones"
 
     id: Mapped[str] = mapped_column(String(36), primary_key=True, index=True)
     display_name: Mapped[str | None] = mapped_column(String(255), nullable=True)
     color: Mapped[str] = mapped_column(String(255), nullable=False)
     border_path: Mapped[List[Tuple[int, int]]] = mapped_column(JSON, nullable=False)
+    border_holes: Mapped[List[List[Tuple[int, int]]] | None] = mapped_column(JSON, nullable=True)
     ph: Mapped[float | None] = mapped_column(Float, nullable=True)
     temp: Mapped[float | None] = mapped_column(Float, nullable=True)
     moisture: Mapped[float | None] = mapped_column(Float, nullable=True)
@@ -147,7 +183,7 @@ class GardenZone(Base):
     q_watered: Mapped[float | None] = mapped_column(Float, nullable=True)
     t_amended: Mapped[DateTime | None] = mapped_column(DateTime, nullable=True)
     q_amended: Mapped[float | None] = mapped_column(Float, nullable=True)
-    last_modified: Mapped[DateTime] = mapped_column(DateTime, default=func.now(), onupdate=func.now())
+    last_modified: Mapped[DateTime] = mapped_column(DateTime, default=datetime.now, onupdate=datetime.now)
 
 
     coverage: Mapped[list["Cell"]] = relationship(
@@ -155,14 +191,28 @@ class GardenZone(Base):
         cascade="all, delete-orphan"
     )
 
-class GardenZoneHistory(Base):
+Index("ix_T_garden_zones_modified", GardenZone.last_modified, GardenZone.id)
+
+@event.listens_for(GardenZone, "before_insert")
+@event.listens_for(GardenZone, "before_update")
+def set_zone_bounds(_mapper, _connection, target: GardenZone):
+    bounds = ring_bounds(target.border_path)
+    if bounds is not None:
+        target.min_x, target.min_y, target.max_x, target.max_y = bounds
+
+class GardenZoneHistory(HistoryDeltaMixin, CompactCoverageMixin, Base):
     __tablename__ = "T_garden_zones_history"
+    __table_args__ = (
+        Index("ix_T_garden_zones_history_seq", "garden_zone_id", "seq"),
+        Index("ix_T_garden_zones_history_modified", "garden_zone_id", "last_modified"),
+    )
 
     id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid4()))
     garden_zone_id: Mapped[str] = mapped_column(String(36), index=True)
     display_name: Mapped[str | None] = mapped_column(String(255), nullable=True)
-    color: Mapped[str] = mapped_column(String(255), nullable=False)
-    border_path: Mapped[List[Tuple[int, int]]] = mapped_column(JSON, nullable=False)
+    color: Mapped[str] = mapped_column(String(255), nullable=True)
+    border_path: Mapped[List[Tuple[int, int]]] = mapped_column(JSON, nullable=True)
+    border_holes: Mapped[List[List[Tuple[int, int]]] | None] = mapped_column(JSON, nullable=True)
     ph: Mapped[float | None] = mapped_column(Float, nullable=True)
     temp: Mapped[float | None] = mapped_column(Float, nullable=True)
     moisture: Mapped[float | None] = mapped_column(Float, nullable=True)
@@ -176,13 +226,20 @@ class GardenZoneHistory(Base):
     q_watered: Mapped[float | None] = mapped_column(Float, nullable=True)
     t_amended: Mapped[DateTime | None] = mapped_column(DateTime, nullable=True)
     q_amended: Mapped[float | None] = mapped_column(Float, nullable=True)
-    last_modified: Mapped[DateTime] = mapped_column(DateTime, default=func.now(), onupdate=func.now())
+    last_modified: Mapped[DateTime] = mapped_column(DateTime, default=datetime.now, onupdate=datetime.now)
 
     coverage: Mapped[list["Cell"]] = relationship(
         back_populates="zone_history",
         cascade="all, delete-orphan"
     )
 
+ZONE_HISTORY_FIELDS = (
+    "display_name", "color", "border_path", "border_holes", "ph", "temp", "moisture",
+    "sunshine", "compaction", "sand", "silt", "clay", "t_watered", "dt_watered", "q_watered",
+    "t_amended", "q_amended",
+)
+zone_history = history.Chain(GardenZoneHistory, "garden_zone_id", "garden_zone_history_id", ZONE_HISTORY_FIELDS)
+
 @event.listens_for(GardenZone, "before_update")
 def track_garden_zone_history(mapper, connection, target: GardenZone):
     session = object_session(target)
@@ -196,42 +253,31 @@ def track_garden_zone_history(mapper, connection, target: GardenZone):
         return
     session.info[f"_history_created_for_{target.id}"] = True
 
-    history_entry = GardenZoneHistory(
-        garden_zone_id=db_state.id,
-        display_name=db_state.display_name,
-        color=db_state.color,
-        border_path=db_state.border_path,
-        ph=db_state.ph,
-        temp=db_state.temp,
-        moisture=db_state.moisture,
-        sunshine=db_state.sunshine,
-        compaction=db_state.compaction,
-        sand=db_state.sand,
-        silt=db_state.silt,
-        clay=db_state.clay,
-        t_watered=db_state.t_watered,
-        dt_watered=db_state.dt_watered,
-        q_watered=db_state.q_watered,
-        t_amended=db_state.t_amended,
-        q_amended=db_state.q_amended,
-        last_modified=db_state.last_modified,
-    )
+    zone_history.record(connection, db_state)
 
-    for cell in db_state.coverage:
-        copied_cell = Cell(
-            col=cell.col,
-            row=cell.row,
-            color=cell.color,
-            palette_item_id=cell.palette_item_id,
-            serialized=cell.serialized,
-            zone_history=history_entry
-        )
-        history_entry.coverage.append(copied_cell)
+class Tombstone(Base):
+    # Marks a deleted item or zone so delta sync clients can drop it
+    __tablename__ = "T_tombstones"
 
-    session.add(history_entry)
+    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid4()))
+    kind: Mapped[str] = mapped_column(String(16))  # "item" or "zone"
+    object_id: Mapped[str] = mapped_column(String(36))
+    deleted_at: Mapped[DateTime] = mapped_column(DateTime, default=datetime.now, index=True)
+
+class Version(Base):
+    # Write counter behind the ETags of the read endpoints
+    __tablename__ = "T_versions"
+
+    name: Mapped[str] = mapped_column(String(32), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0)
 
 class Cell(Base):
     __tablename__ = "T_cells"
+    __table_args__ = (
+        Index("ix_T_cells_zone_position", "garden_zone_id", "col", "row"),
+        # Cells of any zone at given positions, for merging a stroke into its neighbours
+        Index("ix_T_cells_position", "col", "row", "garden_zone_id"),
+    )
 
     id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid4()), index=True)
     col: Mapped[float] = mapped_column(Float, nullable=False)
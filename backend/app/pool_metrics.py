@@ -0,0 +1,99 @@
+from threading import Lock
+from typing import Dict
+import time
+from sqlalchemy import event, exc
+
+# Upper bounds, in seconds, of the checkout wait histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class PoolMetrics:
+    """
+    Counters of one engine's connection pool.
+
+    Checkout waits are timed around ``Pool.connect``, so they include opening
+    a new connection when the pool has none idle. Connections reopened on
+    checkout without having been invalidated first were recycled for
+    exceeding ``pool_recycle``.
+    """
+
+    def __init__(self):
+        self.connects = 0
+        self.recycled = 0
+        self.invalidated = 0
+        self.timeouts = 0
+        self.wait_count = 0
+        self.wait_sum = 0.0
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS) + 1)
+        self._lock = Lock()
+
+    def observe_wait(self, seconds: float):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_sum += seconds
+            for i, bound in enumerate(WAIT_BUCKETS):
+                if seconds <= bound:
+                    self.wait_buckets[i] += 1
+                    break
+            else:
+                self.wait_buckets[-1] += 1
+
+    def watch(self, target):
+        """Count connects, recycles and invalidations of the pool of ``target``, an Engine or Pool."""
+
+        @event.listens_for(target, "connect")
+        def on_connect(_dbapi_connection, record):
+            with self._lock:
+                self.connects += 1
+                if record.record_info.pop("invalidated", False):
+                    return
+                if record.record_info.get("connected"):
+                    self.recycled += 1
+            record.record_info["connected"] = True
+
+        @event.listens_for(target, "invalidate")
+        @event.listens_for(target, "soft_invalidate")
+        def on_invalidate(_dbapi_connection, record, _exception):
+            with self._lock:
+                self.invalidated += 1
+            record.record_info["invalidated"] = True
+
+    def stats(self, pool) -> dict:
+        live = {"pool": pool.status()}
+        for name in ("size", "checkedin", "checkedout", "overflow"):
+            # SingletonThreadPool and StaticPool don't track these
+            if hasattr(pool, name):
+                live[name] = getattr(pool, name)()
+        with self._lock:
+            cumulative = 0
+            buckets: Dict[str, int] = {}
+            for bound, count in zip((*WAIT_BUCKETS, "+Inf"), self.wait_buckets):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            return {
+                **live,
+                "connects": self.connects,
+                "recycled": self.recycled,
+                "invalidated": self.invalidated,
+                "timeouts": self.timeouts,
+                "wait_seconds": {"count": self.wait_count, "sum": self.wait_sum, "buckets": buckets},
+            }
+
+
+def timed_pool(pool_class, metrics: PoolMetrics):
+    """A subclass of ``pool_class`` timing every checkout into ``metrics``."""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = pool_class.connect(self)
+        except exc.TimeoutError:
+            with metrics._lock:
+                metrics.timeouts += 1
+            metrics.observe_wait(time.perf_counter() - start)
+            raise
+        metrics.observe_wait(time.perf_counter() - start)
+        return connection
+
+    # Pool.recreate() builds the new pool from type(self), so the timing survives dispose()
+    return type(f"Timed{pool_class.__name__}", (pool_class,), {"connect": connect, "metrics": metrics})
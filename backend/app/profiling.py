@@ -0,0 +1,191 @@
+"""
+Opt-in profiling of single requests, for finding where a slow request spends its time.
+
+Start the server with PROFILING=true, then send a request with an
+``X-Profile: 1`` header or a ``profile=1`` query parameter. The request runs
+under cProfile, every SQL statement is recorded with its duration, and two
+files land in PROFILE_DIR:
+
+- ``<time>-<method>-<path>.prof``, the merged cProfile stats (``python -m pstats``, snakeviz)
+- ``<time>-<method>-<path>.json``, a summary with the slowest functions, every
+  statement, and statements repeated PROFILE_REPEAT_THRESHOLD times or more,
+  the usual sign of an N+1 query
+
+With PROFILING off nothing here is installed: no middleware, no engine
+events, and ``database.run_sync`` skips its only check.
+"""
+from contextvars import ContextVar
+from urllib.parse import parse_qs
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import time
+from sqlalchemy import event
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("PROFILING", "false").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+REPEAT_THRESHOLD = int(os.getenv("PROFILE_REPEAT_THRESHOLD", "3"))
+TOP_FUNCTIONS = 40
+
+
+class RequestProfile:
+    """cProfile runs and SQL statements of one profiled request."""
+
+    def __init__(self):
+        self.profiles: list[cProfile.Profile] = []
+        self.statements: list[dict] = []
+
+    def profiled(self, fn):
+        """Wrap ``fn`` to run under its own profiler, for calls made on worker threads."""
+
+        def run(*args, **kwargs):
+            profile = cProfile.Profile()
+            self.profiles.append(profile)
+            profile.enable()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profile.disable()
+
+        return run
+
+    def stats(self) -> pstats.Stats | None:
+        profiles = [profile for profile in self.profiles if profile.getstats()]
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0], stream=io.StringIO())
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def repeated(self) -> list[dict]:
+        groups: dict[str, dict] = {}
+        for statement in self.statements:
+            group = groups.setdefault(statement["sql"], {"sql": statement["sql"], "count": 0, "ms": 0.0, "parameters": set()})
+            group["count"] += 1
+            group["ms"] += statement["ms"]
+            group["parameters"].add(statement["parameters"])
+        return sorted(
+            (
+                {**group, "ms": round(group["ms"], 3), "parameters": len(group["parameters"])}
+                for group in groups.values() if group["count"] >= REPEAT_THRESHOLD
+            ),
+            key=lambda group: -group["count"],
+        )
+
+
+# The profile of the current request, None when it isn't profiled
+current: ContextVar[RequestProfile | None] = ContextVar("profile", default=None)
+
+
+def watch_engine(engine):
+    """Record the statements of ``engine`` (a sync Engine) run by profiled requests."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timer(connection, _cursor, _statement, _parameters, _context, _executemany):
+        if current.get() is not None:
+            connection.info.setdefault("profile_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_timer(connection, _cursor, statement, parameters, _context, executemany):
+        profile = current.get()
+        if profile is None:
+            return
+        elapsed = time.perf_counter() - connection.info["profile_start"].pop()
+        profile.statements.append({
+            "sql": statement,
+            "parameters": repr(parameters)[:500],
+            "executemany": executemany,
+            "ms": round(elapsed * 1000, 3),
+        })
+
+
+def _wants_profile(scope) -> bool:
+    for name, value in scope["headers"]:
+        if name == b"x-profile":
+            return value not in (b"", b"0", b"false")
+    query = parse_qs(scope.get("query_string", b"").decode())
+    return query.get("profile", ["0"])[-1] not in ("", "0", "false")
+
+
+def _write(profile: RequestProfile, method: str, path: str, status: int, elapsed: float) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_") or "root"
+    base = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{method}-{slug}")
+
+    top = []
+    stats = profile.stats()
+    if stats is not None:
+        stats.dump_stats(base + ".prof")
+        rows = sorted(stats.stats.items(), key=lambda item: -item[1][3])[:TOP_FUNCTIONS]
+        for (filename, line, function), (_, calls, tottime, cumtime, _) in rows:
+            top.append({
+                "function": f"{filename}:{line}({function})",
+                "calls": calls,
+                "tottime_ms": round(tottime * 1000, 3),
+                "cumtime_ms": round(cumtime * 1000, 3),
+            })
+
+    summary = {
+        "method": method,
+        "path": path,
+        "status": status,
+        "duration_ms": round(elapsed * 1000, 3),
+        "db": {
+            "statements": len(profile.statements),
+            "ms": round(sum(statement["ms"] for statement in profile.statements), 3),
+        },
+        "repeated_statements": profile.repeated(),
+        "top_functions": top,
+        "statements": profile.statements,
+    }
+    with open(base + ".json", "w") as file:
+        json.dump(summary, file, indent=2)
+    return base
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling the requests that ask for it, only installed with PROFILING on."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _wants_profile(scope):
+            return await self.app(scope, receive, send)
+
+        profile = RequestProfile()
+        token = current.set(profile)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        # Covers the event loop thread, including AsyncSession greenlets; threadpool
+        # calls get their own profilers through database.run_sync. Other requests
+        # running concurrently on the loop show up here too.
+        loop_profile = cProfile.Profile()
+        profile.profiles.append(loop_profile)
+        start = time.perf_counter()
+        loop_profile.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            loop_profile.disable()
+            elapsed = time.perf_counter() - start
+            current.reset(token)
+            base = await run_in_threadpool(_write, profile, scope["method"], scope["path"], status, elapsed)
+            repeated = profile.repeated()
+            if repeated:
+                logger.warning("repeated statements", extra={"profile": base, "repeated": [group["count"] for group in repeated]})
+            logger.info("profiled request", extra={"profile": base, "statements": len(profile.statements)})
@@ -0,0 +1,334 @@
+from typing import Dict, Iterable, List, Set, Tuple
+import numpy as np
+
+# Marker for grid squares that are not painted
+EMPTY = -1
+
+# Refuse to allocate grids that are much larger than the number of cells they hold
+MAX_GRID_SPARSITY = 64
+
+
+def intern_attributes(
+    colors: Iterable[str | None],
+    palette_item_ids: Iterable[str | None],
+) -> Tuple[np.ndarray, List[Tuple[str | None, str | None]]]:
+    """Map every (color, palette_item_id) pair to a small integer code."""
+    keys = list(zip(colors, palette_item_ids))
+    table: Dict[Tuple[str | None, str | None], int] = {
+        key: code for code, key in enumerate(dict.fromkeys(keys))
+    }
+    codes = np.fromiter(map(table.__getitem__, keys), dtype=np.int32, count=len(keys))
+    return codes, list(table)
+
+
+def deduplicate(cols: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """
+    Return the indices of the entries that survive when later cells overwrite
+    earlier ones at the same position, ordered by first appearance of the position.
+    This mirrors building a ``{(col, row): cell}`` dict from the input.
+    """
+    if cols.size == 0:
+        return np.zeros(0, dtype=np.intp)
+    keys = np.stack([cols, rows], axis=1)
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    last = np.zeros(first.size, dtype=np.intp)
+    np.maximum.at(last, inverse, np.arange(cols.size))
+    return last[np.argsort(first, kind="stable")]
+
+
+def fits_dense_grid(cols: np.ndarray, rows: np.ndarray) -> bool:
+    """Whether the bounding box of the cells is small enough to rasterize."""
+    if cols.size == 0:
+        return True
+    area = (int(cols.max()) - int(cols.min()) + 3) * (int(rows.max()) - int(rows.min()) + 3)
+    return area <= MAX_GRID_SPARSITY * cols.size + 4096
+
+
+def pack(cols: np.ndarray, rows: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Paint ``values`` into a dense grid with a one-square EMPTY border.
+    Returns the grid (indexed ``[row, col]``) and the (col, row) of its top-left square.
+    Positions must be unique (see ``deduplicate``).
+    """
+    if cols.size == 0:
+        return np.full((2, 2), EMPTY, dtype=np.int32), (0, 0)
+    origin = (int(cols.min()) - 1, int(rows.min()) - 1)
+    width = int(cols.max()) - origin[0] + 2
+    height = int(rows.max()) - origin[1] + 2
+    grid = np.full((height, width), EMPTY, dtype=np.int32)
+    grid[rows - origin[1], cols - origin[0]] = values
+    return grid, origin
+
+
+def label(grid: np.ndarray) -> Tuple[np.ndarray, int]:
+    """
+    Label 4-connected components of equal, non-EMPTY codes.
+
+    Works as a vectorized union-find: every round hooks the larger root of each
+    unresolved edge onto the smaller one, then compresses all paths by pointer
+    jumping. Returns the label grid (EMPTY outside components, 0..n-1 inside)
+    and the number of components.
+    """
+    height, width = grid.shape
+    index = np.arange(grid.size, dtype=np.int64).reshape(height, width)
+    painted = grid != EMPTY
+
+    horizontal = (grid[:, :-1] == grid[:, 1:]) & painted[:, :-1]
+    vertical = (grid[:-1, :] == grid[1:, :]) & painted[:-1, :]
+    a = np.concatenate([index[:, :-1][horizontal], index[:-1, :][vertical]])
+    b = np.concatenate([index[:, 1:][horizontal], index[1:, :][vertical]])
+
+    roots = _union(grid.size, a, b).reshape(height, width)
+    labels = np.full(grid.shape, EMPTY, dtype=np.int32)
+    unique_roots, compact = np.unique(roots[painted], return_inverse=True)
+    labels[painted] = compact.ravel()
+    return labels, int(unique_roots.size)
+
+
+def _union(size: int, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Root of every node 0..size-1 once the edges ``a[i] - b[i]`` are joined."""
+    parent = np.arange(size, dtype=np.int64)
+    while a.size:
+        root_a, root_b = parent[a], parent[b]
+        pending = root_a != root_b
+        if not pending.any():
+            break
+        a, b = a[pending], b[pending]
+        root_a, root_b = root_a[pending], root_b[pending]
+        np.minimum.at(parent, np.maximum(root_a, root_b), np.minimum(root_a, root_b))
+        while True:
+            jumped = parent[parent]
+            if np.array_equal(jumped, parent):
+                break
+            parent = jumped
+    return parent
+
+
+def _neighbors(cols: np.ndarray, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Index pairs of 4-adjacent cells without a grid: ``(left, right)`` of
+    horizontal and ``(above, below)`` of vertical neighbors. Positions must be unique.
+    """
+    by_row = np.lexsort((cols, rows))
+    right = (rows[by_row[1:]] == rows[by_row[:-1]]) & (cols[by_row[1:]] == cols[by_row[:-1]] + 1)
+    by_col = np.lexsort((rows, cols))
+    below = (cols[by_col[1:]] == cols[by_col[:-1]]) & (rows[by_col[1:]] == rows[by_col[:-1]] + 1)
+    return by_row[:-1][right], by_row[1:][right], by_col[:-1][below], by_col[1:][below]
+
+
+def label_cells(cols: np.ndarray, rows: np.ndarray, codes: np.ndarray) -> Tuple[np.ndarray, int]:
+    """
+    ``label`` for paints too sparse for ``pack``: the component, 0..n-1, of
+    every cell, found from sorted positions in O(cells log cells) memory and
+    time whatever the bounding box. Positions must be unique.
+    """
+    left, right, above, below = _neighbors(cols, rows)
+    a = np.concatenate([left, above])
+    b = np.concatenate([right, below])
+    same = codes[a] == codes[b]
+    roots = _union(cols.size, a[same], b[same])
+    unique_roots, compact = np.unique(roots, return_inverse=True)
+    return compact.ravel().astype(np.int32), int(unique_roots.size)
+
+
+def component_rings(cols: np.ndarray, rows: np.ndarray) -> Tuple[List[Tuple[int, int]], List[List[Tuple[int, int]]]]:
+    """
+    ``(outer, holes)`` of one 4-connected set of cells, as ``trace_rings``
+    gives them. Traced on a grid of the set's own bounding box, or, for thin
+    shapes spanning a box too large to allocate, by linking its boundary edges.
+    """
+    if cols.size == 1:
+        x, y = int(cols[0]), int(rows[0])
+        return [(x, y), (x + 1, y), (x + 1, y + 1), (x, y + 1)], []
+    if fits_dense_grid(cols, rows):
+        grid, origin = pack(cols, rows, np.zeros(cols.size, dtype=np.int32))
+        return trace_rings(grid, origin, 1)[0]
+
+    left, right, above, below = _neighbors(cols, rows)
+    edges: Set[Tuple[int, int, Tuple[int, int]]] = set()
+    for side, has_neighbor, (dx, dy) in (
+        (EAST, below, (0, 0)),
+        (SOUTH, left, (1, 0)),
+        (WEST, above, (1, 1)),
+        (NORTH, right, (0, 1)),
+    ):
+        # An edge on the side of a cell whose neighbor there is not in the set;
+        # EAST edges run along the top, so they need the cell above
+        open_side = np.ones(cols.size, dtype=bool)
+        open_side[has_neighbor] = False
+        for x, y in zip((cols[open_side] + dx).tolist(), (rows[open_side] + dy).tolist()):
+            edges.add((x, y, side))
+    rings = _follow_edges(edges)
+    rings.sort(key=ring_area, reverse=True)
+    return rings[0], rings[1:]
+
+
+# Ring walking directions in grid coordinates (y grows downwards)
+EAST, SOUTH, WEST, NORTH = (1, 0), (0, 1), (-1, 0), (0, -1)
+
+# Offsets, relative to an edge's start vertex, of the squares on either side of the edge
+_RIGHT_OF = {EAST: (0, 0), SOUTH: (-1, 0), WEST: (-1, -1), NORTH: (0, -1)}
+_LEFT_OF = {EAST: (0, -1), SOUTH: (0, 0), WEST: (-1, 0), NORTH: (-1, -1)}
+# Turn preference: right first keeps diagonally touching squares apart (4-connectivity)
+_TURNS = {
+    EAST: (SOUTH, EAST, NORTH),
+    SOUTH: (WEST, SOUTH, EAST),
+    WEST: (NORTH, WEST, SOUTH),
+    NORTH: (EAST, NORTH, WEST),
+}
+
+
+def ring_area(ring: List[Tuple[int, int]]) -> float:
+    """Signed shoelace area; positive for rings that run clockwise on screen."""
+    total = 0
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+        total += x1 * y2 - x2 * y1
+    return total / 2
+
+
+def trace_rings(
+    labels: np.ndarray,
+    origin: Tuple[int, int],
+    count: int | None = None,
+) -> List[Tuple[List[Tuple[int, int]], List[List[Tuple[int, int]]]]]:
+    """
+    Trace the outline of every labeled component as closed rings of unit vertices.
+
+    Each ring is walked with the component on its right, so outer rings run
+    clockwise on screen and holes run counter-clockwise. Every boundary edge is
+    visited exactly once, so the cost is proportional to the perimeter once the
+    starting edges are known. Returns one ``(outer, holes)`` pair per label, in
+    label order, with vertices in garden coordinates.
+    """
+    if count is None:
+        count = int(labels.max()) + 1 if labels.size else 0
+    rings: List[Tuple[List[Tuple[int, int]], List[List[Tuple[int, int]]]]] = [
+        ([], []) for _ in range(count)
+    ]
+
+    # Every ring has at least one eastbound edge along the top of a square,
+    # scanning those in raster order meets each component's outer ring first.
+    top = (labels[1:, :] != labels[:-1, :]) & (labels[1:, :] != EMPTY)
+    start_ys, start_xs = np.nonzero(top)
+    start_ys = start_ys + 1
+    owners = labels[start_ys, start_xs]
+    order = np.lexsort((start_xs, start_ys, owners))
+
+    grid = labels.tolist()
+    ox, oy = origin
+    traced = set()
+
+    for y0, x0, k in zip(start_ys[order].tolist(), start_xs[order].tolist(), owners[order].tolist()):
+        if (x0, y0) in traced:
+            continue
+
+        ring = []
+        x, y, d = x0, y0, EAST
+        while True:
+            ring.append((x + ox, y + oy))
+            if d == EAST:
+                traced.add((x, y))
+            x, y = x + d[0], y + d[1]
+            for turn in _TURNS[d]:
+                rx, ry = _RIGHT_OF[turn]
+                lx, ly = _LEFT_OF[turn]
+                if grid[y + ry][x + rx] == k and grid[y + ly][x + lx] != k:
+                    d = turn
+                    break
+            if (x, y) == (x0, y0) and d == EAST:
+                break
+
+        outer, holes = rings[k]
+        if not outer and ring_area(ring) > 0:
+            outer.extend(ring)
+        else:
+            holes.append(ring)
+
+    return rings
+
+
+def _follow_edges(edges: Set[Tuple[int, int, Tuple[int, int]]]) -> List[List[Tuple[int, int]]]:
+    """Link directed boundary edges ``(x, y, direction)`` into closed rings."""
+    outgoing: Dict[Tuple[int, int], List[Tuple[int, int]]] = {}
+    for x, y, d in sorted(edges, key=lambda e: (e[1], e[0])):
+        outgoing.setdefault((x, y), []).append(d)
+
+    rings = []
+    while outgoing:
+        # The top-left vertex with an eastbound edge starts an outer ring first
+        start = min(outgoing, key=lambda v: (v[1], v[0]))
+        first = EAST if EAST in outgoing[start] else outgoing[start][0]
+        vertex, d = start, first
+        ring = []
+        while True:
+            ring.append(vertex)
+            directions = outgoing[vertex]
+            directions.remove(d)
+            if not directions:
+                del outgoing[vertex]
+            vertex = (vertex[0] + d[0], vertex[1] + d[1])
+            for turn in _TURNS[d]:
+                if (vertex == start and turn == first) or turn in outgoing.get(vertex, ()):
+                    d = turn
+                    break
+            else:
+                raise ValueError(f"Outline is not closed at {vertex}")
+            if vertex == start and d == first:
+                break
+        rings.append(ring)
+    return rings
+
+
+def splice_rings(
+    rings: List[List[Tuple[int, int]]],
+    origin: Tuple[int, int],
+    inside: np.ndarray,
+) -> Tuple[List[Tuple[int, int]], List[List[Tuple[int, int]]]]:
+    """
+    Rebuild an outline after the squares of a window have changed.
+
+    ``inside`` marks which squares of the window (top-left square at
+    ``origin``) belong to the shape now. Edges between two squares of the
+    window are recomputed from it, every other edge is kept from the old
+    ``rings``. Changed squares must not lie on the window's own border. Edges
+    that two merged outlines share cancel out. Returns ``(outer, holes)`` with
+    the same winding as ``trace_rings``; raises ``ValueError`` when the old
+    rings do not describe a closed outline.
+    """
+    ox, oy = origin
+    height, width = inside.shape
+
+    def in_window(cx: int, cy: int) -> bool:
+        return ox <= cx < ox + width and oy <= cy < oy + height
+
+    edges: Set[Tuple[int, int, Tuple[int, int]]] = set()
+    for ring in rings:
+        for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+            d = (x2 - x1, y2 - y1)
+            rx, ry = _RIGHT_OF[d]
+            lx, ly = _LEFT_OF[d]
+            if in_window(x1 + rx, y1 + ry) and in_window(x1 + lx, y1 + ly):
+                continue
+            reverse = (x2, y2, (-d[0], -d[1]))
+            if reverse in edges:
+                edges.discard(reverse)
+            else:
+                edges.add((x1, y1, d))
+
+    # Edges between two window squares, keyed by the vertex they start from
+    for d, mask, (dx, dy) in (
+        (EAST, inside[1:, :] & ~inside[:-1, :], (0, 1)),
+        (SOUTH, inside[:, :-1] & ~inside[:, 1:], (1, 0)),
+        (WEST, inside[:-1, :] & ~inside[1:, :], (1, 1)),
+        (NORTH, inside[:, 1:] & ~inside[:, :-1], (1, 1)),
+    ):
+        ys, xs = np.nonzero(mask)
+        for x, y in zip((xs + ox + dx).tolist(), (ys + oy + dy).tolist()):
+            edges.add((x, y, d))
+
+    traced = _follow_edges(edges)
+    if not traced:
+        return [], []
+    traced.sort(key=ring_area, reverse=True)
+    return traced[0], traced[1:]
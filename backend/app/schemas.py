@@ -1,8 +1,8 @@
-from pydantic import BaseModel, Field, AliasChoices, computed_field, model_validator
+from pydantic import BaseModel, BeforeValidator, Field, AliasChoices, computed_field, model_validator
 from sqlalchemy.ext.hybrid import hybrid_property
-from typing import List, Tuple, Literal, Any, Dict, ClassVar
+from typing import Annotated, List, Tuple, Literal, Any, Dict, ClassVar
 from datetime import datetime
-from app.utils import calculate_location
+from app.utils import calculate_location, expand_ranges
 
 class Vec2(BaseModel):
     x: float
@@ -49,6 +49,15 @@ class Cell(BaseModel):
         from_attributes = True
         populate_by_name = True
 
+class CoverageRanges(BaseModel):
+    # Compact coverage, opted into with coverage_format=ranges: palette[i] is
+    # painted over every range in ranges[i], "B3:F9" or "B3" for a single cell
+    palette: List[Tuple[str | None, str | None]]
+    ranges: List[List[str]]
+
+# Coverage on input, either form is accepted and becomes a list of cells
+CoverageInput = Annotated[List[Cell], BeforeValidator(expand_ranges, json_schema_input_type=List[Cell] | CoverageRanges)]
+
 class GardenItemBase(BaseModel):
     id: str
     palette_item_id: str
@@ -58,7 +67,7 @@ class GardenItemBase(BaseModel):
     width: float
     height: float
     rotation: float | None = None
-    coverage: List[Cell] | None = None
+    coverage: CoverageInput | None = None
     category: str
     sub_category: str | None = None
     wcvp_id: str | None = None
@@ -97,7 +106,7 @@ class GardenItemHistory(BaseModel):
     width: float
     height: float
     rotation: float | None = None
-    coverage: List[Cell] | None = None
+    coverage: List[Cell] | None = Field(default=None, validation_alias=AliasChoices("coverage_cells", "coverage"))
     category: str
     sub_category: str | None = None
     wcvp_id: str | None = None
@@ -117,7 +126,8 @@ class GardenItemHistory(BaseModel):
         from_attributes = True
         populate_by_name = True
 
-class GardenItemRead(BaseModel):
+class GardenItemSummary(BaseModel):
+    # Everything but the coverage, for list views that do not draw cells
     id: str
     palette_item_id: str
     icon: str
@@ -127,7 +137,6 @@ class GardenItemRead(BaseModel):
     width: float
     height: float
     rotation: float | None = None
-    coverage: List[Cell] | None = None
     category: str
     sub_category: str | None = None
     wcvp_id: str | None = None
@@ -153,6 +162,9 @@ class GardenItemRead(BaseModel):
     class Config:
         from_attributes = True
 
+class GardenItemRead(GardenItemSummary):
+    coverage: List[Cell] | CoverageRanges | None = Field(default=None, validation_alias=AliasChoices("coverage_cells", "coverage"))
+
 
 class GardenItemCreate(GardenItemBase):
     pass
@@ -172,7 +184,7 @@ class GardenItemUpdate(BaseModel):
     width: float | None = None
     height: float | None = None
     rotation: float | None = None
-    coverage: List[Cell] | None = None
+    coverage: CoverageInput | None = None
     wcvp_id: str | None = None
     rhs_id: str | None = None
     species: str | None = None
@@ -197,8 +209,9 @@ class GardenZoneBase(BaseModel):
     id: str
     display_name: str | None = None
     color: str
-    coverage: List[Cell]
+    coverage: CoverageInput
     border_path: List[Tuple[int, int]] = None
+    border_holes: List[List[Tuple[int, int]]] | None = None
     ph: float | None = None
     temp: float | None = None
     moisture: float | None = None
@@ -220,8 +233,9 @@ class GardenZoneHistory(BaseModel):
     garden_zone_id: str
     display_name: str | None = None
     color: str
-    coverage: List[Cell]
+    coverage: List[Cell] | None = Field(default=None, validation_alias=AliasChoices("coverage_cells", "coverage"))
     border_path: List[Tuple[int, int]] = None
+    border_holes: List[List[Tuple[int, int]]] | None = None
     ph: float | None = None
     temp: float | None = None
     moisture: float | None = None
@@ -243,8 +257,11 @@ class GardenZoneUpdate(BaseModel):
     id: str
     display_name: str | None = None
     color: str | None = None
-    coverage: List[Cell] | None = None
+    coverage: CoverageInput | None = None
+    coverage_added: CoverageInput | None = None
+    coverage_removed: CoverageInput | None = None
     border_path: List[Tuple[int, int]] | None = None
+    border_holes: List[List[Tuple[int, int]]] | None = None
     ph: float | None = None
     temp: float | None = None
     moisture: float | None = None
@@ -270,9 +287,10 @@ class GardenZoneCreate(GardenZoneBase):
     id: str | None = None
     display_name: str
     color: str | None = None
-    cells: List[Cell]
-    coverage: List[Cell] | None = None
+    cells: CoverageInput
+    coverage: CoverageInput | None = None
     border_path: List[Tuple[int, int]] | None = None
+    border_holes: List[List[Tuple[int, int]]] | None = None
     ph: float | None = None
     temp: float | None = None
     moisture: float | None = None
@@ -289,12 +307,13 @@ class GardenZoneCreate(GardenZoneBase):
         from_attributes = True
         populate_by_name = True
 
-class GardenZoneRead(BaseModel):
+class GardenZoneSummary(BaseModel):
+    # Everything but the coverage, for list views that only draw outlines
     id: str
     display_name: str | None = None
     color: str
-    coverage: List[Cell]
     border_path: List[Tuple[int, int]] = None
+    border_holes: List[List[Tuple[int, int]]] | None = None
     ph: float | None = None
     temp: float | None = None
     moisture: float | None = None
@@ -327,6 +346,9 @@ class GardenZoneRead(BaseModel):
             "clay": {"exclude": True},
         }
 
+class GardenZoneRead(GardenZoneSummary):
+    coverage: List[Cell] | CoverageRanges = Field(validation_alias=AliasChoices("coverage_cells", "coverage"))
+
     class Config:
         from_attributes = True
         fields = {
@@ -337,3 +359,45 @@ class GardenZoneRead(BaseModel):
     
 class GardenZone(GardenZoneBase):
     pass
+
+class ZoneJob(BaseModel):
+    # A zone calculation running in the background, see app/jobs.py
+    id: str
+    status: Literal["queued", "running", "done", "failed"]
+    display_name: str | None = None
+    cells: int
+    created_at: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    zone_ids: List[str] | None = None
+    error: str | None = None
+    # With ?view= once done
+    zones: List[GardenZoneRead] | List[GardenZoneSummary] | None = None
+
+class Tombstones(BaseModel):
+    items: List[str] = []
+    zones: List[str] = []
+
+class SyncRead(BaseModel):
+    # Pass `token` as `since` on the next call
+    token: str
+    items: List[GardenItemRead] | List[GardenItemSummary]
+    zones: List[GardenZoneRead] | List[GardenZoneSummary]
+    deleted: Tombstones
+
+class BatchOperation(BaseModel):
+    op: Literal["create", "update", "delete"]
+    kind: Literal["item", "zone"]
+    id: str | None = None
+    # Same meaning as on PUT, "create" records a history entry
+    operation: Literal["create", "modify"] = "modify"
+    data: Dict[str, Any] | None = None
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation]
+
+class BatchResult(BaseModel):
+    index: int
+    status: int
+    data: Any | None = None
+    detail: str | None = None
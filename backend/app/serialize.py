@@ -0,0 +1,207 @@
+"""
+Read responses built straight from ORM rows, without the read schemas.
+
+Validating a row through ``GardenItemRead`` or ``GardenZoneRead`` re-checks
+every field and builds a ``Cell`` model per coverage cell, only to dump it
+again. The rows come from our own tables, so the functions here copy the same
+attributes into plain dicts, in the schemas' field order and with their
+conversions, and orjson encodes them. The bytes match the schemas' own
+``model_dump_json``, except that floats of 1e16 and above spell their
+exponent ``1e16`` rather than ``1e+16``.
+
+Keep these in step with the read schemas when either changes.
+"""
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Iterable, Iterator, Literal
+import orjson
+from fastapi.responses import JSONResponse
+from app import coverage as coverage_codec
+from app.utils import calculate_location, encode_ranges
+
+# Pydantic writes aware UTC datetimes with a Z, orjson would write +00:00
+OPTIONS = orjson.OPT_UTC_Z
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, option=OPTIONS)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse encoded with orjson, for content that is already plain dicts and lists."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def _int(value):
+    # Float columns behind int fields, the schemas coerce them
+    return None if value is None else int(value)
+
+
+def cells(owner) -> list[dict]:
+    """The coverage of an item or zone as ``Cell`` dicts, whichever way it is stored."""
+    if owner.coverage_blob is not None:
+        return coverage_codec.decode_cells(owner.coverage_blob)
+    if owner.loaded_cells is not None:
+        return owner.loaded_cells
+    return [
+        {"col": int(cell.col), "row": int(cell.row), "color": cell.color, "palette_item_id": cell.palette_item_id}
+        for cell in owner.coverage
+    ]
+
+
+def ranges(owner) -> dict | list[dict]:
+    """
+    The coverage as ``utils.encode_ranges`` output, for coverage_format=ranges.
+    Coverage reaching left of column A has no range form and stays a cell list.
+    """
+    if owner.coverage_blob is not None:
+        cols, rows, colors, palette_item_ids = coverage_codec.decode(owner.coverage_blob)
+    else:
+        plain = cells(owner)
+        cols = [cell["col"] for cell in plain]
+        rows = [cell["row"] for cell in plain]
+        colors = [cell["color"] for cell in plain]
+        palette_item_ids = [cell["palette_item_id"] for cell in plain]
+    try:
+        return encode_ranges(cols, rows, colors, palette_item_ids)
+    except ValueError:
+        return cells(owner)
+
+
+def item_summary(item) -> dict:
+    """``GardenItemSummary`` of an ORM item."""
+    row = _item_fields(item)
+    row["location"] = calculate_location(item.x, item.y)
+    row["position"] = {"x": item.x, "y": item.y}
+    return row
+
+
+def item_read(item) -> dict:
+    """``GardenItemRead`` of an ORM item, its coverage loaded."""
+    return _item_read(item, cells(item))
+
+
+def item_read_ranges(item) -> dict:
+    """``item_read`` with the coverage in ranges."""
+    return _item_read(item, ranges(item))
+
+
+def _item_read(item, coverage) -> dict:
+    row = _item_fields(item)
+    row["coverage"] = coverage
+    row["location"] = calculate_location(item.x, item.y)
+    row["position"] = {"x": item.x, "y": item.y}
+    return row
+
+
+def item_serializer(view: Literal["full", "summary"], coverage_format: Literal["cells", "ranges"] = "cells") -> Callable:
+    if view == "summary":
+        return item_summary
+    return item_read_ranges if coverage_format == "ranges" else item_read
+
+
+def _item_fields(item) -> dict:
+    return {
+        "id": item.id,
+        "palette_item_id": item.palette_item_id,
+        "icon": item.icon,
+        "display_name": item.display_name,
+        "x": item.x,
+        "y": item.y,
+        "width": item.width,
+        "height": item.height,
+        "rotation": item.rotation,
+        "category": item.category,
+        "sub_category": item.sub_category,
+        "wcvp_id": item.wcvp_id,
+        "rhs_id": item.rhs_id,
+        "species": item.species,
+        "genus": item.genus,
+        "circumference": _int(item.circumference),
+        "price": item.price,
+        "t_watered": item.t_watered,
+        "dt_watered": _int(item.dt_watered),
+        "q_watered": item.q_watered,
+        "t_amended": item.t_amended,
+        "q_amended": item.q_amended,
+    }
+
+
+def zone_summary(zone) -> dict:
+    """``GardenZoneSummary`` of an ORM zone."""
+    row = _zone_fields(zone)
+    row["soil_mix"] = _soil_mix(zone)
+    return row
+
+
+def zone_read(zone) -> dict:
+    """``GardenZoneRead`` of an ORM zone, its coverage loaded."""
+    return _zone_read(zone, cells(zone))
+
+
+def zone_read_ranges(zone) -> dict:
+    """``zone_read`` with the coverage in ranges."""
+    return _zone_read(zone, ranges(zone))
+
+
+def _zone_read(zone, coverage) -> dict:
+    row = _zone_fields(zone)
+    row["coverage"] = coverage
+    row["soil_mix"] = _soil_mix(zone)
+    return row
+
+
+def zone_serializer(view: Literal["full", "summary"], coverage_format: Literal["cells", "ranges"] = "cells") -> Callable:
+    if view == "summary":
+        return zone_summary
+    return zone_read_ranges if coverage_format == "ranges" else zone_read
+
+
+def _zone_fields(zone) -> dict:
+    return {
+        "id": zone.id,
+        "display_name": zone.display_name,
+        "color": zone.color,
+        "border_path": zone.border_path,
+        "border_holes": zone.border_holes,
+        "ph": zone.ph,
+        "temp": zone.temp,
+        "moisture": zone.moisture,
+        "sunshine": zone.sunshine,
+        "compaction": zone.compaction,
+        "sand": zone.sand,
+        "silt": zone.silt,
+        "clay": zone.clay,
+        "t_watered": zone.t_watered,
+        "dt_watered": _int(zone.dt_watered),
+        "q_watered": zone.q_watered,
+        "t_amended": zone.t_amended,
+        "q_amended": zone.q_amended,
+    }
+
+
+def _soil_mix(zone) -> dict | None:
+    if zone.sand is None and zone.silt is None and zone.clay is None:
+        return None
+    return {
+        "sand": round((zone.sand or 0.0) * 100, 2),
+        "silt": round((zone.silt or 0.0) * 100, 2),
+        "clay": round((zone.clay or 0.0) * 100, 2),
+    }
+
+
+def encode_list(objects: Iterable, serializer: Callable) -> bytes:
+    """The JSON array bytes of a list response, ``serializer`` one of the functions above."""
+    return dumps([serializer(obj) for obj in objects])
+
+
+def ndjson_lines(objects: Iterable, serializer: Callable) -> Iterator[bytes]:
+    """Encode ORM objects one per line, so a response never holds the whole list."""
+    for obj in objects:
+        yield dumps(serializer(obj)) + b"\n"
+
+
+async def ndjson_lines_async(objects: AsyncIterable, serializer: Callable) -> AsyncIterator[bytes]:
+    """``ndjson_lines`` for the async result streams of an AsyncSession."""
+    async for obj in objects:
+        yield dumps(serializer(obj)) + b"\n"
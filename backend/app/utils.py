@@ -1,5 +1,12 @@
-from typing import List, Union
-from app import schemas
+from typing import List, Tuple, Union
+from datetime import datetime
+import base64
+import json
+import math
+import re
+import struct
+import numpy as np
+from app import raster, schemas
 
 def to_column_letter(col: int) -> str:
     letter = ''
@@ -8,11 +15,61 @@ def to_column_letter(col: int) -> str:
         col = (col // 26) - 1
     return letter
 
+def from_column_letter(letters: str) -> int:
+    """Inverse of ``to_column_letter``."""
+    col = 0
+    for letter in letters:
+        col = col * 26 + ord(letter) - 64
+    return col - 1
+
 def calculate_location(x: float, y: float, cell_size: int = 20) -> str:
     col = int(x // cell_size) + 1
     row = int(y // cell_size) + 1
     return f"{to_column_letter(col)}{row}"
 
+def item_bounds(x: float, y: float, width: float, height: float, rotation: float | None = None) -> Tuple[float, float, float, float]:
+    """Bounding box (min_x, min_y, max_x, max_y) of an item in map pixels."""
+    if rotation:
+        # Whatever the rotation origin, the item stays within its diagonal of (x, y)
+        reach = math.hypot(width, height)
+        return x - reach, y - reach, x + reach, y + reach
+    return x, y, x + width, y + height
+
+def ring_bounds(ring: List[Tuple[int, int]], cell_size: int = 20) -> Tuple[float, float, float, float] | None:
+    """Bounding box of a zone outline, given in cells, in map pixels."""
+    if not ring:
+        return None
+    xs = [point[0] for point in ring]
+    ys = [point[1] for point in ring]
+    return min(xs) * cell_size, min(ys) * cell_size, max(xs) * cell_size, max(ys) * cell_size
+
+def parse_bbox(value: str | None) -> Tuple[float, float, float, float] | None:
+    """Parse a ``min_x,min_y,max_x,max_y`` query parameter."""
+    if value is None:
+        return None
+    parts = value.split(",")
+    if len(parts) != 4:
+        raise ValueError("bbox must be min_x,min_y,max_x,max_y")
+    min_x, min_y, max_x, max_y = (float(part) for part in parts)
+    if min_x > max_x or min_y > max_y:
+        raise ValueError("bbox minimum must not exceed its maximum")
+    return min_x, min_y, max_x, max_y
+
+def encode_cursor(last_modified: datetime, id: str) -> str:
+    """Opaque page token for the row a page ended on."""
+    raw = json.dumps([last_modified.isoformat(), id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(token: str | None) -> Tuple[datetime, str] | None:
+    """Inverse of ``encode_cursor``, raises ValueError on a malformed token."""
+    if token is None:
+        return None
+    try:
+        last_modified, id = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return datetime.fromisoformat(last_modified), str(id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
 def get_covered_cells(x: float, y: float, width: float, height: float, cell_size: int = 20) -> list[tuple[int, int]]:
     col_start = int(x // cell_size) + 1
     row_start = int(y // cell_size) + 1
@@ -26,4 +83,159 @@ def get_covered_cells(x: float, y: float, width: float, height: float, cell_size
 
 def serialize_cells(cells: List[Union[dict, 'schemas.Cell']]) -> List[str]:
     """Convert list of cells to Excel-style cell references (e.g. 'B3')."""
-    return [f"{to_column_letter(cell.col)}{cell.row}" for cell in cells]
\ No newline at end of file
+    return [f"{to_column_letter(cell.col)}{cell.row}" for cell in cells]
+
+def serialize_positions(cols: np.ndarray, rows: np.ndarray) -> List[str]:
+    """Vectorized serialize_cells for arrays of column and row numbers."""
+    cols = np.asarray(cols, dtype=np.int64)
+    rows = np.asarray(rows, dtype=np.int64)
+    unique_cols, inverse = np.unique(cols, return_inverse=True)
+    letters = np.array([to_column_letter(int(col)) for col in unique_cols], dtype=object)
+    return (letters[inverse.ravel()] + rows.astype(str).astype(object)).tolist()
+
+# "B3" or "B3:F9", rows may be negative
+_RANGE = re.compile(r"([A-Z]+)(-?[0-9]+)(?::([A-Z]+)(-?[0-9]+))?")
+
+# Most cells a ranges coverage may expand to, a few bytes of ranges can describe billions
+MAX_RANGE_CELLS = 4_000_000
+
+def encode_ranges(cols: np.ndarray, rows: np.ndarray, colors, palette_item_ids) -> dict:
+    """
+    Compact wire form of a coverage: ``{"palette": [[color, palette_item_id], ...],
+    "ranges": [[range, ...], ...]}`` where ``ranges[i]`` lists the rectangles
+    painted with ``palette[i]`` as Excel-style ranges, "B3:F9" or "B3" for a
+    single cell. Each row is split into runs of one paint, and runs spanning
+    the same columns in consecutive rows are stacked into one rectangle.
+    Raises ValueError for columns left of A, which have no letter.
+    """
+    cols = np.asarray(cols, dtype=np.int64)
+    rows = np.asarray(rows, dtype=np.int64)
+    if cols.size == 0:
+        return {"palette": [], "ranges": []}
+    if cols.min() < 0:
+        raise ValueError("Columns left of A have no range reference")
+    keep = raster.deduplicate(cols, rows)
+    codes, palette = raster.intern_attributes(
+        (colors[i] for i in keep.tolist()), (palette_item_ids[i] for i in keep.tolist())
+    )
+    cols, rows = cols[keep], rows[keep]
+
+    # Runs of consecutive columns in one row and paint
+    order = np.lexsort((cols, rows, codes))
+    cols, rows, codes = cols[order], rows[order], codes[order]
+    starts = np.flatnonzero(np.concatenate(([True], (codes[1:] != codes[:-1]) | (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1] + 1))))
+    ends = np.append(starts[1:], cols.size) - 1
+    code, row, first, last = codes[starts], rows[starts], cols[starts], cols[ends]
+
+    # Runs of the same paint and columns in consecutive rows form a rectangle
+    order = np.lexsort((row, last, first, code))
+    code, row, first, last = code[order], row[order], first[order], last[order]
+    tops = np.flatnonzero(np.concatenate(([True], (code[1:] != code[:-1]) | (first[1:] != first[:-1]) | (last[1:] != last[:-1]) | (row[1:] != row[:-1] + 1))))
+    bottoms = np.append(tops[1:], row.size) - 1
+    code, first, last, top, bottom = code[tops], first[tops], last[tops], row[tops], row[bottoms]
+
+    # Listed in reading order within each paint
+    order = np.lexsort((first, top, code))
+    code, first, last, top, bottom = code[order], first[order], last[order], top[order], bottom[order]
+    single = ((first == last) & (top == bottom)).tolist()
+    ranges = [[] for _ in palette]
+    for code, start, end, single in zip(code.tolist(), serialize_positions(first, top), serialize_positions(last, bottom), single):
+        ranges[code].append(start if single else f"{start}:{end}")
+    return {"palette": [list(paint) for paint in palette], "ranges": ranges}
+
+def decode_ranges(value: dict) -> List[dict]:
+    """Inverse of ``encode_ranges``, the ``{col, row, color, palette_item_id}`` dicts in row-major order per range."""
+    palette, ranges = value.get("palette"), value.get("ranges")
+    if not isinstance(palette, list) or not isinstance(ranges, list) or len(palette) != len(ranges):
+        raise ValueError("ranges needs one list of ranges per palette entry")
+    cells = []
+    for paint, references in zip(palette, ranges):
+        if not isinstance(paint, (list, tuple)) or len(paint) != 2:
+            raise ValueError("palette entries are [color, palette_item_id] pairs")
+        color, palette_item_id = paint
+        for reference in references:
+            match = _RANGE.fullmatch(reference) if isinstance(reference, str) else None
+            if match is None:
+                raise ValueError(f"Invalid range {reference!r}")
+            first, top = from_column_letter(match[1]), int(match[2])
+            last, bottom = (from_column_letter(match[3]), int(match[4])) if match[3] else (first, top)
+            if last < first or bottom < top:
+                raise ValueError(f"Range {reference!r} must run from its top-left to its bottom-right cell")
+            if len(cells) + (last - first + 1) * (bottom - top + 1) > MAX_RANGE_CELLS:
+                raise ValueError(f"ranges cover more than {MAX_RANGE_CELLS} cells")
+            cells.extend(
+                {"col": col, "row": row, "color": color, "palette_item_id": palette_item_id}
+                for row in range(top, bottom + 1)
+                for col in range(first, last + 1)
+            )
+    return cells
+
+def expand_ranges(value):
+    """Accept a coverage as either a list of cells or ``encode_ranges`` output, as a list of cells."""
+    if isinstance(value, dict):
+        return decode_ranges(value)
+    return value
+
+# Binary zone upload: magic, header, palette as JSON, then width * height
+# little-endian uint16 palette indices in row-major order
+GRID_MAGIC = b"GGR1"
+GRID_HEADER = struct.Struct("<iiIII")  # origin col, origin row, width, height, palette JSON length
+GRID_EMPTY = 0xFFFF
+
+def _palette_codes(palette, codes: np.ndarray) -> Tuple[np.ndarray, List[Tuple[str | None, str | None]]]:
+    # Check the palette and merge repeated entries, one paint has to be one code to form one zone
+    if not isinstance(palette, list) or not all(
+        isinstance(paint, (list, tuple)) and len(paint) == 2
+        and all(value is None or isinstance(value, str) for value in paint)
+        for paint in palette
+    ):
+        raise ValueError("palette must be a list of [color, palette_item_id] pairs")
+    if codes.size and (codes.min() < 0 or codes.max() >= len(palette)):
+        raise ValueError("color_idx must index into the palette")
+    table = {}
+    remap = np.array([table.setdefault(tuple(paint), len(table)) for paint in palette], dtype=np.int32)
+    return remap[codes] if len(palette) else codes.astype(np.int32), list(table)
+
+def decode_columns(payload: dict) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[Tuple[str | None, str | None]]]:
+    """
+    Parse a columnar paint, ``{"cols": [...], "rows": [...], "color_idx": [...],
+    "palette": [[color, palette_item_id], ...]}``, into ``(cols, rows, codes, palette)``
+    arrays. Raises ValueError for anything malformed.
+    """
+    try:
+        cols = np.asarray(payload["cols"], dtype=np.int64)
+        rows = np.asarray(payload["rows"], dtype=np.int64)
+        codes = np.asarray(payload["color_idx"], dtype=np.int64)
+    except (KeyError, TypeError, OverflowError) as e:
+        raise ValueError("cols, rows and color_idx must be lists of integers") from e
+    if cols.ndim != 1 or not cols.shape == rows.shape == codes.shape:
+        raise ValueError("cols, rows and color_idx must be lists of the same length")
+    codes, palette = _palette_codes(payload.get("palette"), codes)
+    return cols, rows, codes, palette
+
+def encode_grid(cols: np.ndarray, rows: np.ndarray, codes: np.ndarray, palette: List[Tuple[str | None, str | None]]) -> bytes:
+    """Pack a paint into the binary upload format, later cells win at the same position."""
+    cols = np.asarray(cols, dtype=np.int64)
+    rows = np.asarray(rows, dtype=np.int64)
+    palette_json = json.dumps([list(paint) for paint in palette], separators=(",", ":")).encode()
+    if cols.size == 0:
+        return GRID_MAGIC + GRID_HEADER.pack(0, 0, 0, 0, len(palette_json)) + palette_json
+    origin_col, origin_row = int(cols.min()), int(rows.min())
+    width, height = int(cols.max()) - origin_col + 1, int(rows.max()) - origin_row + 1
+    grid = np.full((height, width), GRID_EMPTY, dtype="<u2")
+    grid[rows - origin_row, cols - origin_col] = codes
+    return GRID_MAGIC + GRID_HEADER.pack(origin_col, origin_row, width, height, len(palette_json)) + palette_json + grid.tobytes()
+
+def decode_grid(body: bytes) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[Tuple[str | None, str | None]]]:
+    """Inverse of ``encode_grid``, ``(cols, rows, codes, palette)`` in row-major order."""
+    if body[:len(GRID_MAGIC)] != GRID_MAGIC or len(body) < len(GRID_MAGIC) + GRID_HEADER.size:
+        raise ValueError("Not a binary grid upload")
+    origin_col, origin_row, width, height, palette_length = GRID_HEADER.unpack_from(body, len(GRID_MAGIC))
+    offset = len(GRID_MAGIC) + GRID_HEADER.size
+    if len(body) != offset + palette_length + 2 * width * height:
+        raise ValueError("Binary grid size does not match its header")
+    palette = json.loads(body[offset:offset + palette_length])
+    grid = np.frombuffer(body, dtype="<u2", count=width * height, offset=offset + palette_length).reshape(height, width)
+    rows, cols = np.nonzero(grid != GRID_EMPTY)
+    codes, palette = _palette_codes(palette, grid[rows, cols].astype(np.int64))
+    return cols.astype(np.int64) + origin_col, rows.astype(np.int64) + origin_row, codes, palette
@@ -0,0 +1,78 @@
+"""
+Compare coverage write throughput of the ORM path and crud.insert_cells on SQLite.
+
+Run from backend/:
+    python -m benchmarks.bench_cell_writes [--sizes 1000 10000 100000]
+"""
+import argparse
+import os
+import tempfile
+import time
+import uuid
+
+# The app reads its database URL at import time
+_DB_FILE = os.path.join(tempfile.mkdtemp(prefix="garden-bench-"), "bench.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_DB_FILE}")
+
+from app import schemas  # noqa: E402  (schemas first, models imports utils -> schemas)
+from app import crud, models  # noqa: E402
+from app.database import Base, SessionLocal, engine  # noqa: E402
+
+
+def make_cells(count: int) -> list[schemas.Cell]:
+    side = int(count ** 0.5) + 1
+    return [
+        schemas.Cell(col=i % side, row=i // side, color="#7cb342", palette_item_id="g01")
+        for i in range(count)
+    ]
+
+
+def make_zone(db) -> str:
+    zone = models.GardenZone(id=str(uuid.uuid4()), display_name="bench", color="#7cb342", border_path=[])
+    db.add(zone)
+    db.commit()
+    return zone.id
+
+
+def write_orm(db, zone_id: str, cells: list[schemas.Cell]) -> None:
+    db.add_all([
+        models.Cell(
+            id=str(uuid.uuid4()),
+            col=cell.col,
+            row=cell.row,
+            color=cell.color,
+            palette_item_id=cell.palette_item_id,
+            garden_zone_id=zone_id,
+        )
+        for cell in cells
+    ])
+    db.commit()
+
+
+def write_bulk(db, zone_id: str, cells: list[schemas.Cell]) -> None:
+    crud.insert_cells(db, cells, garden_zone_id=zone_id)
+    db.commit()
+
+
+def run(sizes: list[int], repeat: int) -> None:
+    Base.metadata.create_all(bind=engine)
+    print(f"{'cells':>9} {'path':>5} {'seconds':>9} {'rows/sec':>12}")
+    for size in sizes:
+        cells = make_cells(size)
+        for name, write in (("orm", write_orm), ("bulk", write_bulk)):
+            best = float("inf")
+            for _ in range(repeat):
+                with SessionLocal() as db:
+                    zone_id = make_zone(db)
+                    start = time.perf_counter()
+                    write(db, zone_id, cells)
+                    best = min(best, time.perf_counter() - start)
+            print(f"{size:>9} {name:>5} {best:>9.3f} {size / best:>12,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    run(args.sizes, args.repeat)
@@ -0,0 +1,164 @@
+"""
+Time the zoning algorithms, the zone crud paths and zone uploads on synthetic gardens.
+
+Run from backend/:
+    python -m benchmarks.bench_zoning [--sizes 1000 10000 100000 1000000] [--shapes blobs rings]
+                                      [--output results.jsonl]
+
+Each measurement prints as a table row and, with --output, is appended to a
+JSON lines file, one object per benchmark, shape and size, so runs can be
+compared over time. Database benchmarks run on a fresh SQLite file and are
+skipped above --db-max cells.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import uuid
+
+# The app reads its database URL at import time
+_DB_FILE = os.path.join(tempfile.mkdtemp(prefix="garden-bench-"), "bench.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_DB_FILE}")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from fastapi.testclient import TestClient  # noqa: E402
+from app import schemas  # noqa: E402  (schemas first, models imports utils -> schemas)
+from app import algorithms, coverage, crud, utils  # noqa: E402
+from app.database import SessionLocal  # noqa: E402
+from app.main import app  # noqa: E402
+from benchmarks import gardens  # noqa: E402
+
+
+def _revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(run, repeat: int, setup=None) -> list[float]:
+    """Seconds taken by ``run(setup())`` over ``repeat`` runs, setup not included."""
+    times = []
+    for _ in range(repeat):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        run(argument)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def square_outline(n: int):
+    side = max(1, int(n ** 0.5))
+    cells = [schemas.Cell(col=i % side, row=i // side) for i in range(side * side)]
+    return gardens.border_segments(cells)
+
+
+def new_zone(cells: list[schemas.Cell], name: str = "bench") -> schemas.GardenZoneCreate:
+    return schemas.GardenZoneCreate(
+        id=str(uuid.uuid4()), display_name=name, color=cells[0].color, cells=[], coverage=cells, border_path=[]
+    )
+
+
+def benchmarks(shape: str, cells: list[schemas.Cell], args):
+    """Yield ``(name, cells measured, run, setup)`` for one garden."""
+    n = len(cells)
+    yield "group_cells_into_zones", n, lambda _: algorithms.group_cells_into_zones(cells), None
+    if n <= args.bfs_max:
+        yield "group_cells_into_zones_bfs", n, lambda _: algorithms.group_cells_into_zones(cells, engine="bfs"), None
+    if shape == args.shapes[0]:
+        # Input is a single closed outline, the shape of the paint doesn't matter
+        segments = square_outline(n)
+        yield "sort_border_segments", n, lambda _: algorithms.sort_border_segments(segments), None
+
+    if n > args.db_max:
+        return
+
+    def create(_):
+        with SessionLocal() as db:
+            crud.create_zone_with_cells(db, new_zone(cells))
+
+    yield "crud.create_zone_with_cells", n, create, None
+
+    # A brush stroke painted next to the largest zone, merged in by the incremental diff
+    largest = max(algorithms.group_cells_into_zones(cells), key=lambda zone: len(zone.coverage))
+    added = gardens.stroke(largest.coverage)
+
+    def setup_update():
+        with SessionLocal() as db:
+            zone = largest.model_copy(update={"id": str(uuid.uuid4()), "display_name": "bench"})
+            return crud.create_zone_with_cells(db, schemas.GardenZoneCreate(**zone.model_dump(), cells=[])).id
+
+    def update(zone_id):
+        with SessionLocal() as db:
+            crud.update_zone(
+                db, zone_id, schemas.GardenZoneUpdate(id=zone_id, coverage_added=added), "modify"
+            )
+
+    yield "crud.update_zone", len(largest.coverage), update, setup_update
+
+    client = TestClient(app)
+    payload = {"display_name": "bench", "cells": [cell.model_dump() for cell in cells]}
+    yield "POST /api/zones", n, lambda _: client.post("/api/zones/", json=payload).raise_for_status(), None
+
+    palette = list(dict.fromkeys((cell.color, cell.palette_item_id) for cell in cells))
+    codes = {paint: code for code, paint in enumerate(palette)}
+    grid = utils.encode_grid(
+        [cell.col for cell in cells], [cell.row for cell in cells],
+        [codes[cell.color, cell.palette_item_id] for cell in cells], palette,
+    )
+    headers = {"content-type": "application/octet-stream"}
+    yield "POST /api/zones/grid", n, lambda _: client.post(
+        "/api/zones/grid?display_name=bench&view=summary", content=grid, headers=headers
+    ).raise_for_status(), None
+
+
+def run(args) -> None:
+    common = {
+        "revision": _revision(),
+        "python": platform.python_version(),
+        "database": "sqlite",
+        "coverage_storage": coverage.STORAGE,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    output = open(args.output, "a") if args.output else None
+    print(f"{'benchmark':<30} {'shape':<13} {'cells':>9} {'best s':>9} {'median s':>9}")
+    try:
+        for size in args.sizes:
+            for shape in args.shapes:
+                cells = gardens.SHAPES[shape](size)
+                for name, measured, bench, setup in benchmarks(shape, cells, args):
+                    times = measure(bench, args.repeat, setup)
+                    result = {
+                        **common,
+                        "benchmark": name,
+                        "shape": shape,
+                        "size": size,
+                        "cells": measured,
+                        "repeat": args.repeat,
+                        "best_seconds": min(times),
+                        "median_seconds": statistics.median(times),
+                    }
+                    print(f"{name:<30} {shape:<13} {measured:>9} {min(times):>9.4f} {statistics.median(times):>9.4f}")
+                    if output is not None:
+                        output.write(json.dumps(result) + "\n")
+                        output.flush()
+    finally:
+        if output is not None:
+            output.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--shapes", nargs="+", choices=list(gardens.SHAPES), default=list(gardens.SHAPES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--bfs-max", type=int, default=100_000, help="largest garden for the BFS reference engine")
+    parser.add_argument("--db-max", type=int, default=100_000, help="largest garden for the database and API benchmarks")
+    parser.add_argument("--output", help="append results to this JSON lines file")
+    run(parser.parse_args())
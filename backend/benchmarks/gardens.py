@@ -0,0 +1,93 @@
+"""
+Synthetic gardens for the benchmarks: deterministic paints of about ``n`` cells.
+"""
+import math
+import numpy as np
+from app import schemas
+
+PALETTE = (("#7cb342", "g01"), ("#8d6e63", "s02"), ("#29b6f6", "w03"))
+
+
+def _cells(cols: np.ndarray, rows: np.ndarray, codes: np.ndarray) -> list[schemas.Cell]:
+    return [
+        schemas.Cell(col=col, row=row, color=PALETTE[code][0], palette_item_id=PALETTE[code][1])
+        for col, row, code in zip(cols.tolist(), rows.tolist(), codes.tolist())
+    ]
+
+
+def _side(n: int) -> int:
+    return max(1, math.isqrt(n))
+
+
+def blobs(n: int, seed: int = 0) -> list[schemas.Cell]:
+    """Overlapping discs of random size and paint, like beds drawn with a round brush."""
+    rng = np.random.default_rng(seed)
+    side = _side(int(n * 1.6))
+    grid = np.full((side, side), -1, dtype=np.int64)
+    ys, xs = np.mgrid[0:side, 0:side]
+    while (grid >= 0).sum() < n:
+        cx, cy = rng.integers(0, side, size=2)
+        radius = rng.integers(2, max(3, side // 8))
+        grid[(xs - cx) ** 2 + (ys - cy) ** 2 <= radius ** 2] = rng.integers(0, len(PALETTE))
+    rows, cols = np.nonzero(grid >= 0)
+    keep = slice(0, n)
+    return _cells(cols[keep], rows[keep], grid[rows, cols][keep])
+
+
+def stripes(n: int, width: int = 3) -> list[schemas.Cell]:
+    """Vertical stripes of alternating paint, one long zone per stripe."""
+    side = _side(n)
+    rows, cols = np.divmod(np.arange(side * side), side)
+    return _cells(cols, rows, (cols // width) % 2)
+
+
+def checkerboard(n: int) -> list[schemas.Cell]:
+    """Alternating paint on every cell, the worst case of one zone per cell."""
+    side = _side(n)
+    rows, cols = np.divmod(np.arange(side * side), side)
+    return _cells(cols, rows, (cols + rows) % 2)
+
+
+def rings(n: int, width: int = 2) -> list[schemas.Cell]:
+    """Concentric square rings with empty gaps, so every zone but the innermost has a hole."""
+    side = _side(int(n * 2))
+    rows, cols = np.divmod(np.arange(side * side), side)
+    center = side // 2
+    distance = np.maximum(np.abs(cols - center), np.abs(rows - center))
+    painted = (distance // width) % 2 == 0
+    return _cells(cols[painted], rows[painted], np.zeros(int(painted.sum()), dtype=np.int64))
+
+
+SHAPES = {
+    "blobs": blobs,
+    "stripes": stripes,
+    "checkerboard": checkerboard,
+    "rings": rings,
+}
+
+
+def border_segments(cells: list[schemas.Cell]) -> set[tuple[tuple[int, int], tuple[int, int]]]:
+    """Unit edges on the outline of the painted cells, the input of ``sort_border_segments``."""
+    painted = {(cell.col, cell.row) for cell in cells}
+    segments = set()
+    for x, y in painted:
+        if (x, y - 1) not in painted:
+            segments.add(((x, y), (x + 1, y)))
+        if (x + 1, y) not in painted:
+            segments.add(((x + 1, y), (x + 1, y + 1)))
+        if (x, y + 1) not in painted:
+            segments.add(((x + 1, y + 1), (x, y + 1)))
+        if (x - 1, y) not in painted:
+            segments.add(((x, y + 1), (x, y)))
+    return segments
+
+
+def stroke(cells: list[schemas.Cell], size: int = 200) -> list[schemas.Cell]:
+    """A brush stroke of about ``size`` cells along the row just below the garden."""
+    bottom = max(cell.row for cell in cells) + 1
+    left = min(cell.col for cell in cells)
+    color, palette_item_id = cells[0].color, cells[0].palette_item_id
+    return [
+        schemas.Cell(col=left + i % max(1, size // 2), row=bottom + i // max(1, size // 2), color=color, palette_item_id=palette_item_id)
+        for i in range(size)
+    ]
@@ -0,0 +1,48 @@
+import os
+import tempfile
+
+# The app reads its settings at import time
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='garden-test-'), 'test.db')}")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+# The schema is migrated once below, not by every TestClient's startup
+os.environ.setdefault("MIGRATE_ON_STARTUP", "false")
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from app import schemas  # noqa: E402,F401  (schemas first, models imports utils -> schemas)
+from app.database import Base, SessionLocal, engine  # noqa: E402
+from app.cache import read_cache  # noqa: E402
+from app.main import app  # noqa: E402
+from app.migrate_schema import migrate  # noqa: E402
+
+migrate()
+
+
+@pytest.fixture
+def db():
+    """A session on an emptied database."""
+    with engine.begin() as connection:
+        for table in reversed(Base.metadata.sorted_tables):
+            connection.execute(table.delete())
+    read_cache.invalidate("items")
+    read_cache.invalidate("zones")
+    with SessionLocal() as session:
+        yield session
+
+
+@pytest.fixture
+def client(db):
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def item_payload():
+    def build(id: str, x: float = 0, y: float = 0, **fields) -> dict:
+        return {
+            "id": id, "palette_item_id": "oak", "icon": "tree", "display_name": "Oak", "category": "tree",
+            "sub_category": "deciduous", "wcvp_id": "w1", "rhs_id": "r1", "species": "robur", "genus": "Quercus",
+            "circumference": 10, "price": 1.0, "rotation": 0, "position": {"x": x, "y": y},
+            "width": 1, "height": 1, "coverage": [], **fields,
+        }
+    return build
@@ -0,0 +1,36 @@
+def update(item_payload, id, x, **fields):
+    data = item_payload(id, x=x, location="garden", **fields)
+    data.pop("coverage")
+    return {"op": "update", "kind": "item", "id": id, "operation": "create", "data": data}
+
+
+def test_update_may_repeat_the_id_in_its_data(client, item_payload):
+    operations = [
+        {"op": "create", "kind": "item", "data": item_payload("abc")},
+        update(item_payload, "abc", 5),
+    ]
+    response = client.post("/api/batch/", json={"operations": operations})
+    assert response.status_code == 200
+    assert [result["status"] for result in response.json()] == [201, 200]
+    assert response.json()[1]["data"]["position"]["x"] == 5
+    assert len(client.get("/api/items/abc/history").json()) == 1
+
+
+def test_invalid_data_fails_the_batch_at_its_operation(client, item_payload):
+    bad = update(item_payload, "abc", 5)
+    bad["data"]["position"] = "north"
+    operations = [{"op": "create", "kind": "item", "data": item_payload("abc")}, bad]
+    response = client.post("/api/batch/", json={"operations": operations})
+    assert response.status_code == 422
+    assert response.json()["detail"].startswith("Operation 1: ")
+    # The create before it was rolled back
+    assert client.get("/api/items/").json() == []
+
+
+def test_second_update_of_an_object_is_rejected(client, item_payload):
+    assert client.post("/api/items/", json=item_payload("abc")).status_code == 200
+    operations = [update(item_payload, "abc", 5), update(item_payload, "def", 1), update(item_payload, "abc", 6)]
+    response = client.post("/api/batch/", json={"operations": operations})
+    assert response.status_code == 422
+    assert response.json()["detail"].startswith("Operation 2: ")
+    assert client.get("/api/items/").json()[0]["position"]["x"] == 0
@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+from app import coverage, utils
+from benchmarks import gardens
+
+
+def as_set(cols, rows, colors, palette_item_ids):
+    return set(zip(np.asarray(cols).tolist(), np.asarray(rows).tolist(), list(colors), list(palette_item_ids)))
+
+
+def last_wins(cells):
+    return {(cell.col, cell.row): (cell.color, cell.palette_item_id) for cell in cells}
+
+
+def columns(cells):
+    return (
+        np.array([cell.col for cell in cells], dtype=np.int64),
+        np.array([cell.row for cell in cells], dtype=np.int64),
+        [cell.color for cell in cells],
+        [cell.palette_item_id for cell in cells],
+    )
+
+
+@pytest.mark.parametrize("shape", list(gardens.SHAPES))
+def test_coverage_blob_round_trip(shape):
+    cells = gardens.SHAPES[shape](2000)
+    cols, rows, colors, palette_item_ids = coverage.decode(coverage.encode(*columns(cells)))
+    assert as_set(cols, rows, colors, palette_item_ids) == as_set(*columns(cells))
+    assert list(zip(rows.tolist(), cols.tolist())) == sorted(zip(rows.tolist(), cols.tolist()))
+
+
+def test_coverage_blob_later_cells_win_and_keep_missing_paints():
+    blob = coverage.encode([0, 1, 0, -5], [0, 0, 0, 7], ["#a", None, "#b", "#a"], ["x", "y", None, "x"])
+    assert coverage.decode_cells(blob) == [
+        {"col": 0, "row": 0, "color": "#b", "palette_item_id": None},
+        {"col": 1, "row": 0, "color": None, "palette_item_id": "y"},
+        {"col": -5, "row": 7, "color": "#a", "palette_item_id": "x"},
+    ]
+
+
+def test_coverage_blob_empty():
+    assert coverage.decode_cells(coverage.encode([], [], [], [])) == []
+    with pytest.raises(ValueError):
+        coverage.decode(b"nope")
+
+
+@pytest.mark.parametrize("shape", list(gardens.SHAPES))
+def test_ranges_round_trip(shape):
+    cells = gardens.SHAPES[shape](2000)
+    encoded = utils.encode_ranges(*columns(cells))
+    decoded = utils.decode_ranges(encoded)
+    assert len(decoded) == len(last_wins(cells))
+    assert {(cell["col"], cell["row"]): (cell["color"], cell["palette_item_id"]) for cell in decoded} == last_wins(cells)
+
+
+def test_ranges_stack_rows_into_rectangles():
+    cols, rows = np.meshgrid(np.arange(1, 6), np.arange(2, 9))
+    encoded = utils.encode_ranges(cols.ravel(), rows.ravel(), ["#a"] * cols.size, [None] * cols.size)
+    assert encoded == {"palette": [["#a", None]], "ranges": [["B2:F8"]]}
+    assert utils.encode_ranges([27], [0], ["#a"], ["x"]) == {"palette": [["#a", "x"]], "ranges": [["AB0"]]}
+
+
+def test_ranges_reject_what_they_cannot_spell():
+    with pytest.raises(ValueError):
+        utils.encode_ranges([-1], [0], ["#a"], [None])
+    for bad in ({"palette": [["#a", None]], "ranges": []}, {"palette": [["#a", None]], "ranges": [["3B"]]}, {"ranges": [["A1"]]}):
+        with pytest.raises(ValueError):
+            utils.decode_ranges(bad)
+
+
+def test_expand_ranges_leaves_cell_lists_alone():
+    cells = [{"col": 0, "row": 0, "color": "#a"}]
+    assert utils.expand_ranges(cells) is cells
+    assert utils.expand_ranges({"palette": [["#a", None]], "ranges": [["A1"]]}) == [
+        {"col": 0, "row": 1, "color": "#a", "palette_item_id": None}
+    ]
+
+
+@pytest.mark.parametrize("shape", list(gardens.SHAPES))
+def test_binary_grid_round_trip(shape):
+    cells = gardens.SHAPES[shape](2000)
+    palette = list(dict.fromkeys((cell.color, cell.palette_item_id) for cell in cells))
+    codes = [palette.index((cell.color, cell.palette_item_id)) for cell in cells]
+    cols, rows, decoded_codes, decoded_palette = utils.decode_grid(
+        utils.encode_grid([cell.col for cell in cells], [cell.row for cell in cells], codes, palette)
+    )
+    decoded = {(col, row): decoded_palette[code] for col, row, code in zip(cols.tolist(), rows.tolist(), decoded_codes.tolist())}
+    assert decoded == last_wins(cells)
+
+
+def test_binary_grid_rejects_bad_bodies():
+    body = utils.encode_grid([0, 1], [0, 0], [0, 0], [("#a", None)])
+    for bad in (b"", b"GGR1", body[:-1], b"XXXX" + body[4:]):
+        with pytest.raises(ValueError):
+            utils.decode_grid(bad)
+
+
+def test_columns_merge_repeated_paints_and_check_indices():
+    cols, rows, codes, palette = utils.decode_columns(
+        {"cols": [0, 1, 2], "rows": [0, 0, 0], "color_idx": [0, 1, 2], "palette": [["#a", None], ["#a", None], ["#b", "x"]]}
+    )
+    assert codes.tolist() == [0, 0, 1]
+    assert palette == [("#a", None), ("#b", "x")]
+    for bad in (
+        {"cols": [0], "rows": [0], "color_idx": [1], "palette": [["#a", None]]},
+        {"cols": [0, 1], "rows": [0], "color_idx": [0], "palette": [["#a", None]]},
+        {"cols": ["x"], "rows": [0], "color_idx": [0], "palette": [["#a", None]]},
+        {"cols": [0], "rows": [0], "color_idx": [0], "palette": [["#a"]]},
+    ):
+        with pytest.raises(ValueError):
+            utils.decode_columns(bad)
+
+
+def test_uploads_agree_across_wire_formats(client):
+    cells = gardens.blobs(800)
+    palette = list(dict.fromkeys((cell.color, cell.palette_item_id) for cell in cells))
+    codes = [palette.index((cell.color, cell.palette_item_id)) for cell in cells]
+    cols, rows = [cell.col for cell in cells], [cell.row for cell in cells]
+
+    binary = client.post(
+        "/api/zones/grid?display_name=bed&job=false", content=utils.encode_grid(cols, rows, codes, palette),
+        headers={"content-type": "application/octet-stream"},
+    )
+    as_json = client.post(
+        "/api/zones/grid?job=false",
+        json={"display_name": "bed", "cols": cols, "rows": rows, "color_idx": codes, "palette": palette},
+    )
+    assert binary.status_code == as_json.status_code == 200
+
+    def shapes(zones):
+        return sorted((zone["border_path"], sorted((cell["col"], cell["row"]) for cell in zone["coverage"])) for zone in zones)
+
+    assert shapes(binary.json()) == shapes(as_json.json())
+
+    # The ranges form of every stored zone expands back to its cells
+    cells_form = {zone["id"]: zone["coverage"] for zone in client.get("/api/zones/").json()}
+    for zone in client.get("/api/zones/?coverage_format=ranges").json():
+        expanded = utils.expand_ranges(zone["coverage"])
+        key = lambda cell: (cell["row"], cell["col"])
+        assert sorted(expanded, key=key) == sorted(cells_form[zone["id"]], key=key)
@@ -0,0 +1,43 @@
+import pytest
+from app import metrics
+from test_query_count import count_queries
+
+
+def version_reads(statements):
+    return sum("T_versions" in statement and statement.lstrip().upper().startswith("SELECT") for statement in statements)
+
+
+@pytest.mark.parametrize("path, route", [
+    ("/api/items/?view=summary", "/api/items/"),
+    ("/api/items/abc/history", "/api/items/{id}/history"),
+    ("/api/zones/zones/abc/history", "/api/zones/zones/{id}/history"),
+])
+def test_unchanged_read_is_answered_with_304(client, item_payload, path, route):
+    assert client.post("/api/items/", json=item_payload("abc")).status_code == 200
+
+    with count_queries() as statements:
+        first = client.get(path)
+    assert first.status_code == 200
+    # Only the route reads the version when there is nothing to compare
+    assert version_reads(statements) == 1
+
+    before = metrics.REQUESTS._values.get(("GET", route, "304"), 0)
+    with count_queries() as statements:
+        again = client.get(path, headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+    assert len(statements) == version_reads(statements) == 1
+    assert metrics.REQUESTS._values[("GET", route, "304")] == before + 1
+
+
+def test_write_changes_the_etag(client, item_payload):
+    assert client.post("/api/items/", json=item_payload("abc")).status_code == 200
+    etag = client.get("/api/items/").headers["ETag"]
+    assert client.post("/api/items/", json=item_payload("def")).status_code == 200
+
+    with count_queries() as statements:
+        response = client.get("/api/items/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    assert response.headers["ETag"] != etag
+    # The route reuses the version the middleware compared
+    assert version_reads(statements) == 1
@@ -0,0 +1,20 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.api import diagnostics
+
+PATHS = ["/api/cache", "/api/jobs", "/api/feed/stats", "/api/pool", "/metrics"]
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_diagnostics_are_off_by_default(client, path):
+    assert client.get(path).status_code == 404
+
+
+def test_diagnostics_router():
+    app = FastAPI()
+    app.include_router(diagnostics.router)
+    with TestClient(app) as client:
+        for path in PATHS:
+            assert client.get(path).status_code == 200
+        assert "http_requests_total" in client.get("/metrics").text
@@ -0,0 +1,71 @@
+import asyncio
+from app import crud, schemas
+from app.feed import Hub, LocalBackend, Subscription, hub
+
+
+def upsert(id, x):
+    return {"op": "upsert", "kind": "items", "id": id, "data": {"position": {"x": x, "y": 0}}}
+
+
+def test_newest_event_of_an_object_wins():
+    async def scenario():
+        subscription = Subscription(["items"])
+        subscription.offer([upsert("a", 1), upsert("b", 1), {"op": "upsert", "kind": "zones", "id": "z", "data": {}}])
+        subscription.offer([upsert("a", 2)])
+        return await subscription.next_batch(1)
+
+    batch = asyncio.run(scenario())
+    assert [(event["id"], event["data"]["position"]["x"]) for event in batch] == [("b", 1), ("a", 2)]
+
+
+def test_slow_subscriber_is_told_to_resync():
+    async def scenario():
+        subscription = Subscription(["items"], max_pending=3)
+        subscription.offer([upsert(str(i), 0) for i in range(5)])
+        first = await subscription.next_batch(1)
+        subscription.offer([upsert("late", 0)])
+        return first, await subscription.next_batch(1), await subscription.next_batch(0.01)
+
+    resync, after, idle = asyncio.run(scenario())
+    assert [event["op"] for event in resync] == ["resync"]
+    assert [event["id"] for event in after] == ["late"]
+    assert idle is None
+
+
+def test_hub_fans_out_from_other_threads():
+    local = Hub(LocalBackend())
+
+    async def scenario():
+        items, zones = local.subscribe(["items"]), local.subscribe(["zones"])
+        await asyncio.to_thread(local.publish, [upsert("a", 1)])
+        batch = await items.next_batch(1)
+        assert await zones.next_batch(0.05) is None
+        local.unsubscribe(items)
+        local.unsubscribe(zones)
+        return batch
+
+    assert [event["id"] for event in asyncio.run(scenario())] == ["a"]
+    assert local.stats()["published"] == 1
+
+
+def test_drag_updates_reach_subscribers_coalesced(db, item_payload):
+    def drag():
+        crud.create_item(db, schemas.GardenItemCreate(**item_payload("abc")))
+        for x in range(1, 11):
+            updates = schemas.GardenItemUpdate(**{**item_payload("abc", x=x * 10), "location": "garden"})
+            crud.update_item(db, "abc", updates, "modify")
+
+    async def scenario():
+        subscription = hub.subscribe(["items"])
+        try:
+            await asyncio.to_thread(drag)
+            # Every commit was delivered before the thread returned
+            await asyncio.sleep(0)
+            return await subscription.next_batch(1)
+        finally:
+            hub.unsubscribe(subscription)
+
+    batch = asyncio.run(scenario())
+    assert len(batch) == 1
+    assert batch[0]["op"] == "upsert" and batch[0]["id"] == "abc"
+    assert batch[0]["data"]["position"]["x"] == 100
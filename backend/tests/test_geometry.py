@@ -0,0 +1,160 @@
+import uuid
+import numpy as np
+import pytest
+from sqlalchemy import event
+from app import algorithms, crud, raster, schemas
+from app.database import engine
+from benchmarks import gardens
+
+# A ring of lawn around an empty pond square
+POND = [(x, y) for x in range(3) for y in range(3) if (x, y) != (1, 1)]
+# The pond ring without its top-left corner: the outline touches itself at (1, 1)
+PINCHED = [cell for cell in POND if cell != (0, 0)]
+
+
+def cells_at(positions, color="#7cb342", palette_item_id="g01"):
+    return [schemas.Cell(col=col, row=row, color=color, palette_item_id=palette_item_id) for col, row in positions]
+
+
+def assert_outline(zone):
+    # Closed rings of unit steps, enclosing exactly the zone's squares
+    rings = [zone.border_path, *(zone.border_holes or [])]
+    for ring in rings:
+        for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+            assert abs(x2 - x1) + abs(y2 - y1) == 1
+    assert raster.ring_area(zone.border_path) > 0
+    assert all(raster.ring_area(hole) < 0 for hole in zone.border_holes or [])
+    assert sum(raster.ring_area(ring) for ring in rings) == len(zone.coverage)
+
+
+def canonical(ring):
+    # The same ring may start at any of its vertices
+    ring = [tuple(point) for point in ring]
+    start = min(range(len(ring)), key=lambda i: (ring[i][1], ring[i][0]))
+    return ring[start:] + ring[:start]
+
+
+def positions(zone):
+    return sorted((int(cell.col), int(cell.row)) for cell in zone.coverage)
+
+
+def test_hole_is_traced():
+    [zone] = algorithms.group_cells_into_zones(cells_at(POND))
+    assert zone.border_path == [(0, 0), (1, 0), (2, 0), (3, 0), (3, 1), (3, 2), (3, 3), (2, 3), (1, 3), (0, 3), (0, 2), (0, 1)]
+    assert zone.border_holes == [[(1, 2), (2, 2), (2, 1), (1, 1)]]
+
+
+def test_pinched_outline():
+    [zone] = algorithms.group_cells_into_zones(cells_at(PINCHED))
+    assert len(zone.coverage) == 7
+    assert_outline(zone)
+
+
+@pytest.mark.parametrize("shape", [POND, PINCHED])
+def test_far_apart_cells(shape):
+    # Too sparse for one grid, each bed is traced on its own
+    near = algorithms.group_cells_into_zones(cells_at(shape))
+    zones = algorithms.group_cells_into_zones(cells_at([*shape, (5000, 5000), (-10**6, 10**6)]))
+    assert len(zones) == 3
+    assert (zones[0].border_path, zones[0].border_holes) == (near[0].border_path, near[0].border_holes)
+    assert zones[1].border_path == [(5000, 5000), (5001, 5000), (5001, 5001), (5000, 5001)]
+    for zone in zones:
+        assert_outline(zone)
+
+
+def test_thin_shape_spanning_a_huge_box():
+    # A staircase whose bounding box is too large to rasterize
+    steps = [(i, i) for i in range(3000)] + [(i + 1, i) for i in range(3000)]
+    [zone] = algorithms.group_cells_into_zones(cells_at(steps))
+    assert zone.border_holes == []
+    assert_outline(zone)
+
+
+@pytest.mark.parametrize("shape", list(gardens.SHAPES))
+def test_sparse_path_matches_dense_grid(shape):
+    cells = gardens.SHAPES[shape](2000)
+    cols = np.array([cell.col for cell in cells])
+    rows = np.array([cell.row for cell in cells])
+    codes, _ = raster.intern_attributes([cell.color for cell in cells], [cell.palette_item_id for cell in cells])
+    dense = algorithms.group_columns_into_zones(cols, rows, codes)
+    sparse = algorithms._group_sparse_columns(cols, rows, codes)
+    assert len(dense) == len(sparse)
+    for (dense_members, dense_outer, dense_holes), (sparse_members, sparse_outer, sparse_holes) in zip(dense, sparse):
+        assert np.array_equal(dense_members, sparse_members)
+        assert dense_outer == sparse_outer
+        assert sorted(dense_holes) == sorted(sparse_holes)
+
+
+@pytest.mark.parametrize("shape", list(gardens.SHAPES))
+def test_raster_engine_groups_like_bfs(shape):
+    cells = gardens.SHAPES[shape](1500)
+    raster_zones = algorithms.group_cells_into_zones(cells)
+    bfs_zones = algorithms.group_cells_into_zones(cells, engine="bfs")
+    assert [positions(zone) for zone in raster_zones] == [positions(zone) for zone in bfs_zones]
+    for zone in raster_zones:
+        assert_outline(zone)
+
+
+def test_bfs_reference_ends_on_pinched_outline():
+    [zone] = algorithms.group_cells_into_zones(cells_at(PINCHED), engine="bfs")
+    assert len(zone.coverage) == 7
+
+
+@pytest.mark.parametrize("added, removed", [
+    # Grow the bed by a strip
+    ([(x, 4) for x in range(5)], []),
+    # Dig a pond in the middle
+    ([], [(2, 2)]),
+    # Cut the bed in two, the right piece becomes a zone of its own
+    ([], [(2, y) for y in range(4)]),
+    # Join a far stroke through a pinch
+    ([(5, 5), (4, 4)], [(0, 0)]),
+])
+def test_incremental_edit_matches_full_retrace(db, added, removed):
+    bed = [(x, y) for x in range(4) for y in range(4)]
+    [zone] = algorithms.group_cells_into_zones(cells_at(bed))
+    zone_id = str(uuid.uuid4())
+    crud.create_zone_with_cells(db, schemas.GardenZoneCreate(**zone.model_dump(exclude={"id", "display_name"}), id=zone_id, display_name="bed", cells=[]))
+
+    updates = schemas.GardenZoneUpdate(id=zone_id, coverage_added=cells_at(added), coverage_removed=cells_at(removed))
+    crud.update_zone(db, zone_id, updates, "modify")
+
+    painted = (set(bed) | set(added)) - set(removed)
+    expected = algorithms.group_cells_into_zones(cells_at(sorted(painted)))
+    stored = crud.get_zones(db)
+    assert len(stored) == len(expected)
+    by_cells = {tuple(sorted((cell["col"], cell["row"]) for cell in zone.coverage_cells)): zone for zone in stored}
+    for zone in expected:
+        saved = by_cells[tuple(positions(zone))]
+        assert canonical(saved.border_path) == canonical(zone.border_path)
+        assert sorted(map(canonical, saved.border_holes or [])) == sorted(map(canonical, zone.border_holes))
+
+
+def test_stroke_looks_up_neighbours_by_position(db):
+    # A bed far from the stroke, and the zone being painted
+    crud.create_zones_from_columns(db, "far", np.arange(0, 400, 2), np.full(200, 50), np.zeros(200, dtype=np.int64), [("#7cb342", "g01")])
+    [zone] = algorithms.group_cells_into_zones(cells_at([(0, 0)]))
+    zone_id = str(uuid.uuid4())
+    crud.create_zone_with_cells(db, schemas.GardenZoneCreate(**zone.model_dump(exclude={"id", "display_name"}), id=zone_id, display_name="bed", cells=[]))
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if "garden_zone_id !=" in statement:
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        # A diagonal stroke whose bounding box covers the far bed
+        stroke = cells_at([(i, i) for i in range(1, 60)] + [(i + 1, i) for i in range(0, 60)])
+        crud.update_zone(db, zone_id, schemas.GardenZoneUpdate(id=zone_id, coverage_added=stroke, coverage_removed=[]), "modify")
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    # The stroke runs over the far bed's cells at (50, 50) and (52, 50), those two join the zone
+    assert len(crud.get_zones(db, view="summary")) == 199
+    assert statements
+    with engine.connect() as connection:
+        for statement, parameters in statements:
+            plan = " ".join(row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters))
+            assert "ix_T_cells_position" in plan and "SCAN T_cells" not in plan, plan
@@ -0,0 +1,47 @@
+import pytest
+from app import history, models
+from test_query_count import count_queries
+
+EDITS = history.KEYFRAME_INTERVAL + 5
+
+# Recording history must not add to the session in the middle of its flush
+pytestmark = pytest.mark.filterwarnings("error::sqlalchemy.exc.SAWarning")
+
+
+def edit(client, item_payload, i):
+    coverage = [{"col": col, "row": 0, "color": "#7cb342", "palette_item_id": "g01"} for col in range(i % 4 + 1)]
+    payload = item_payload("abc", x=i, coverage=coverage)
+    payload["location"] = "garden"
+    response = client.put("/api/items/abc", json={"updates": payload, "operation": "create"})
+    assert response.status_code == 200
+
+
+def recorded(client):
+    entries = client.get("/api/items/abc/history").json()
+    return [(entry["position"]["x"], sorted(cell["col"] for cell in entry["coverage"])) for entry in entries[::-1]]
+
+
+@pytest.mark.parametrize("cached", [True, False])
+def test_history_replays_every_recorded_edit(client, db, item_payload, cached):
+    assert client.post("/api/items/", json=item_payload("abc")).status_code == 200
+    for i in range(EDITS):
+        if not cached:
+            # As if another process wrote the previous entry
+            models.item_history._states.clear()
+        edit(client, item_payload, i)
+
+    assert recorded(client) == [(i, list(range(i % 4 + 1))) for i in range(EDITS)]
+    keyframes = db.query(models.GardenItemHistory).filter(models.GardenItemHistory.changes.is_(None)).all()
+    assert len(keyframes) == 2
+    assert all(keyframe.coverage_blob is not None for keyframe in keyframes)
+    assert db.query(models.Cell).filter(models.Cell.garden_item_history_id.is_not(None)).count() == 0
+
+
+def test_edit_diffs_against_the_remembered_state(client, item_payload):
+    assert client.post("/api/items/", json=item_payload("abc")).status_code == 200
+    edit(client, item_payload, 0)
+    with count_queries() as statements:
+        edit(client, item_payload, 1)
+    # No entry of the chain is read back to diff against
+    assert not any("added_blob" in statement and statement.lstrip().upper().startswith("SELECT") for statement in statements)
+    assert recorded(client) == [(0, [0]), (1, [0, 1])]
@@ -0,0 +1,12 @@
+import pytest
+
+
+def test_update_of_unknown_item(client, item_payload):
+    updates = {**item_payload("nope"), "location": "garden"}
+    response = client.put("/api/items/nope", json={"updates": updates, "operation": "modify"})
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("path", ["/api/items/nope", "/api/zones/nope"])
+def test_delete_of_unknown_object(client, path):
+    assert client.delete(path).status_code == 404
@@ -0,0 +1,47 @@
+import pytest
+from app import crud, schemas
+
+ROWS = 450
+
+
+@pytest.fixture
+def many_items(db, item_payload):
+    # Written in one go, most of them share their second
+    for i in range(ROWS):
+        crud.create_item(db, schemas.GardenItemCreate(**item_payload(f"item-{i:04d}", x=i)), commit=False)
+    db.commit()
+
+
+def page_through(client, path, limit):
+    ids, cursor, pages = [], None, 0
+    while True:
+        response = client.get(path, params={"limit": limit, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        ids += [row["id"] for row in response.json()]
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return ids, pages
+
+
+@pytest.mark.parametrize("limit", [1, 7, 150, 1000])
+def test_pages_cover_rows_of_the_same_second(client, many_items, limit):
+    ids, pages = page_through(client, "/api/items/", limit)
+    assert ids == sorted(ids) and len(ids) == ROWS
+    assert pages == ROWS // limit + 1
+
+
+def test_pages_cover_zones_of_the_same_second(client):
+    cols = [col for i in range(60) for col in (i * 3, i * 3 + 1)]
+    response = client.post(
+        "/api/zones/grid?job=false",
+        json={"display_name": "bed", "cols": cols, "rows": [0] * len(cols), "color_idx": [0] * len(cols), "palette": [["#7cb342", "g01"]]},
+    )
+    assert response.status_code == 200
+    ids, _ = page_through(client, "/api/zones/?view=summary", 8)
+    assert sorted(ids) == sorted(zone["id"] for zone in response.json())
+
+
+def test_ndjson_streams_every_row(client, many_items):
+    response = client.get("/api/items/?format=ndjson&view=summary")
+    assert len(response.text.splitlines()) == ROWS
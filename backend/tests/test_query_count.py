@@ -0,0 +1,67 @@
+from contextlib import contextmanager
+import pytest
+from sqlalchemy import event
+from app.cache import read_cache
+from app.database import engine
+
+N = 25
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def queries_for(client, kind, path):
+    # A cached body would hide the queries behind it
+    read_cache.invalidate(kind)
+    with count_queries() as statements:
+        response = client.get(path)
+    assert response.status_code == 200
+    return response.json(), len(statements)
+
+
+def add_items(client, item_payload, start, count):
+    for i in range(start, start + count):
+        coverage = [{"col": i, "row": row, "color": "#7cb342", "palette_item_id": "g01"} for row in range(3)]
+        response = client.post("/api/items/", json=item_payload(f"item-{i}", x=i * 40, coverage=coverage))
+        assert response.status_code == 200
+
+
+def add_zones(client, start, count):
+    # Beds three columns apart never touch, each becomes a zone
+    cols = [col for i in range(start, start + count) for col in (i * 3, i * 3 + 1)]
+    response = client.post(
+        "/api/zones/grid?job=false",
+        json={"display_name": "bed", "cols": cols, "rows": [0] * len(cols), "color_idx": [0] * len(cols), "palette": [["#7cb342", "g01"]]},
+    )
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("path", ["/api/items/", "/api/items/?view=summary", "/api/items/?coverage_format=ranges", "/api/items/?limit=100"])
+def test_item_list_queries_do_not_grow_with_rows(client, item_payload, path):
+    add_items(client, item_payload, 0, 1)
+    one, one_queries = queries_for(client, "items", path)
+    add_items(client, item_payload, 1, N - 1)
+    many, many_queries = queries_for(client, "items", path)
+    assert (len(one), len(many)) == (1, N)
+    assert many_queries == one_queries
+
+
+@pytest.mark.parametrize("path", ["/api/zones/", "/api/zones/?view=summary", "/api/zones/?coverage_format=ranges", "/api/zones/?limit=100"])
+def test_zone_list_queries_do_not_grow_with_rows(client, path):
+    add_zones(client, 0, 1)
+    one, one_queries = queries_for(client, "zones", path)
+    add_zones(client, 1, N - 1)
+    many, many_queries = queries_for(client, "zones", path)
+    assert (len(one), len(many)) == (1, N)
+    assert many_queries == one_queries
@@ -0,0 +1,62 @@
+import time
+import pytest
+from app.cache import read_cache
+
+
+def ids(response):
+    assert response.status_code == 200
+    return sorted(row["id"] for row in response.json())
+
+
+def cached_twice(client, path):
+    """The list at ``path``, read once more so the second read comes from the cache."""
+    first = ids(client.get(path))
+    hits = read_cache.stats()["hits"]
+    assert ids(client.get(path)) == first
+    assert read_cache.stats()["hits"] == hits + 1
+    return first
+
+
+@pytest.mark.parametrize("path", ["/api/items/", "/api/items/?view=summary"])
+def test_item_write_replaces_the_cached_list(client, item_payload, path):
+    assert client.post("/api/items/", json=item_payload("abc")).status_code == 200
+    assert cached_twice(client, path) == ["abc"]
+
+    assert client.post("/api/items/", json=item_payload("def")).status_code == 200
+    assert ids(client.get(path)) == ["abc", "def"]
+    assert client.delete("/api/items/abc").status_code == 200
+    assert ids(client.get(path)) == ["def"]
+
+
+def test_batch_write_replaces_the_cached_lists(client, item_payload):
+    assert client.post("/api/items/", json=item_payload("abc")).status_code == 200
+    assert cached_twice(client, "/api/items/") == ["abc"]
+    assert cached_twice(client, "/api/zones/") == []
+
+    cells = [{"col": col, "row": 0, "color": "#7cb342", "palette_item_id": "g01"} for col in range(3)]
+    operations = [
+        {"op": "delete", "kind": "item", "id": "abc"},
+        {"op": "create", "kind": "item", "data": item_payload("def")},
+        {"op": "create", "kind": "zone", "data": {"display_name": "bed", "cells": cells}},
+    ]
+    response = client.post("/api/batch/", json={"operations": operations})
+    assert response.status_code == 200, response.text
+    assert ids(client.get("/api/items/")) == ["def"]
+    assert [zone["display_name"] for zone in client.get("/api/zones/").json()] == ["bed"]
+
+
+def test_zone_job_replaces_the_cached_list(client):
+    assert cached_twice(client, "/api/zones/") == []
+
+    response = client.post(
+        "/api/zones/grid?job=true",
+        json={"display_name": "bed", "cols": [0, 1, 5], "rows": [0, 0, 0], "color_idx": [0, 0, 0], "palette": [["#7cb342", "g01"]]},
+    )
+    assert response.status_code == 202
+    deadline = time.monotonic() + 60
+    while (job := client.get(response.headers["Location"]).json())["status"] in ("queued", "running"):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert job["status"] == "done", job["error"]
+    assert ids(client.get("/api/zones/")) == sorted(job["zone_ids"])
+    assert len(job["zone_ids"]) == 2
@@ -0,0 +1,55 @@
+import time
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from app import database, main
+from app.cache import read_cache
+from app.database import WROTE_AT_HEADER, Base
+
+
+@pytest.fixture
+def replicas(monkeypatch, tmp_path):
+    """Two SQLite replicas that never receive the primary's writes, with the statements each ran."""
+    urls = [f"sqlite:///{tmp_path / f'replica-{i}.db'}" for i in range(2)]
+    engines = [create_engine(url, future=True) for url in urls]
+    statements = [[] for _ in engines]
+    for replica, ran in zip(engines, statements):
+        Base.metadata.create_all(bind=replica)
+        event.listen(replica, "before_cursor_execute", lambda *args, ran=ran: ran.append(args[2]))
+    monkeypatch.setattr(database, "replica_engines", engines)
+    monkeypatch.setattr(main, "replica_engines", engines)
+    monkeypatch.setattr(database, "ReplicaSessions", [
+        sessionmaker(bind=replica, autoflush=False, autocommit=False, future=True) for replica in engines
+    ])
+    yield statements
+    for replica in engines:
+        replica.dispose()
+
+
+def test_read_after_write_goes_to_the_primary(client, item_payload, replicas):
+    response = client.post("/api/items/", json=item_payload("abc"))
+    assert response.status_code == 200
+    assert float(response.headers[WROTE_AT_HEADER]) <= time.time()
+
+    # The client sends the cookie back
+    assert [item["id"] for item in client.get("/api/items/").json()] == ["abc"]
+    # Clients without cookies echo the header
+    client.cookies.clear()
+    read_cache.invalidate("items")
+    headers = {WROTE_AT_HEADER: response.headers[WROTE_AT_HEADER]}
+    assert [item["id"] for item in client.get("/api/items/", headers=headers).json()] == ["abc"]
+    assert replicas == [[], []]
+
+
+def test_read_without_a_recent_write_goes_to_a_replica(client, item_payload, replicas):
+    assert client.post("/api/items/", json=item_payload("abc")).status_code == 200
+    client.cookies.clear()
+
+    # The replicas haven't seen the write, and take turns
+    assert client.get("/api/items/").json() == []
+    assert client.get("/api/zones/").json() == []
+    assert all(replicas)
+
+    # A marker older than the read-your-writes window doesn't pin the primary
+    stale = {WROTE_AT_HEADER: f"{time.time() - database.READ_YOUR_WRITES_SECONDS - 1:.3f}"}
+    assert client.get("/api/items/", headers=stale).json() == []
@@ -0,0 +1,13 @@
+from fastapi.testclient import TestClient
+from sqlalchemy import inspect
+from app import main
+from app.database import engine
+
+
+def test_startup_migrates_the_schema(db, monkeypatch):
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP INDEX ix_T_cells_position")
+    monkeypatch.setattr(main, "MIGRATE_ON_STARTUP", True)
+    with TestClient(main.app):
+        pass
+    assert "ix_T_cells_position" in {index["name"] for index in inspect(engine).get_indexes("T_cells")}
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+import pytest
+from app import crud, models
+
+
+@pytest.fixture
+def no_overlap(monkeypatch):
+    # Only what changed strictly at or after the token comes back
+    monkeypatch.setattr(crud, "SYNC_OVERLAP", timedelta(0))
+
+
+def sync(client, token=None, status=200):
+    response = client.get("/api/sync/?view=summary", params={"since": token} if token else {})
+    assert response.status_code == status
+    return response.json()
+
+
+def ids(rows):
+    return sorted(row["id"] for row in rows)
+
+
+def test_incremental_window_and_tombstones(client, item_payload, no_overlap):
+    for id in ("a", "b"):
+        assert client.post("/api/items/", json=item_payload(id)).status_code == 200
+    full = sync(client)
+    assert ids(full["items"]) == ["a", "b"]
+    assert full["deleted"] == {"items": [], "zones": []}
+
+    moved = {**item_payload("a", x=40), "location": "garden"}
+    assert client.put("/api/items/a", json={"updates": moved, "operation": "modify"}).status_code == 200
+    assert client.delete("/api/items/b").status_code == 200
+    assert client.post("/api/items/", json=item_payload("c")).status_code == 200
+
+    delta = sync(client, full["token"])
+    assert ids(delta["items"]) == ["a", "c"]
+    assert delta["deleted"]["items"] == ["b"]
+
+    # The newest change is sent again, nothing older
+    again = sync(client, delta["token"])
+    assert ids(again["items"]) == ["c"] and again["deleted"]["items"] == []
+
+
+def test_token_is_the_newest_stamp_read(client, item_payload, db, no_overlap):
+    for id in ("a", "b"):
+        assert client.post("/api/items/", json=item_payload(id)).status_code == 200
+    token = sync(client)["token"]
+    assert token == db.get(models.GardenItem, "b").last_modified.isoformat()
+
+    assert client.delete("/api/items/a").status_code == 200
+    token = sync(client, token)["token"]
+    assert token == db.query(models.Tombstone).one().deleted_at.isoformat()
+
+
+def test_empty_garden_has_a_usable_token(client):
+    token = sync(client)["token"]
+    assert sync(client, token)["items"] == []
+
+
+def test_token_expires_only_when_tombstones_after_it_were_pruned(client, item_payload, monkeypatch):
+    for id in ("a", "b"):
+        assert client.post("/api/items/", json=item_payload(id)).status_code == 200
+    old = sync(client)["token"]
+    # A quiet garden: an old token keeps working
+    assert sync(client, old)["items"]
+
+    monkeypatch.setattr(crud, "TOMBSTONE_RETENTION", timedelta(0))
+    monkeypatch.setattr(crud, "SYNC_OVERLAP", timedelta(0))
+    assert client.delete("/api/items/a").status_code == 200
+    assert client.delete("/api/items/b").status_code == 200
+    # The first tombstone was pruned by the second delete
+    sync(client, old, status=410)
+    reloaded = sync(client)
+    assert sync(client, reloaded["token"])["items"] == []
@@ -0,0 +1,38 @@
+def listed(client, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    return sorted(row["id"] for row in response.json())
+
+
+def test_bbox_and_zoom_filter_the_items(client, item_payload):
+    items = [
+        item_payload("inside", x=100, y=100, width=40, height=40),
+        # Overlaps the viewport's right edge
+        item_payload("edge", x=190, y=150, width=40, height=40),
+        item_payload("outside", x=500, y=500, width=40, height=40),
+        # Only 2 map pixels wide and high
+        item_payload("tiny", x=120, y=120, width=2, height=2),
+    ]
+    for item in items:
+        assert client.post("/api/items/", json=item).status_code == 200
+
+    assert listed(client, "/api/items/?bbox=0,0,200,200") == ["edge", "inside", "tiny"]
+    # At 1 screen pixel per 4 map pixels the tiny one is half a pixel wide
+    assert listed(client, "/api/items/?bbox=0,0,200,200&zoom=0.25") == ["edge", "inside"]
+    assert listed(client, "/api/items/?bbox=0,0,200,200&zoom=1") == ["edge", "inside", "tiny"]
+    assert listed(client, "/api/items/?zoom=0.25") == ["edge", "inside", "outside"]
+    assert client.get("/api/items/?bbox=0,0,200").status_code == 400
+
+
+def test_bbox_filters_the_zones(client):
+    # Two beds of cells 20 map pixels wide, around columns 0-1 and 30-31
+    cols = [0, 1, 30, 31]
+    response = client.post(
+        "/api/zones/grid?job=false",
+        json={"display_name": "bed", "cols": cols, "rows": [0] * 4, "color_idx": [0] * 4, "palette": [["#7cb342", "g01"]]},
+    )
+    assert response.status_code == 200
+    assert len(client.get("/api/zones/").json()) == 2
+    assert len(client.get("/api/zones/?bbox=0,0,100,100").json()) == 1
+    assert len(client.get("/api/zones/?bbox=1000,1000,2000,2000").json()) == 0
+
@@ -0,0 +1,13 @@
+def test_every_zone_of_a_paint_is_saved(client):
+    # Two beds and a stroke of another paint touching the first
+    cells = [{"col": col, "row": row, "color": "#7cb342", "palette_item_id": "g01"} for col in range(3) for row in range(2)]
+    cells += [{"col": col, "row": 9, "color": "#7cb342", "palette_item_id": "g01"} for col in range(4)]
+    cells += [{"col": 3, "row": row, "color": "#795548", "palette_item_id": "m01"} for row in range(2)]
+    response = client.post("/api/zones/?job=false", json={"display_name": "bed", "cells": cells})
+    assert response.status_code == 200
+    created = response.json()
+    assert sorted(len(zone["coverage"]) for zone in created) == [2, 4, 6]
+    assert all(zone["display_name"] == "bed" for zone in created)
+
+    stored = client.get("/api/zones/").json()
+    assert sorted(zone["id"] for zone in stored) == sorted(zone["id"] for zone in created)